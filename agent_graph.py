@@ -4,14 +4,32 @@ Notion 知识管理 Agent 图定义
 本模块使用 LangGraph 构建一个自主的知识管理 Agent，负责维护高质量的 Notion 数据库。
 Agent 会自动检查重复内容，智能合并新旧信息，并支持 Markdown 格式化。
 """
+import os
 import uuid
 import re
-from langgraph.prebuilt import create_react_agent
-from langgraph.checkpoint.memory import MemorySaver
-from langchain_core.messages import SystemMessage, ToolMessage, AIMessage
+import time
+import json
+import queue
+import asyncio
+import threading
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Iterator
+from langgraph.prebuilt import create_react_agent, ToolNode
+from langchain_core.messages import SystemMessage, ToolMessage, AIMessage, HumanMessage
+from langchain_core.messages.utils import count_tokens_approximately, trim_messages
 
 from llm_core import get_llm
-from tools import tools_list
+from tools import (
+    tools_list, convert_text_to_audio, search_knowledge_base,
+    run_tool_with_timeout, arun_tool_with_timeout, TOOL_MAX_CONCURRENCY,
+)
+import router
+import doc_index
+from checkpoint_store import create_checkpointer, trim_thread_messages
+from tracing import span
+from prefetch import prefetcher
+from text_store import TextLike, has_text, read_text, text_preview, text_sha256
 
 # ==========================================
 # 系统提示词配置
@@ -36,14 +54,15 @@ You are an autonomous Multi-modal Knowledge Manager Agent. Your goal is to maint
     - **Step 1**: Identify the target language ('es' for Spanish, 'en' for English). If uncertain/mixed, default to 'es' (Spanish).
     - **Step 2**: Call `convert_text_to_audio(text=..., language=...)` immediately.
     - **Step 3**: STOP. Do not perform vector search unless the user explicitly asks to "find notes AND convert them".
+    - **Saved notes → audio**: If the user wants to LISTEN to existing notes (a topic, a domain, or page IDs), call `generate_audiobook(query=... / domain=... / page_ids=...)`. Never copy note text into a tool call yourself.
 
     🔵 **PATH B: IF TYPE = KNOWLEDGE** (SEARCH REQUIRED):
     - **Step 1**: Check for `FORCE_CREATE` intent (explicit instructions to "create new", "don't merge").
-    - **Step 2**: **Always** use `search_knowledge_base` to retrieve context.
+    - **Step 2**: **Always** use `search_knowledge_base` ONCE to retrieve context. It returns ranked candidates plus a `suggestion`; do not re-search with reworded queries unless it found nothing relevant.
     - **Step 3**: DECISION LOGIC:
         - **CASE A (Intent = FORCE_CREATE)**: IGNORE matches. Use `manage_notion_note(action="create")`.
-        - **CASE B (Found similar + AUTO_DETECT)**: Merge content. Use `manage_notion_note(action="overwrite", target_page_id=...)`.
-        - **CASE C (No match)**: Use `manage_notion_note(action="create")`.
+        - **CASE B (suggestion = "overwrite" + AUTO_DETECT)**: Merge with the best match's `existing_content`. Use `manage_notion_note(action="overwrite", target_page_id=<target_page_id>)`.
+        - **CASE C (suggestion = "create")**: Use `manage_notion_note(action="create")`.
 
 3. **RESPONSE**:
     - For Audio: You MUST include the file path in your response. 
@@ -51,57 +70,316 @@ You are an autonomous Multi-modal Knowledge Manager Agent. Your goal is to maint
     - For Notes: Reply with "✅ Operation Complete" and the Notion Link.
     - DO NOT ask for confirmation.
 
+**Uploaded Documents**:
+- Small files are attached inline. Large files only show a preview; use `search_uploaded_document(query=...)` to fetch the passages you need (several targeted queries are better than one vague query).
+
 **Formatting Rules (CRITICAL)**:
 - **Markdown is fully supported**: Use `**bold**`, `[links](url)`, tables, etc.
 - **Callouts**: Use `> 💡` for tips, `> ⚠️` for warnings.
 - **Language**: When generating audio, ensure the text sent to the tool is clean text (the tool handles markdown stripping, but you should provide the core content).
 """
 
+# ==========================================
+# 上下文管理 (Context Compaction)
+# ==========================================
+# - SYSTEM_PROMPT 通过 create_react_agent(prompt=...) 在调用模型时注入，不再写入会话历史
+# - 附件按内容哈希只附加一次，之后的轮次复用历史中的同一条消息
+# - 大附件只附加预览，正文通过 search_uploaded_document 按需检索
+# - 每次调用模型前按 token 预算裁剪旧对话，附件消息始终保留
+
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "24000"))
+INLINE_ATTACHMENT_CHARS = 8000   # 小于该长度的附件直接内联，否则建立检索索引
+ATTACHMENT_PREVIEW_CHARS = 800
+ATTACHMENT_KEY = "attachment_hash"
+SYSTEM_PROMPT_TOKENS = count_tokens_approximately([SystemMessage(content=SYSTEM_PROMPT)])
+
+# thread_id -> 本轮每次模型调用的 prompt token 数 (近似值)
+_prompt_token_log = defaultdict(list)
+
+
+def _find_attachment(messages, doc_hash: str = None):
+    """返回历史中最新的附件消息 (可指定哈希)"""
+    for m in reversed(messages):
+        attached = m.additional_kwargs.get(ATTACHMENT_KEY) if hasattr(m, "additional_kwargs") else None
+        if attached and (doc_hash is None or attached == doc_hash):
+            return m
+    return None
+
+
+def _prepare_attachment(file_content: TextLike, config: dict):
+    """
+    小文件：整段内联；大文件：建立检索索引并只附加预览。
+    file_content 可以是 str 或 TextHandle (大上传只按需读取切片)。
+    返回需要追加到本轮的附件消息；历史中已有同一文件时返回 None。
+    """
+    thread_id = config["configurable"]["thread_id"]
+    doc_hash = text_sha256(file_content)[:16]
+    total_chars = len(file_content)
+    large = total_chars > INLINE_ATTACHMENT_CHARS
+
+    if large:
+        # 每轮都重新绑定 (进程重启后索引按哈希重建)
+        index = doc_index.index_document(file_content)
+        doc_index.bind_thread(thread_id, index)
+
+    state = graph.get_state(config)
+    history = (state.values or {}).get("messages", []) if state else []
+    if _find_attachment(history, doc_hash) is not None:
+        return None
+
+    if large:
+        preview = text_preview(file_content, ATTACHMENT_PREVIEW_CHARS)
+        content = (
+            f"--- 📎 附加文件 (共 {total_chars} 字符, {len(index.chunks)} 段, 仅显示开头) ---\n"
+            f"{preview}\n...\n"
+            "[Use `search_uploaded_document` to read the relevant passages of this file.]"
+        )
+    else:
+        content = f"--- 📎 附加文件内容 ---\n{read_text(file_content)}"
+
+    print(f"📎 Attaching document {doc_hash} ({'indexed' if large else 'inline'}, {total_chars} chars)")
+    return HumanMessage(content=content, additional_kwargs={ATTACHMENT_KEY: doc_hash})
+
+
+def compact_context(state, config):
+    """
+    pre_model_hook：构造送入 LLM 的消息列表 (不修改持久化的历史)
+    """
+    # 旧版本每轮都会写入 SystemMessage，这里统一丢弃，由 prompt 注入
+    messages = [m for m in state["messages"] if not isinstance(m, SystemMessage)]
+    attachment = _find_attachment(messages)
+
+    budget = CONTEXT_TOKEN_BUDGET - SYSTEM_PROMPT_TOKENS
+    if attachment is not None:
+        budget -= count_tokens_approximately([attachment])
+
+    candidates = [m for m in messages if m is not attachment]
+    trimmed = trim_messages(
+        candidates,
+        max_tokens=max(budget, 1),
+        strategy="last",
+        token_counter=count_tokens_approximately,
+        start_on="human",
+        end_on=("human", "tool"),
+    )
+    if not trimmed and candidates:
+        # 单条消息就超出预算时，至少保留最后一轮的提问
+        last_human = max(i for i, m in enumerate(candidates) if isinstance(m, HumanMessage))
+        trimmed = candidates[last_human:]
+
+    keep_ids = {m.id for m in trimmed}
+    if attachment is not None:
+        keep_ids.add(attachment.id)
+    llm_messages = [m for m in messages if m.id in keep_ids]
+
+    prompt_tokens = SYSTEM_PROMPT_TOKENS + count_tokens_approximately(llm_messages)
+    thread_id = config.get("configurable", {}).get("thread_id")
+    _prompt_token_log[thread_id].append(prompt_tokens)
+    dropped = len(messages) - len(llm_messages)
+    print(f"🧮 Prompt ≈ {prompt_tokens} tokens ({len(llm_messages)} msgs, {dropped} trimmed)")
+
+    return {"llm_input_messages": llm_messages}
+
+
 # ==========================================
 # Agent 图初始化
 
 llm = get_llm()
-memory = MemorySaver()
+# 持久化会话记忆：SQLite (WAL)，带消息窗口、TTL 淘汰与压缩
+memory = create_checkpointer()
+
+# 工具节点：同一条 AIMessage 中的多个 tool call 并发执行，结果按原顺序返回，各自带超时
+tool_node = ToolNode(
+    tools_list,
+    wrap_tool_call=run_tool_with_timeout,
+    awrap_tool_call=arun_tool_with_timeout,
+)
 
 # 创建 ReAct Agent 图
 graph = create_react_agent(
     model=llm,
-    tools=tools_list,
+    tools=tool_node,
+    prompt=SYSTEM_PROMPT,
+    pre_model_hook=compact_context,
     checkpointer=memory
 )
 
-def run_agent(user_input: str, file_content: str = None, thread_id: str = None):
+def _extract_audio_path(tool_output: str) -> str:
+    """从工具输出中提取 mp3 路径"""
+    # Tool 返回: "SUCCESS... File path: /tmp/xyz.mp3 ..."
+    match = re.search(r"File path:\s*(.+?\.mp3)", tool_output)
+    if match:
+        return match.group(1).strip()
+    # 保底逻辑
+    return tool_output
+
+
+def _format_search_reply(tool_output: str) -> str:
+    """把 search_knowledge_base 的 JSON 输出 (排序后的候选列表) 渲染为 Markdown 回复"""
+    try:
+        data = json.loads(tool_output)
+    except ValueError:
+        return tool_output
+    candidates = data.get("candidates") or []
+    if not candidates:
+        return "🔍 No relevant notes found."
+
+    best = candidates[0]
+    url = f"https://www.notion.so/{best.get('page_id', '').replace('-', '')}"
+    summary = best.get("summary") or best.get("existing_content", best.get("snippet", ""))[:300]
+    header = "🔍 Found" if data.get("found") else "🔍 Closest note"
+    lines = [f"{header}: **{best.get('title')}**\n\n{summary}\n\n🔗 {url}"]
+    if len(candidates) > 1:
+        lines.append("\nOther related notes:")
+        for c in candidates[1:]:
+            c_url = f"https://www.notion.so/{c.get('page_id', '').replace('-', '')}"
+            lines.append(f"- [{c.get('title')}]({c_url})")
+    return "\n".join(lines)
+
+
+def _run_fast_path(decision, user_input: str, config: dict, result: dict) -> dict:
     """
-    运行 Agent 的封装函数
+    直接执行工具，跳过 LLM。执行结果写回会话历史，保证后续轮次上下文连续。
     """
-    result = {
+    if decision.route == router.ROUTE_AUDIO:
+        output = convert_text_to_audio.invoke({"text": decision.text, "language": decision.language})
+        if "File path:" in output:
+            result["type"] = "audio"
+            result["audio_path"] = _extract_audio_path(output)
+            result["text"] = f"✅ Audio generated. File path: {result['audio_path']}"
+        else:
+            result["text"] = output
+    else:
+        output = search_knowledge_base.invoke({"query": decision.query})
+        result["text"] = _format_search_reply(output)
+
+    try:
+        graph.update_state(
+            config,
+            {"messages": [HumanMessage(content=user_input), AIMessage(content=result["text"])]},
+            as_node="agent",
+        )
+    except Exception as e:
+        print(f"⚠️ Failed to record fast-path turn in history: {e}")
+    _bound_history(config)
+    return result
+
+
+def _bound_history(config: dict):
+    """每轮结束后把 thread 历史裁剪到固定窗口，保证内存/存储有界"""
+    try:
+        removed = trim_thread_messages(graph, config)
+        if removed:
+            print(f"✂️ Trimmed {removed} old messages from thread history.")
+    except Exception as e:
+        print(f"⚠️ History trim failed: {e}")
+
+
+def _last_ai_text(config: dict) -> str:
+    """从最终状态中取最后一条 AI 回复 (流式事件没有拿到文本时兜底)"""
+    try:
+        messages = graph.get_state(config).values.get("messages", [])
+    except Exception as e:
+        print(f"⚠️ Failed to read final state: {e}")
+        return ""
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            break  # 只看本轮 (最后一条用户消息之后) 的回复
+        if isinstance(message, AIMessage) and isinstance(message.content, str) and message.content:
+            return message.content
+    return ""
+
+
+def _new_result() -> dict:
+    return {
         "type": "knowledge",
         "text": "",
         "audio_path": None,
         "notion_url": None
     }
+
+
+def _prepare_turn(user_input: str, file_content: TextLike, thread_id: str):
+    """
+    公共的回合准备：快速路由 + 附件处理。
+    返回 (config, result, inputs)；快速路由已完成时 inputs 为 None。
+    """
+    result = _new_result()
+
+    # 配置会话上下文 (max_concurrency 限制同一步并发执行的工具数)
+    config = {"configurable": {"thread_id": thread_id}, "max_concurrency": TOOL_MAX_CONCURRENCY}
+
+    # ⚡ 规则快速路由：明确的音频/检索请求直接执行，不进入 Graph
+    route_start = time.perf_counter()
+    decision = router.route_request(user_input, has_file=has_text(file_content))
+    router.log_decision(decision, user_input, thread_id, (time.perf_counter() - route_start) * 1000)
+    if decision.route != router.ROUTE_GRAPH:
+        try:
+            return config, _run_fast_path(decision, user_input, config, result), None
+        except Exception as e:
+            print(f"⚠️ Fast path failed, falling back to graph: {e}")
+    
+    # 构造本轮消息。附件内容只在首次出现 (或内容变化) 时附加一次
+    new_messages = []
+    if has_text(file_content):
+        attachment = _prepare_attachment(file_content, config)
+        if attachment is not None:
+            new_messages.append(attachment)
+    new_messages.append(HumanMessage(content=user_input))
+
+    _prompt_token_log.pop(thread_id, None)
+    return config, result, {"messages": new_messages}
+
+
+NOTION_URL_PATTERN = re.compile(r"https://www\.notion\.so/[0-9a-fA-F]{32}")
+WRITE_JOB_PATTERN = re.compile(r"\(job ([0-9a-f]+)\)")
+
+
+def _apply_tool_output(tool_name: str, content: str, result: dict):
+    """根据工具输出更新回合结果 (音频路径 / 类型)"""
+    # 捕获 Audio Tool
+    if tool_name in ("convert_text_to_audio", "generate_audiobook"):
+        result["type"] = "audio"
+        # ✅ 关键修复：正则提取纯净路径
+        result["audio_path"] = _extract_audio_path(content)
+
+    # 捕获 Notion Tool
+    elif tool_name == "manage_notion_note":
+        result["type"] = "knowledge"
+        url_match = NOTION_URL_PATTERN.search(content or "")
+        if url_match:
+            result["notion_url"] = url_match.group(0)
+        # 后写队列的任务号，UI 用它查询写入进度
+        job_match = WRITE_JOB_PATTERN.search(content or "")
+        if job_match:
+            result["write_job_id"] = job_match.group(1)
+
+
+def run_agent(user_input: str, file_content: TextLike = None, thread_id: str = None):
+    """
+    运行 Agent 的封装函数
+    """
     # 如果没有提供 thread_id，自动生成一个用于会话记忆
     if thread_id is None:
         thread_id = str(uuid.uuid4())
-    
-    # 配置会话上下文
-    config = {"configurable": {"thread_id": thread_id}}
-    
-    # 构造完整的用户消息。如果有 附加文件，将其附加到用户输入后面
-    full_user_message = user_input
-    if file_content and file_content.strip():
-        safe_content = file_content[:50000] 
-        full_user_message = f"{user_input}\n\n--- 📎 附加文件内容 ---\n{safe_content}"
-    
-    # 构造初始消息
-    inputs = {
-        "messages": [
-            SystemMessage(content=SYSTEM_PROMPT),
-            ("user", full_user_message)
-        ]
-    }
+
+    # 整轮对话是一个 trace，LLM / 工具 / Notion / TTS 的 span 都挂在它下面
+    with span("agent.run", thread_id=thread_id) as root:
+        result = _run_turn(user_input, file_content, thread_id)
+        if root is not None:
+            root.set(type=result.get("type"))
+            result["trace_id"] = root.trace_id
+    return result
+
+
+def _run_turn(user_input: str, file_content: TextLike, thread_id: str):
+    config, result, inputs = _prepare_turn(user_input, file_content, thread_id)
+    if inputs is None:
+        return result
     
     print("❯❯❯❯❯❯❯ Agent Starting...")
+    # 🔮 与第一次 LLM 调用并行，先用用户输入做一次检索
+    prefetcher.start(thread_id, user_input)
     
     try:
         # ✅ 关键修复：循环逻辑
@@ -110,30 +388,181 @@ def run_agent(user_input: str, file_content: str = None, thread_id: str = None):
 
             # --- A. 捕获 Tool 输出 (必须在循环内部！) ---
             if isinstance(message, ToolMessage):
-                
-                # 捕获 Audio Tool
-                if message.name == "convert_text_to_audio":
-                    result["type"] = "audio"
-                    # ✅ 关键修复：正则提取纯净路径
-                    # Tool 返回: "SUCCESS... File path: /tmp/xyz.mp3 ..."
-                    match = re.search(r"File path:\s*(.+?\.mp3)", message.content)
-                    if match:
-                        result["audio_path"] = match.group(1).strip()
-                    else:
-                        # 保底逻辑
-                        result["audio_path"] = message.content
-
-                # 捕获 Notion Tool
-                elif message.name == "manage_notion_note":
-                    result["type"] = "knowledge"
-                    # 这里预留给未来提取 Notion URL
+                _apply_tool_output(message.name, message.content, result)
 
             # --- B. 捕获 AI 最终回复 ---
             if isinstance(message, AIMessage) and message.content:
                 result["text"] = message.content
             
+        _bound_history(config)
+        result["prompt_tokens"] = _prompt_token_log.pop(thread_id, [])
         return result
 
     except Exception as e:
         print(f"❌ Error during execution: {e}")
-        return {"type": "error", "text": f"Agent 运行出错: {str(e)}"}
\ No newline at end of file
+        return {"type": "error", "text": f"Agent 运行出错: {str(e)}"}
+    finally:
+        prefetcher.finish(thread_id)
+
+
+# ==========================================
+# 异步流式接口
+# ==========================================
+
+@dataclass
+class AgentEvent:
+    """
+    arun_agent 产生的事件
+    kind: "token" | "tool_start" | "tool_end" | "done" | "error"
+    - token      : data = {"text"}
+    - tool_start : data = {"name", "input"}
+    - tool_end   : data = {"name", "output", "seconds"}
+    - done       : data = 与 run_agent 相同结构的结果 dict
+    - error      : data = {"text"}
+    """
+    kind: str
+    data: dict = field(default_factory=dict)
+
+
+async def arun_agent(user_input: str, file_content: TextLike = None, thread_id: str = None) -> AsyncIterator[AgentEvent]:
+    """
+    异步版 run_agent：边执行边产出 token 与工具进度事件，最后产出 done 事件
+    """
+    if thread_id is None:
+        thread_id = str(uuid.uuid4())
+
+    with span("agent.run", thread_id=thread_id, stream=True) as root:
+        async for event in _astream_turn(user_input, file_content, thread_id):
+            if event.kind == "done" and root is not None:
+                root.set(type=event.data.get("type"))
+                event.data["trace_id"] = root.trace_id
+            yield event
+
+
+async def _astream_turn(user_input: str, file_content: TextLike, thread_id: str) -> AsyncIterator[AgentEvent]:
+    config, result, inputs = await asyncio.to_thread(_prepare_turn, user_input, file_content, thread_id)
+    if inputs is None:
+        yield AgentEvent("done", result)
+        return
+
+    print("❯❯❯❯❯❯❯ Agent Starting (stream)...")
+    prefetcher.start(thread_id, user_input)
+    tool_started = {}
+    current_text = []
+
+    try:
+        async for event in graph.astream_events(inputs, config, version="v2"):
+            kind = event["event"]
+            node = event.get("metadata", {}).get("langgraph_node")
+
+            if kind == "on_chat_model_start" and node == "agent":
+                # 新的一次模型调用，之前的中间文本作废
+                current_text = []
+
+            elif kind == "on_chat_model_stream" and node == "agent":
+                chunk = event["data"]["chunk"]
+                if isinstance(chunk.content, str) and chunk.content:
+                    current_text.append(chunk.content)
+                    yield AgentEvent("token", {"text": chunk.content})
+
+            elif kind == "on_chat_model_end" and node == "agent" and not current_text:
+                # 响应缓存命中时模型不产生 stream 事件，整段回复只出现在 end 事件里
+                output = event["data"].get("output")
+                content = getattr(output, "content", None)
+                if isinstance(content, str) and content:
+                    current_text.append(content)
+                    yield AgentEvent("token", {"text": content})
+
+            elif kind == "on_tool_start":
+                tool_started[event["run_id"]] = time.perf_counter()
+                yield AgentEvent("tool_start", {"name": event["name"], "input": event["data"].get("input")})
+
+            elif kind == "on_tool_end":
+                output = event["data"].get("output")
+                content = output.content if isinstance(output, ToolMessage) else str(output)
+                _apply_tool_output(event["name"], content, result)
+                seconds = time.perf_counter() - tool_started.pop(event["run_id"], time.perf_counter())
+                yield AgentEvent("tool_end", {"name": event["name"], "output": content, "seconds": seconds})
+
+        if current_text:
+            result["text"] = "".join(current_text)
+        else:
+            result["text"] = await asyncio.to_thread(_last_ai_text, config)
+        await asyncio.to_thread(_bound_history, config)
+        result["prompt_tokens"] = _prompt_token_log.pop(thread_id, [])
+        yield AgentEvent("done", result)
+
+    except Exception as e:
+        print(f"❌ Error during execution: {e}")
+        yield AgentEvent("error", {"text": f"Agent 运行出错: {str(e)}"})
+    finally:
+        prefetcher.finish(thread_id)
+
+
+# ==========================================
+# 同步调用方的流式接口 (Streamlit)
+# ==========================================
+
+class _AgentLoop:
+    """
+    常驻的 event loop 线程 (与 audio_ops.TTSService 相同的模式)。
+    共享 AsyncClient 的连接绑定在 event loop 上：若每轮 asyncio.run 新建 loop，每轮都要重新建连 / 握手。
+    同步调用方的所有回合都跑在这一个 loop 上，keep-alive 连接跨回合复用。
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._thread = None
+        self._started = threading.Event()
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._started.clear()
+            self._thread = threading.Thread(target=self._run_loop, name="agent-loop", daemon=True)
+            self._thread.start()
+        self._started.wait()
+
+    def _run_loop(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._loop.call_soon(self._started.set)
+        self._loop.run_forever()
+
+    def submit(self, coro):
+        """把协程交给常驻 loop 执行，返回 concurrent.futures.Future"""
+        self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+
+_agent_loop = _AgentLoop()
+
+
+def iter_agent_events(user_input: str, file_content: TextLike = None, thread_id: str = None) -> Iterator[AgentEvent]:
+    """
+    同步迭代 arun_agent 的事件：agent 在常驻 loop 上执行，事件经线程安全队列交回调用线程，
+    渲染等调用方逻辑仍在调用方自己的线程里完成。调用方提前结束迭代时取消本轮执行。
+    """
+    events = queue.Queue()
+
+    async def _pump():
+        try:
+            async for event in arun_agent(user_input, file_content, thread_id):
+                events.put(event)
+        except Exception as e:
+            events.put(AgentEvent("error", {"text": f"Agent 运行出错: {str(e)}"}))
+        finally:
+            events.put(None)
+
+    future = _agent_loop.submit(_pump())
+    try:
+        while True:
+            event = events.get()
+            if event is None:
+                return
+            yield event
+    finally:
+        if not future.done():
+            future.cancel()
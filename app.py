@@ -11,13 +11,9 @@ if sys.platform.startswith('linux'):
 
 import streamlit as st
 import uuid
-import warnings
-import tempfile
-from ebooklib import epub
-from bs4 import BeautifulSoup
-from pypdf import PdfReader
-from io import BytesIO       
-from audio_ops import generate_audio_file
+from extract_cache import extraction_cache
+from extract_ops import extract_to_file, ExtractStats, ExtractionError, SUPPORTED_TYPES
+from text_store import session_dir, spool_upload
     
 st.set_page_config(page_title="AI Knowledge Base", page_icon="🌱")
 
@@ -74,79 +70,60 @@ for msg in st.session_state.messages:
         st.markdown(msg["content"])
 
 # 文件上传
-def extract_text_from_epub(file_stream):
-    """解析 EPUB 文件内容"""
-    try:
-        # EbookLib 需要文件路径，所以先保存为临时文件
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".epub") as tmp_file:
-            tmp_file.write(file_stream.read())
-            tmp_path = tmp_file.name
+def process_uploaded_file(uploaded_file):
+    """
+    上传文件先按块落盘，再按路径解析；解析结果流式写入会话目录，
+    返回 TextHandle (session_state 中不保存全文)。相同内容命中解析缓存时跳过解析。
+    """
+    file_type = uploaded_file.name.split('.')[-1].lower()
+    if file_type not in SUPPORTED_TYPES:
+        return None
 
-        book = epub.read_epub(tmp_path)
-        chapters = []
-        
-        # 遍历书籍内容，提取文本
-        for item in book.get_items():
-            if item.get_type() == epub.ITEM_DOCUMENT:
-                # 使用 BeautifulSoup 去除 HTML 标签
-                soup = BeautifulSoup(item.get_content(), 'html.parser')
-                chapters.append(soup.get_text())
-        
-        # 清理临时文件
-        os.remove(tmp_path)
-        
-        return "\n".join(chapters)
-    except Exception as e:
-        return f"Error reading EPUB: {e}"
+    if "upload_session" not in st.session_state:
+        st.session_state["upload_session"] = uuid.uuid4().hex
+    upload_dir = session_dir(st.session_state["upload_session"])
+    source_path, source_sha = spool_upload(uploaded_file, upload_dir, suffix=f".{file_type}")
+    # 每次生成新文件名：旧句柄被回收时只会删除它自己的文件
+    dest_path = os.path.join(upload_dir, f"{source_sha[:16]}-{uuid.uuid4().hex[:8]}.txt")
+    progress = st.sidebar.empty()
+
+    def _extract(path: str):
+        stats = ExtractStats()
+
+        def _on_progress(stage, done, total, elapsed):
+            progress.progress(done / total if total else 1.0, text=f"解析中 {done}/{total} · {elapsed:.1f}s")
+
+        handle = extract_to_file(source_path, file_type, path, stats=stats, on_progress=_on_progress, owned=True)
+        if stats.units:
+            st.session_state["extract_summary"] = stats.summary()
+        return handle
 
-def extract_text_from_txt(file_stream):
-    """解析 TXT 文件内容"""
-    try:
-        # 尝试 UTF-8 解码
-        return file_stream.read().decode("utf-8")
-    except UnicodeDecodeError:
-        # 如果失败，尝试 gbk (兼容中文旧文件)
-        try:
-            return file_stream.read().decode("gbk")
-        except:
-            return "Error: Unsupported text encoding."
-        
-def extract_pdf_text(pdf_bytes: bytes) -> str:
-    """从 PDF 字节数据中提取文本"""
     try:
-        pdf_file = BytesIO(pdf_bytes)
-        # 抑制 pypdf 的格式警告（PDF 文件格式不规范时的警告）
-        # 这些警告是直接打印到 stderr 的，需要重定向
-        with warnings.catch_warnings():
-            warnings.filterwarnings("ignore")
-            # 重定向 stderr 以抑制 pypdf 的格式警告输出
-            with open(os.devnull, 'w') as devnull:
-                old_stderr = sys.stderr
-                sys.stderr = devnull
-                try:
-                    reader = PdfReader(pdf_file, strict=False)  # strict=False 允许更宽松的解析
-                    text = ""
-                    for page in reader.pages:
-                        text += page.extract_text() + "\n"
-                finally:
-                    sys.stderr = old_stderr
-        return text
-    except Exception as e:
-        st.error(f"PDF 提取错误: {e}")
-        return ""
-    
-def process_uploaded_file(uploaded_file):
-    """根据文件后缀分发处理逻辑"""
-    file_type = uploaded_file.name.split('.')[-1].lower()
-    
-    if file_type == 'pdf':
-        return extract_pdf_text(uploaded_file.read())
-    elif file_type == 'epub':
-        return extract_text_from_epub(uploaded_file)
-    elif file_type == 'txt':
-        return extract_text_from_txt(uploaded_file)
-    else:
+        return extraction_cache.get_or_extract(source_sha, file_type, dest_path, _extract)
+    except ExtractionError as e:
+        st.error(str(e))
         return None
+    finally:
+        progress.empty()
+        os.remove(source_path)  # 原始文件解析完即可丢弃
+
+@st.fragment(run_every="3s")
+def _write_queue_panel():
+    from write_queue import write_queue, STATUS_DEAD, STATUS_DONE
+
+    counts = write_queue.stats()
+    st.caption(" · ".join(f"{k} {v}" for k, v in counts.items()))
+    icons = {"queued": "🕒", "running": "⏳", STATUS_DONE: "✅", STATUS_DEAD: "☠️"}
+    for job in write_queue.list(limit=5):
+        title = (job["payload"] or {}).get("title", job["kind"])
+        line = f"{icons.get(job['status'], '•')} **{title}** · `{job['id']}`"
+        if job["status"] == STATUS_DONE and job["page_id"]:
+            line += f" · [Notion](https://www.notion.so/{job['page_id'].replace('-', '')})"
+        st.markdown(line)
+        if job["status"] == STATUS_DEAD:
+            st.caption(job["last_error"] or "")
+            if st.button("🔁 Retry", key=f"retry_{job['id']}"):
+                write_queue.retry(job["id"])
 
 with st.sidebar:
     # 注入自定义 CSS 样式
@@ -191,6 +168,18 @@ with st.sidebar:
         type=["pdf", "epub", "txt"],
         help="支持上传 PDF、电子书或纯文本文件供 Agent 学习"
     )
+    # 🔌 连接池观测
+    with st.expander("🔌 Connection pools"):
+        from http_pool import pool_stats
+        st.json(pool_stats())
+    with st.expander("🗃️ LLM cache"):
+        from llm_cache import cache_stats
+        st.json(cache_stats())
+    with st.expander("📄 Extraction cache"):
+        st.json(extraction_cache.stats())
+    # 📝 Notion 后写队列：自动刷新任务状态，死信任务可手动重试
+    with st.expander("📝 Write queue"):
+        _write_queue_panel()
     # 清空按钮，方便重置对话
     if st.button("🥀 "):
         st.session_state.messages = []
@@ -198,14 +187,23 @@ with st.sidebar:
         
 file_content = None 
 if uploaded_file is not None:
-    # 调用刚才写的统一处理函数
-    file_content = process_uploaded_file(uploaded_file)
+    # 同一个上传对象在重跑时直接复用，连哈希都不用再算
+    upload_id = getattr(uploaded_file, "file_id", None) or f"{uploaded_file.name}:{uploaded_file.size}"
+    if st.session_state.get("file_upload_id") == upload_id and st.session_state.get("file_content"):
+        file_content = st.session_state["file_content"]
+    else:
+        # 调用刚才写的统一处理函数 (命中缓存时不会产生新的解析统计)
+        st.session_state.pop("extract_summary", None)
+        file_content = process_uploaded_file(uploaded_file)
+        st.session_state["file_upload_id"] = upload_id
     
     if file_content:
         # ✅ [关键步骤] 必须存入 Session State，否则 Agent 读不到！
         st.session_state["file_content"] = file_content
         
         st.sidebar.success(f"已加载: {uploaded_file.name} ({len(file_content)} 字符)")
+        if st.session_state.get("extract_summary"):
+            st.sidebar.caption(f"⚡ {st.session_state['extract_summary']}")
     else:
         st.sidebar.error("无法读取文件内容")
 else:
@@ -213,6 +211,38 @@ else:
     # 我们也要同步清除 Session State 里的内容，防止 Agent 还在读旧文件
     if "file_content" in st.session_state:
         del st.session_state["file_content"]
+    st.session_state.pop("file_upload_id", None)
+    st.session_state.pop("extract_summary", None)
+
+# 📚 大文件 Map-Reduce 整理为 Notion 笔记
+if st.session_state.get("file_content"):
+    with st.sidebar:
+        ingest_category = st.selectbox("笔记分类", ["Humanities", "Tech", "Spanish"], key="ingest_category")
+        if st.button("📚 整理全文为 Notion 笔记"):
+            from summarize_ops import ingest_document
+
+            with st.status("Map-Reduce 整理中...", expanded=True) as status:
+                progress_bar = st.progress(0.0)
+                stage_text = st.empty()
+
+                def _on_progress(stage, done, total, elapsed):
+                    progress_bar.progress(done / total if total else 1.0)
+                    stage_text.markdown(f"**{stage}**: {done}/{total} · {elapsed:.1f}s")
+
+                outcome = ingest_document(
+                    st.session_state["file_content"],
+                    category=ingest_category,
+                    title_hint=uploaded_file.name if uploaded_file else "Document Notes",
+                    on_progress=_on_progress,
+                )
+                timing_line = " · ".join(f"{k} {v:.1f}s" for k, v in outcome["timings"].items())
+                st.markdown(outcome["message"])
+                if timing_line:
+                    st.caption(f"⏱️ {timing_line}")
+                status.update(
+                    label="✅ 整理完成" if outcome["ok"] else "❌ 整理失败",
+                    state="complete" if outcome["ok"] else "error",
+                )
 
 # 1. 获取用户输入
 if prompt := st.chat_input("Enter a note or topic..."):
@@ -224,17 +254,48 @@ if prompt := st.chat_input("Enter a note or topic..."):
 
     # --- B. AI 开始处理 ---
     with st.chat_message("assistant"):
+        from agent_graph import iter_agent_events
+
+        tool_box = st.empty()
+        text_box = st.empty()
+
+        def _consume_stream():
+            """边接收事件边渲染：token 实时追加，工具调用显示进度"""
+            tokens = []
+            tool_lines = []
+            final = {"type": "error", "text": "Agent 没有返回结果"}
+            # agent 跑在常驻 event loop 上 (连接跨轮复用)，事件在脚本线程里渲染
+            for event in iter_agent_events(
+                prompt,
+                file_content=st.session_state.get("file_content", None),
+                thread_id=st.session_state.thread_id
+            ):
+                if event.kind == "token":
+                    tokens.append(event.data["text"])
+                    text_box.markdown("".join(tokens) + "▌")
+                elif event.kind == "tool_start":
+                    # 工具调用开始，之前流出的是中间思考，清空重新累计
+                    tokens = []
+                    tool_lines.append(f"⏳ `{event.data['name']}` ...")
+                    tool_box.markdown("\n\n".join(tool_lines))
+                elif event.kind == "tool_end":
+                    for i, line in enumerate(tool_lines):
+                        if line.startswith(f"⏳ `{event.data['name']}`"):
+                            tool_lines[i] = f"✅ `{event.data['name']}` ({event.data['seconds']:.1f}s)"
+                            break
+                    tool_box.markdown("\n\n".join(tool_lines))
+                elif event.kind in ("done", "error"):
+                    final = event.data if event.kind == "done" else {"type": "error", **event.data}
+            return final
+
         with st.spinner("Thinking..."):
-           from agent_graph import run_agent
+            result = _consume_stream()
 
-           result = run_agent(
-            prompt,
-            file_content=st.session_state.get("file_content", None),
-            thread_id=st.session_state.thread_id
-           )
+        if result.get("trace_id"):
+            st.session_state["last_trace_id"] = result["trace_id"]
 
         # 显示文本
-        st.markdown(result["text"])
+        text_box.markdown(result["text"])
         st.session_state.messages.append(
             {"role": "assistant", "content": result["text"]}
         )
@@ -246,4 +307,32 @@ if prompt := st.chat_input("Enter a note or topic..."):
 
         # Knowledge / Notion 模态
         if result["type"] == "knowledge" and result["notion_url"]:
-            st.markdown(f"[🔗 打开 Notion 页面]({result['notion_url']})")
\ No newline at end of file
+            st.markdown(f"[🔗 打开 Notion 页面]({result['notion_url']})")
+        elif result.get("write_job_id"):
+            st.caption(f"📝 正在后台写入 Notion (job {result['write_job_id']})，进度见侧边栏 Write queue")
+
+# 🧭 链路追踪调试面板：最近一轮的瀑布图 + 各 span 的 p50/p95
+with st.sidebar:
+    with st.expander("🧭 Trace debug"):
+        import altair as alt
+        import pandas as pd
+        from tracing import get_trace, aggregate
+
+        trace_rows = get_trace(st.session_state.get("last_trace_id", ""))
+        if trace_rows:
+            df = pd.DataFrame(trace_rows)
+            # 序号前缀保证同名 span (如多个 tts.segment) 各占一行
+            df["label"] = [f"{i:02d} {'· ' * d}{n}" for i, (d, n) in enumerate(zip(df["depth"], df["name"]))]
+            chart = alt.Chart(df).mark_bar().encode(
+                x=alt.X("start_ms:Q", title="ms"),
+                x2="end_ms:Q",
+                y=alt.Y("label:N", sort=list(df["label"]), title=None),
+                color=alt.Color("status:N", legend=None),
+                tooltip=["name", alt.Tooltip("duration_ms:Q", format=".1f"), "status"],
+            )
+            st.altair_chart(chart, use_container_width=True)
+        else:
+            st.caption("No trace yet.")
+        stats = aggregate()
+        if stats:
+            st.dataframe(pd.DataFrame(stats), hide_index=True)
@@ -1,10 +1,17 @@
 import asyncio
-import edge_tts
 import re
 import tempfile
 import os
 import uuid
+import hashlib
+import itertools
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Optional
 from pydub import AudioSegment
+from tts_backends import TTSBackend, get_backend
+from tracing import Span, span, current_span
 
 # --- 声音配置 ---
 VOICE_MAP = {
@@ -16,6 +23,12 @@ RATE = "-10%"
 PAUSE_DURATION_MS = 1000 
 PAUSE_MARKER = "==="
 
+# --- 后台服务配置 ---
+OUTPUT_DIR = "generated_audio"
+TTS_WORKERS = int(os.environ.get("TTS_WORKERS", "4"))  # 同时进行的合成任务数
+PRIORITY_INTERACTIVE = 0  # 聊天中的即时请求
+PRIORITY_BACKGROUND = 10  # 批量/后台任务
+
 def clean_text_for_audio(text):
     if not text: return ""
     text = re.sub(r"[\*\#]", "", text) 
@@ -23,16 +36,45 @@ def clean_text_for_audio(text):
     text = re.sub(r"\[([^\]]+)\]\([^\)]+\)", r"\1", text) 
     return text.strip()
 
-async def _generate_audio_async(text_content, output_path, language="es"):
+def concat_segments(parts):
+    """
+    一次性拼接多个 AudioSegment。
+    逐个 += 每次都会复制整段已拼接的数据 (总体 O(n^2))；这里先统一采样参数，再只拼接一次原始数据。
+    """
+    parts = [p for p in parts if p is not None]
+    if not parts:
+        return AudioSegment.empty()
+    frame_rate = max(p.frame_rate for p in parts)
+    channels = max(p.channels for p in parts)
+    sample_width = max(p.sample_width for p in parts)
+    synced = [p.set_channels(channels).set_frame_rate(frame_rate).set_sample_width(sample_width) for p in parts]
+    return synced[0]._spawn(b"".join(p.raw_data for p in synced))
+
+
+def _join_and_export(parts, output_path):
+    """拼接所有片段并导出 (CPU 密集，在线程池中执行)，输出格式跟随文件后缀 (默认 mp3)"""
+    final_audio = concat_segments(parts)
+    out_format = os.path.splitext(output_path)[1].lstrip(".") or "mp3"
+    final_audio.export(output_path, format=out_format)
+
+
+async def _generate_audio_async(text_content, output_path, language="es", backend: TTSBackend = None, on_segment=None):
+    """
+    逐段合成并拼接音频。
+    解码 / 拼接 / 导出都放到线程池里，不阻塞共享 TTS event loop 上的其他任务。
+    :param backend: TTS 后端，默认由 TTS_BACKEND 环境变量决定
+    :param on_segment: 可选回调 on_segment(index, segment_audio)，每段解码完成后触发
+    """
+    backend = backend or get_backend()
     voice = VOICE_MAP.get(language, VOICE_MAP["es"])
     segments_text = text_content.split(PAUSE_MARKER)
     
-    final_audio = AudioSegment.empty()
+    parts = []
     silence_audio = AudioSegment.silent(duration=PAUSE_DURATION_MS)
     
     # 创建一个临时文件路径，不立即打开，避免占用
     # 使用 delete=False 让我们可以手动管理它的生命周期
-    with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as tmp:
+    with tempfile.NamedTemporaryFile(suffix=f".{backend.audio_format}", delete=False) as tmp:
         temp_filename = tmp.name
 
     try:
@@ -45,8 +87,8 @@ async def _generate_audio_async(text_content, output_path, language="es"):
             if not clean_segment: continue
             
             # 覆盖写入同一个临时文件
-            communicate = edge_tts.Communicate(clean_segment, voice, rate=RATE)
-            await communicate.save(temp_filename)
+            with span("tts.segment", index=i, chars=len(clean_segment), backend=backend.name):
+                await backend.synthesize(clean_segment, voice, RATE, temp_filename)
             
             # 检查文件大小
             if os.path.getsize(temp_filename) == 0:
@@ -54,17 +96,19 @@ async def _generate_audio_async(text_content, output_path, language="es"):
                 continue
                 
             # 读取音频片段
-            segment_audio = AudioSegment.from_mp3(temp_filename)
-            final_audio += segment_audio
+            segment_audio = await asyncio.to_thread(AudioSegment.from_file, temp_filename, format=backend.audio_format)
+            parts.append(segment_audio)
+            if on_segment:
+                on_segment(i, segment_audio)
             
             # 只要不是最后一段，就加停顿
             if i < len(segments_text) - 1:
-                final_audio += silence_audio
+                parts.append(silence_audio)
             
             has_content = True
             
         if has_content:
-            final_audio.export(output_path, format="mp3")
+            await asyncio.to_thread(_join_and_export, parts, output_path)
             print(f"✅ Audio saved to {output_path} (Size: {os.path.getsize(output_path)} bytes)")
             return True
         else:
@@ -82,22 +126,149 @@ async def _generate_audio_async(text_content, output_path, language="es"):
             except:
                 pass
 
-def generate_audio_file(text, language="es"):
-    output_dir = "generated_audio"
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    
-    filename = f"audio_{uuid.uuid4().hex[:8]}.mp3"
-    
-    output_path = os.path.join(output_dir, filename)
-    abs_path = os.path.abspath(output_path)
-    
+# ==========================================
+# 🎛️ 后台 TTS 服务 (Event Loop Thread + Job Queue)
+# ==========================================
+
+@dataclass
+class AudioJob:
+    """提交给 TTSService 的任务句柄，可在任意线程中等待结果"""
+    job_id: str
+    text: str
+    language: str
+    output_path: str
+    priority: int = PRIORITY_INTERACTIVE
+    owners: int = 1  # 尚未 release 的持有者数 (相同文本的在途任务共用同一个输出文件)，由 TTSService 加锁维护
+    future: Future = field(default_factory=Future, repr=False)
+    trace_parent: Optional[Span] = field(default=None, repr=False)  # 提交方的 span，TTS 线程中挂到它下面
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def result(self, timeout: float = None):
+        """阻塞等待，成功返回音频绝对路径，失败返回 None"""
+        return self.future.result(timeout=timeout)
+
+
+class TTSService:
+    """
+    常驻的 TTS 服务：
+    - 独立线程运行一个长期存活的 event loop，避免每次 asyncio.run 的创建/销毁开销
+    - PriorityQueue 调度，多个 worker 协程让不同用户的任务并发执行
+    - 相同 (text, language) 的在途任务直接复用同一个句柄
+    """
+
+    def __init__(self, workers: int = TTS_WORKERS, backend: TTSBackend = None):
+        self.workers = max(1, workers)
+        self.backend = backend
+        self._loop = None
+        self._queue = None
+        self._thread = None
+        self._started = threading.Event()
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._seq = itertools.count()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._started.clear()
+            self._thread = threading.Thread(target=self._run_loop, name="tts-service", daemon=True)
+            self._thread.start()
+        self._started.wait()
+
+    def _run_loop(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._queue = asyncio.PriorityQueue()
+        for _ in range(self.workers):
+            self._loop.create_task(self._worker())
+        self._loop.call_soon(self._started.set)
+        self._loop.run_forever()
+
+    async def _worker(self):
+        while True:
+            _, _, job = await self._queue.get()
+            try:
+                with span("tts.job", parent=job.trace_parent, job_id=job.job_id, chars=len(job.text)):
+                    ok = await _generate_audio_async(job.text, job.output_path, job.language, backend=self.backend)
+                if ok and os.path.exists(job.output_path) and os.path.getsize(job.output_path) > 0:
+                    job.future.set_result(job.output_path)
+                else:
+                    job.future.set_result(None)
+            except Exception as e:
+                print(f"❌ TTS job {job.job_id} crashed: {e}")
+                job.future.set_result(None)
+            finally:
+                with self._lock:
+                    self._inflight.pop(job.job_id, None)
+                self._queue.task_done()
+
+    def submit(self, text: str, language: str = "es", priority: int = PRIORITY_INTERACTIVE) -> AudioJob:
+        """提交合成任务，立即返回 AudioJob 句柄"""
+        self._ensure_started()
+        job_id = hashlib.sha1(f"{language}\x00{text}".encode("utf-8")).hexdigest()[:16]
+
+        with self._lock:
+            existing = self._inflight.get(job_id)
+            if existing:
+                print(f"♻️ TTS job {job_id} already in flight, reusing handle.")
+                existing.owners += 1
+                return existing
+
+            os.makedirs(OUTPUT_DIR, exist_ok=True)
+            filename = f"audio_{uuid.uuid4().hex[:8]}.mp3"
+            job = AudioJob(
+                job_id=job_id,
+                text=text,
+                language=language,
+                output_path=os.path.abspath(os.path.join(OUTPUT_DIR, filename)),
+                priority=priority,
+                trace_parent=current_span(),
+            )
+            self._inflight[job_id] = job
+
+        self._loop.call_soon_threadsafe(
+            self._queue.put_nowait, (priority, next(self._seq), job)
+        )
+        return job
+
+    def release(self, job: AudioJob) -> bool:
+        """
+        持有者用完输出文件后调用 (每次 submit 对应一次 release)。
+        返回 True 表示这是最后一个持有者，调用方可以删除输出文件。
+        只有显式 release 的调用方才会让计数归零，从不 release 的持有者会让文件一直保留。
+        """
+        with self._lock:
+            if job.owners <= 0:
+                return False
+            job.owners -= 1
+            return job.owners == 0
+
+    def pending(self) -> int:
+        """当前在途 (排队 + 执行中) 的任务数"""
+        with self._lock:
+            return len(self._inflight)
+
+
+tts_service = TTSService()
+
+
+def submit_audio_job(text, language="es", priority=PRIORITY_INTERACTIVE) -> AudioJob:
+    """非阻塞接口：返回任务句柄，调用方自行决定何时等待"""
+    return tts_service.submit(text, language, priority)
+
+
+def release_audio_job(job: AudioJob) -> bool:
+    """释放任务句柄，返回是否为最后一个持有者 (见 TTSService.release)"""
+    return tts_service.release(job)
+
+
+def generate_audio_file(text, language="es", timeout=None):
+    """阻塞接口：提交到后台服务并等待结果，返回音频绝对路径或 None"""
     try:
-        asyncio.run(_generate_audio_async(text, abs_path, language))
-        
-        if os.path.exists(abs_path) and os.path.getsize(abs_path) > 0:
-            return abs_path
-        return None
+        return submit_audio_job(text, language).result(timeout=timeout)
     except Exception as e:
         print(f"Failed to run async audio gen: {e}")
-        return None
\ No newline at end of file
+        return None
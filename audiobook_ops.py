@@ -0,0 +1,178 @@
+"""
+批量有声书生成
+
+直接从 Notion 页面或向量库检索结果取正文，按章节并行合成，
+最后拼接为一个带章节信息的音频文件。正文全程不经过 LLM。
+"""
+import os
+import re
+import json
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
+from pydub import AudioSegment
+
+import notion_ops
+import vector_ops
+from audio_ops import (
+    submit_audio_job, release_audio_job, concat_segments, OUTPUT_DIR, PAUSE_MARKER, PRIORITY_BACKGROUND,
+)
+from rate_limit import notion_priority, PRIORITY_BULK
+
+CHAPTER_GAP_MS = 2000     # 章节之间的停顿
+MAX_CHAPTERS = 30         # 单次最多合成的章节数
+FETCH_WORKERS = 4         # 并发读取 Notion 的线程数
+CHAPTER_TIMEOUT = 600     # 单章合成的最长等待时间 (秒)
+
+
+def _slugify(text: str) -> str:
+    slug = re.sub(r"[^\w\-]+", "_", text or "").strip("_")
+    return slug[:40] or "audiobook"
+
+
+def collect_chapters(
+    page_ids: Optional[List[str]] = None,
+    query: Optional[str] = None,
+    domain: Optional[str] = None,
+    limit: int = 10,
+) -> List[Dict[str, Any]]:
+    """
+    收集章节列表 [{page_id, title, text}]
+    优先级: page_ids > query (向量检索) > domain (按领域列出)
+    """
+    if page_ids:
+        sources = [{"page_id": pid, "title": None, "metadata": {}} for pid in page_ids]
+        # 尝试从向量库补全标题
+        try:
+            known = vector_ops.collection.get(ids=list(page_ids), include=["metadatas"])
+            titles = {pid: (meta or {}).get("title") for pid, meta in zip(known["ids"], known["metadatas"])}
+            for src in sources:
+                src["title"] = titles.get(src["page_id"])
+        except Exception as e:
+            print(f"⚠️ Title lookup failed: {e}")
+    elif query:
+        sources = vector_ops.search_memories(query, n_results=limit, domain=domain)
+    elif domain:
+        sources = vector_ops.list_memories(domain=domain, limit=limit)
+    else:
+        return []
+
+    sources = sources[:MAX_CHAPTERS]
+
+    def _load(src):
+        # 批量读取让位于对话中的 Notion 写入；读整页 (分页 + 子块)，长笔记不会被截断
+        try:
+            with notion_priority(PRIORITY_BULK):
+                note = notion_ops.read_page_note(src["page_id"])
+            text = "\n\n".join(part for part in (note["summary"], note["body"]) if part)
+        except Exception as e:
+            print(f"⚠️ Read {src['page_id']} failed: {e}")
+            text = ""
+        if not text.strip():
+            # Notion 读取失败时退回向量库中缓存的正文
+            text = src.get("metadata", {}).get("content", "")
+        return {
+            "page_id": src["page_id"],
+            "title": src.get("title") or "Untitled",
+            "text": text,
+        }
+
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        chapters = list(executor.map(_load, sources))
+
+    return [c for c in chapters if c["text"].strip()]
+
+
+def build_audiobook(chapters: List[Dict[str, Any]], title: str, language: str = "es") -> Optional[Dict[str, Any]]:
+    """
+    并行合成所有章节并拼接为一个音频文件
+    返回 {"path", "chapters_path", "chapters": [...], "failed": [...]}
+    """
+    if not chapters:
+        return None
+
+    print(f"📚 Building audiobook '{title}' with {len(chapters)} chapters...")
+
+    # 1. 所有章节同时提交到后台 TTS 服务 (每章以标题开头)
+    jobs = [
+        submit_audio_job(f"{c['title']}\n{PAUSE_MARKER}\n{c['text']}", language, priority=PRIORITY_BACKGROUND)
+        for c in chapters
+    ]
+
+    # 2. 按原顺序收集结果，最后一次性拼接
+    gap = AudioSegment.silent(duration=CHAPTER_GAP_MS)
+    segments = []
+    chapter_index = []
+    failed = []
+    position_ms = 0
+
+    for chapter, job in zip(chapters, jobs):
+        try:
+            chapter_path = job.result(timeout=CHAPTER_TIMEOUT)
+            chapter_audio = AudioSegment.from_mp3(chapter_path) if chapter_path else None
+        except Exception as e:
+            print(f"❌ Chapter '{chapter['title']}' failed: {e}")
+            chapter_path, chapter_audio = None, None
+
+        # 每次 submit 对应一次 release：在途去重时别的请求可能拿到了同一个文件，最后一个持有者才删除
+        if release_audio_job(job) and job.done() and chapter_path:
+            try:
+                os.remove(chapter_path)
+            except OSError:
+                pass
+
+        if chapter_audio is None:
+            failed.append({"page_id": chapter["page_id"], "title": chapter["title"]})
+            continue
+
+        if segments:
+            segments.append(gap)
+            position_ms += len(gap)
+        chapter_index.append({
+            "title": chapter["title"],
+            "page_id": chapter["page_id"],
+            "start_ms": position_ms,
+            "duration_ms": len(chapter_audio),
+        })
+        segments.append(chapter_audio)
+        position_ms += len(chapter_audio)
+
+    if not chapter_index:
+        print("❌ No chapter could be synthesized.")
+        return None
+
+    # 3. 导出音频 + 章节索引 (同名 .chapters.json)
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    base = os.path.abspath(os.path.join(OUTPUT_DIR, f"book_{_slugify(title)}_{uuid.uuid4().hex[:6]}"))
+    audio_path = f"{base}.mp3"
+    chapters_path = f"{base}.chapters.json"
+
+    book = concat_segments(segments)
+    book.export(audio_path, format="mp3", tags={"title": title, "album": title})
+    with open(chapters_path, "w", encoding="utf-8") as f:
+        json.dump({"title": title, "language": language, "chapters": chapter_index}, f, ensure_ascii=False, indent=2)
+
+    print(f"✅ Audiobook saved to {audio_path} ({len(chapter_index)} chapters, {len(book) // 1000}s)")
+    return {
+        "path": audio_path,
+        "chapters_path": chapters_path,
+        "chapters": chapter_index,
+        "failed": failed,
+    }
+
+
+def generate_audiobook(
+    page_ids: Optional[List[str]] = None,
+    query: Optional[str] = None,
+    domain: Optional[str] = None,
+    title: Optional[str] = None,
+    language: str = "es",
+    limit: int = 10,
+) -> Optional[Dict[str, Any]]:
+    """入口：收集章节 -> 并行合成 -> 拼接导出"""
+    chapters = collect_chapters(page_ids=page_ids, query=query, domain=domain, limit=limit)
+    if not chapters:
+        print("❌ No content found for audiobook.")
+        return None
+    book_title = title or query or domain or chapters[0]["title"]
+    return build_audiobook(chapters, book_title, language)
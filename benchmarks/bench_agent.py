@@ -0,0 +1,144 @@
+"""
+端到端 Agent 基准测试 (录制 / 回放)
+
+标准场景：audio (快速路由朗读) / create (新建笔记) / search (检索问答) / overwrite (合并更新)。
+先在有真实 API Key 的环境录制一次，之后离线回放，对比代码改动前后的：
+- wall ms     单轮对话耗时 (回放延迟 + 本地处理)
+- cpu ms      本进程消耗的 CPU 时间 (所有线程)
+- llm / tools 本轮的 LLM 调用次数与工具调用次数 (来自 tracing)
+- http        本轮经过共享连接池的 HTTP 请求数
+
+每次运行都在全新的临时工作目录中进行 (chroma_db / checkpoints 等都从空开始)，
+保证录制与回放时向量库状态一致。
+
+仓库里不附带录制好的 fixture：录制结果包含真实的 LLM 回复与 Notion 页面内容 (fixtures/ 已加入 .gitignore)，
+离线回放之前必须先用真实的 OPENAI_API_KEY / NOTION_TOKEN 在本地录制一次，之后的前后对比都基于这份本地录制。
+
+用法:
+    python benchmarks/bench_agent.py --record fixtures/agent_suite
+    python benchmarks/bench_agent.py --replay fixtures/agent_suite [--latency recorded|<ms>] [--latency-scale 1.0]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# 场景名 -> 同一会话中依次发送的用户输入
+SCENARIOS = [
+    ("audio", [
+        "Read this aloud in Spanish: Hola, ¿cómo estás? === Me llamo Ana y estudio español todos los días.",
+    ]),
+    ("create", [
+        "Save a note about the Spanish subjunctive: it expresses wishes, doubts and hypotheticals, "
+        "and is usually triggered by 'que' after verbs like querer, esperar or dudar.",
+    ]),
+    ("search", [
+        "What do my notes say about the Spanish subjunctive?",
+    ]),
+    ("overwrite", [
+        "Update my note about the Spanish subjunctive and merge in this: "
+        "common irregular forms are sea, vaya, haya and sepa.",
+    ]),
+]
+
+
+def _prepare_workdir() -> str:
+    """切到全新的临时目录，并关闭会干扰计时的缓存/后台写入 (必须在导入项目模块之前调用)"""
+    workdir = tempfile.mkdtemp(prefix="bench_agent_")
+    os.chdir(workdir)
+    os.environ.setdefault("LLM_CACHE", "0")
+    os.environ.setdefault("WRITE_QUEUE", "0")
+    os.environ["TRACE_LOG_PATH"] = os.path.join(workdir, "traces.jsonl")
+    os.environ["ROUTER_LOG_PATH"] = os.path.join(workdir, "routing.jsonl")
+    os.environ["CHECKPOINT_DB_PATH"] = os.path.join(workdir, "checkpoints.db")
+    return workdir
+
+
+def _total_requests(pool_stats) -> int:
+    return sum(s["requests"] for s in pool_stats().values())
+
+
+def run_suite() -> list:
+    from agent_graph import run_agent
+    from http_pool import pool_stats
+    from tracing import get_trace
+
+    rows = []
+    for name, turns in SCENARIOS:
+        thread_id = f"bench-{name}"
+        for i, user_input in enumerate(turns):
+            requests_before = _total_requests(pool_stats)
+            cpu_start = time.process_time()
+            wall_start = time.perf_counter()
+            result = run_agent(user_input, thread_id=thread_id)
+            wall_ms = (time.perf_counter() - wall_start) * 1000
+            cpu_ms = (time.process_time() - cpu_start) * 1000
+
+            spans = get_trace(result.get("trace_id", ""))
+            rows.append({
+                "scenario": name,
+                "turn": i + 1,
+                "type": result.get("type"),
+                "wall_ms": round(wall_ms, 1),
+                "cpu_ms": round(cpu_ms, 1),
+                "llm_calls": sum(1 for s in spans if s["name"].startswith("llm.")),
+                "tool_calls": sum(1 for s in spans if s["name"].startswith("tool.")),
+                "http_requests": _total_requests(pool_stats) - requests_before,
+            })
+    return rows
+
+
+def print_report(rows: list, header: str):
+    print(f"\n{header}")
+    print(f"{'scenario':<10} {'turn':>4} {'type':<10} {'wall ms':>9} {'cpu ms':>8} {'llm':>4} {'tools':>5} {'http':>5}")
+    for r in rows:
+        print(
+            f"{r['scenario']:<10} {r['turn']:>4} {str(r['type']):<10} {r['wall_ms']:>9.1f} "
+            f"{r['cpu_ms']:>8.1f} {r['llm_calls']:>4} {r['tool_calls']:>5} {r['http_requests']:>5}"
+        )
+    print(f"{'total':<10} {'':>4} {'':<10} {sum(r['wall_ms'] for r in rows):>9.1f} {sum(r['cpu_ms'] for r in rows):>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--record", metavar="FIXTURE_DIR", help="run against real services and save a fixture")
+    mode.add_argument("--replay", metavar="FIXTURE_DIR", help="replay a fixture offline")
+    parser.add_argument("--latency", default="recorded", help="'recorded' or a fixed latency in ms per call")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="multiplier for recorded latencies")
+    parser.add_argument("--json", metavar="PATH", help="also write the rows as JSON")
+    args = parser.parse_args()
+
+    fixture_dir = os.path.abspath(args.record or args.replay)
+    if args.replay and not os.path.exists(os.path.join(fixture_dir, "http.jsonl")):
+        parser.exit(2, f"❌ No fixture at {fixture_dir}. No fixture is shipped with the repo; record one first with "
+                       f"real API keys:\n    python benchmarks/bench_agent.py --record {args.replay}\n")
+    json_path = os.path.abspath(args.json) if args.json else None
+    workdir = _prepare_workdir()
+    print(f"📂 Workdir: {workdir}")
+
+    import replay
+
+    if args.record:
+        with replay.record(fixture_dir):
+            rows = run_suite()
+        header = f"🔴 Recorded suite -> {fixture_dir}"
+    else:
+        latency = args.latency if args.latency == "recorded" else float(args.latency)
+        with replay.replay(fixture_dir, latency=latency, latency_scale=args.latency_scale) as replayer:
+            rows = run_suite()
+        header = f"▶️ Replayed {fixture_dir} (latency={args.latency}, scale={args.latency_scale}) · matches {replayer.stats}"
+
+    print_report(rows, header)
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+Markdown -> Notion Blocks 解析基准 (pytest-benchmark)
+
+大文档批量导入时 markdown_to_blocks / parse_rich_text 是主要的 CPU 开销。
+用确定性生成的"真实"笔记 (标题 / 段落 / 行内样式 / 列表 / Callout / 代码 / 表格 / 公式，
+西语 + 中文 + 英文混排) 测量 1 KB ~ 10 MB 文档的解析吞吐，并设置回归下限：
+- 每个用例断言吞吐 (MB/s) 不低于 MIN_MB_PER_S × BENCH_THRESHOLD_SCALE
+  (慢机器 / CI 上可用 BENCH_THRESHOLD_SCALE=0.5 放宽)
+- 与保存的基线对比: --benchmark-compare --benchmark-compare-fail=mean:15%
+另有一个不依赖 pytest-benchmark 的往返检查：markdown -> blocks -> markdown -> blocks 结果不变。
+
+用法:
+    pip install pytest-benchmark
+    pytest benchmarks/bench_markdown.py --benchmark-only
+    pytest benchmarks/bench_markdown.py --benchmark-autosave                      # 保存基线
+    pytest benchmarks/bench_markdown.py --benchmark-compare --benchmark-compare-fail=mean:15%
+"""
+import os
+import sys
+import random
+from functools import lru_cache
+
+import pytest
+
+try:
+    import pytest_benchmark  # noqa: F401
+    HAS_BENCHMARK = True
+except ImportError:
+    HAS_BENCHMARK = False
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("NOTION_RATE_LIMIT", "0")
+
+from notion_ops import markdown_to_blocks, blocks_to_markdown, parse_rich_text, _flush_table  # noqa: E402
+
+requires_benchmark = pytest.mark.skipif(not HAS_BENCHMARK, reason="pytest-benchmark not installed")
+
+SIZES = {"1KB": 1 << 10, "100KB": 100 << 10, "1MB": 1 << 20, "10MB": 10 << 20}
+# 大文档单轮就要数秒，少跑几轮
+ROUNDS = {"1KB": 200, "100KB": 20, "1MB": 5, "10MB": 2}
+THRESHOLD_SCALE = float(os.environ.get("BENCH_THRESHOLD_SCALE", "1.0"))
+# 各用例的吞吐下限 (MB/s)，按单核 ~3 GHz 机器实测值的一半左右设置
+MIN_MB_PER_S = {
+    "markdown_to_blocks": 4.0,
+    "parse_rich_text": 8.0,
+    "tables": 2.0,
+}
+
+WORDS = (
+    "el aprendizaje de idiomas requiere práctica diaria paciencia y exposición al contenido auténtico "
+    "subjuntivo expresa deseos dudas hipótesis the vector store keeps embeddings for semantic search "
+    "notion pages are split into blocks 学习 语言 需要 每天 练习 知识 管理 笔记 向量 检索"
+).split()
+CODE_SAMPLE = [
+    "def merge(a, b):",
+    "    # 合并两个有序列表",
+    "    out = []",
+    "    while a and b:",
+    "        out.append(a.pop(0) if a[0] < b[0] else b.pop(0))",
+    "    return out + a + b",
+]
+
+
+def _sentence(rng: random.Random) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(6, 18))]
+    for _ in range(rng.randint(0, 3)):
+        i = rng.randrange(len(words))
+        style = rng.random()
+        if style < 0.35:
+            words[i] = f"**{words[i]}**"
+        elif style < 0.6:
+            words[i] = f"`{words[i]}`"
+        elif style < 0.75:
+            words[i] = f"[{words[i]}](https://example.com/{words[i]})"
+        elif style < 0.9:
+            words[i] = f"=={words[i]}=="
+        else:
+            words[i] = f"$x_{i}^2$"
+    return " ".join(words).capitalize() + "."
+
+
+# 往返检查用的笔记：覆盖 markdown_to_blocks 支持的所有 block 与行内样式
+ROUND_TRIP_NOTE = """# Apuntes de español · 学习笔记
+
+## 1. El subjuntivo
+
+El **subjuntivo** expresa deseos, `dudas` e ==hipótesis==. Ver [RAE](https://www.rae.es) y $x_i^2$.
+
+> 💡 Regla: *ojalá* siempre va con subjuntivo.
+> Cita sin emoji: la práctica hace al maestro.
+
+- Ojalá **que** llueva
+- Espero que `vengas`
+1. Primero: *querer*
+2. Segundo: [ver](https://example.com/ver)
+
+| Término | Significado | Ejemplo |
+|---|---|---|
+| **ser** | to be | `soy` |
+| estar | 状态 | ==estoy== |
+
+```python
+def merge(a, b):
+    return sorted(a + b)
+```
+
+$$
+\\sum_{i=1}^{n} x_i^2
+$$
+
+### 2. Vocabulario
+
+Texto final con **negrita** y `código con espacios `.
+"""
+
+
+def _section(rng: random.Random, index: int) -> str:
+    lines = [f"## {index}. {_sentence(rng)[:40]}", "", " ".join(_sentence(rng) for _ in range(rng.randint(2, 5))), ""]
+    kind = rng.random()
+    if kind < 0.3:
+        lines += [f"- {_sentence(rng)}" for _ in range(rng.randint(2, 6))]
+    elif kind < 0.5:
+        lines += [f"{i + 1}. {_sentence(rng)}" for i in range(rng.randint(2, 6))]
+    elif kind < 0.6:
+        lines += ["```python", *CODE_SAMPLE, "```"]
+    elif kind < 0.7:
+        lines += ["| Término | Significado | Ejemplo |", "|---|---|---|"]
+        lines += [f"| **{rng.choice(WORDS)}** | {rng.choice(WORDS)} | `{rng.choice(WORDS)}` |" for _ in range(rng.randint(3, 8))]
+    elif kind < 0.8:
+        lines += ["$$", "\\sum_{i=1}^{n} x_i^2", "$$"]
+    else:
+        lines += [f"> 💡 {_sentence(rng)}", f"> {_sentence(rng)}"]
+    lines.append("")
+    return "\n".join(lines)
+
+
+@lru_cache(maxsize=None)
+def make_document(size: int, seed: int = 7) -> str:
+    """生成约 size 字节 (UTF-8) 的 Markdown 笔记，同一参数结果固定"""
+    rng = random.Random(seed)
+    parts = ["# Apuntes de español · 学习笔记", ""]
+    total = 0
+    index = 1
+    while total < size:
+        section = _section(rng, index)
+        parts.append(section)
+        total += len(section.encode("utf-8"))
+        index += 1
+    return "\n".join(parts)
+
+
+@lru_cache(maxsize=None)
+def make_inline_lines(size: int) -> tuple:
+    rng = random.Random(11)
+    lines, total = [], 0
+    while total < size:
+        line = " ".join(_sentence(rng) for _ in range(3))
+        lines.append(line)
+        total += len(line.encode("utf-8"))
+    return tuple(lines)
+
+
+@lru_cache(maxsize=None)
+def make_table_rows(size: int) -> tuple:
+    rng = random.Random(13)
+    rows, total = [], 0
+    while total < size:
+        row = [f"**{rng.choice(WORDS)}**", _sentence(rng), f"`{rng.choice(WORDS)}`", ""]
+        rows.append(row)
+        total += sum(len(c.encode("utf-8")) for c in row)
+    return tuple(rows)
+
+
+def _check_throughput(benchmark, name: str, nbytes: int):
+    stats = getattr(benchmark, "stats", None)
+    if not stats:  # --benchmark-disable 时只跑一次，没有统计
+        return
+    mb_per_s = nbytes / (1 << 20) / stats.stats.mean
+    benchmark.extra_info["mb_per_s"] = round(mb_per_s, 2)
+    floor = MIN_MB_PER_S[name] * THRESHOLD_SCALE
+    assert mb_per_s >= floor, f"{name}: {mb_per_s:.2f} MB/s is below the regression floor of {floor:.2f} MB/s"
+
+
+@requires_benchmark
+@pytest.mark.parametrize("label", list(SIZES))
+def test_markdown_to_blocks(benchmark, label):
+    document = make_document(SIZES[label])
+    blocks = benchmark.pedantic(markdown_to_blocks, args=(document,), rounds=ROUNDS[label], iterations=1, warmup_rounds=1)
+    assert blocks and blocks[0]["type"] == "heading_1"
+    assert {"paragraph", "code", "table", "equation"} <= {b["type"] for b in blocks} or label == "1KB"
+    _check_throughput(benchmark, "markdown_to_blocks", len(document.encode("utf-8")))
+
+
+@requires_benchmark
+@pytest.mark.parametrize("label", ["1KB", "100KB", "1MB"])
+def test_parse_rich_text(benchmark, label):
+    lines = make_inline_lines(SIZES[label])
+
+    def run():
+        return [parse_rich_text(line) for line in lines]
+
+    spans = benchmark.pedantic(run, rounds=ROUNDS[label], iterations=1, warmup_rounds=1)
+    assert all(spans)
+    _check_throughput(benchmark, "parse_rich_text", sum(len(line.encode("utf-8")) for line in lines))
+
+
+@requires_benchmark
+@pytest.mark.parametrize("label", ["100KB", "1MB"])
+def test_flush_table(benchmark, label):
+    rows = make_table_rows(SIZES[label])
+    table = benchmark.pedantic(_flush_table, args=([list(r) for r in rows],), rounds=ROUNDS[label], iterations=1,
+                               warmup_rounds=1)
+    assert table["table"]["table_width"] == 4
+    _check_throughput(benchmark, "tables", sum(len(c.encode("utf-8")) for r in rows for c in r))
+
+
+def test_round_trip():
+    """blocks_to_markdown 是 markdown_to_blocks 的逆过程：导出再导入得到相同的 blocks"""
+    blocks = markdown_to_blocks(ROUND_TRIP_NOTE)
+    assert {"heading_1", "heading_2", "heading_3", "paragraph", "callout", "quote", "bulleted_list_item",
+            "numbered_list_item", "table", "code", "equation"} <= {b["type"] for b in blocks}
+    assert markdown_to_blocks(blocks_to_markdown(blocks)) == blocks
@@ -0,0 +1,204 @@
+"""
+持久化会话记忆 (SQLite Checkpointer)
+
+替代进程内的 MemorySaver：
+- SQLite + WAL，重启后会话可直接从最新 checkpoint 恢复
+- 每个 thread 只保留最近 N 条消息 (trim_thread_messages)
+- 超过 TTL 未活跃的 thread 整体删除
+- 定期压缩历史 checkpoint，只保留每个 thread 最新的几个
+"""
+import os
+import time
+import asyncio
+import sqlite3
+import threading
+from typing import Any, Dict
+
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langchain_core.messages import HumanMessage, SystemMessage, RemoveMessage
+
+CHECKPOINT_DB_PATH = os.environ.get("CHECKPOINT_DB_PATH", "./checkpoints.db")
+THREAD_TTL_SECONDS = float(os.environ.get("THREAD_TTL_HOURS", "72")) * 3600
+MAX_THREAD_MESSAGES = int(os.environ.get("MAX_THREAD_MESSAGES", "40"))
+CHECKPOINTS_PER_THREAD = int(os.environ.get("CHECKPOINTS_PER_THREAD", "2"))
+MAINTENANCE_EVERY = 200  # 每写入多少个 checkpoint 做一次维护
+
+
+class BoundedSqliteSaver(SqliteSaver):
+    """
+    带 TTL 淘汰与 checkpoint 压缩的 SqliteSaver
+    async 接口委托给线程池中的同步实现，便于 astream/astream_events 使用
+    """
+
+    def __init__(
+        self,
+        conn: sqlite3.Connection,
+        *,
+        ttl_seconds: float = THREAD_TTL_SECONDS,
+        keep_checkpoints: int = CHECKPOINTS_PER_THREAD,
+        **kwargs,
+    ):
+        super().__init__(conn, **kwargs)
+        self.ttl_seconds = ttl_seconds
+        self.keep_checkpoints = max(1, keep_checkpoints)
+        self._puts_since_maintenance = 0
+        self._maintenance_lock = threading.Lock()
+
+    def setup(self) -> None:
+        if self.is_setup:
+            return
+        super().setup()
+        self.conn.executescript(
+            """
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS thread_activity (
+                thread_id TEXT PRIMARY KEY,
+                last_seen REAL NOT NULL
+            );
+            """
+        )
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        saved = super().put(config, checkpoint, metadata, new_versions)
+        with self.cursor() as cur:
+            cur.execute(
+                "INSERT OR REPLACE INTO thread_activity (thread_id, last_seen) VALUES (?, ?)",
+                (str(config["configurable"]["thread_id"]), time.time()),
+            )
+
+        self._puts_since_maintenance += 1
+        if self._puts_since_maintenance >= MAINTENANCE_EVERY:
+            self._puts_since_maintenance = 0
+            self.maintenance()
+        return saved
+
+    def delete_thread(self, thread_id: str) -> None:
+        super().delete_thread(thread_id)
+        with self.cursor() as cur:
+            cur.execute("DELETE FROM thread_activity WHERE thread_id = ?", (str(thread_id),))
+
+    # ==========================================
+    # 🧹 维护操作
+    # ==========================================
+
+    def evict_idle_threads(self, ttl_seconds: float = None) -> int:
+        """删除超过 TTL 未活跃的 thread，返回删除数量"""
+        cutoff = time.time() - (ttl_seconds if ttl_seconds is not None else self.ttl_seconds)
+        with self.cursor() as cur:
+            cur.execute("SELECT thread_id FROM thread_activity WHERE last_seen < ?", (cutoff,))
+            stale = [row[0] for row in cur.fetchall()]
+        for thread_id in stale:
+            self.delete_thread(thread_id)
+        return len(stale)
+
+    def compact(self, keep: int = None) -> int:
+        """每个 (thread, ns) 只保留最新的 keep 个 checkpoint 及其 writes，返回删除数量"""
+        keep = keep or self.keep_checkpoints
+        with self.cursor() as cur:
+            cur.execute(
+                """
+                DELETE FROM checkpoints WHERE rowid IN (
+                    SELECT rowid FROM (
+                        SELECT rowid, ROW_NUMBER() OVER (
+                            PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC
+                        ) AS rn
+                        FROM checkpoints
+                    ) WHERE rn > ?
+                )
+                """,
+                (keep,),
+            )
+            removed = cur.rowcount
+            cur.execute(
+                """
+                DELETE FROM writes WHERE NOT EXISTS (
+                    SELECT 1 FROM checkpoints c
+                    WHERE c.thread_id = writes.thread_id
+                      AND c.checkpoint_ns = writes.checkpoint_ns
+                      AND c.checkpoint_id = writes.checkpoint_id
+                )
+                """
+            )
+        return removed
+
+    def maintenance(self) -> Dict[str, int]:
+        """TTL 淘汰 + 压缩 + 截断 WAL"""
+        if not self._maintenance_lock.acquire(blocking=False):
+            return {}
+        try:
+            evicted = self.evict_idle_threads()
+            compacted = self.compact()
+            with self.cursor() as cur:
+                cur.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            if evicted or compacted:
+                print(f"🧹 [Checkpoint] Evicted {evicted} idle threads, compacted {compacted} checkpoints.")
+            return {"evicted_threads": evicted, "compacted_checkpoints": compacted}
+        except Exception as e:
+            print(f"⚠️ Checkpoint maintenance failed: {e}")
+            return {}
+        finally:
+            self._maintenance_lock.release()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.cursor(transaction=False) as cur:
+            threads = cur.execute("SELECT COUNT(*) FROM thread_activity").fetchone()[0]
+            checkpoints = cur.execute("SELECT COUNT(*) FROM checkpoints").fetchone()[0]
+            writes = cur.execute("SELECT COUNT(*) FROM writes").fetchone()[0]
+        return {"threads": threads, "checkpoints": checkpoints, "writes": writes}
+
+    # ==========================================
+    # ⚡ Async 接口 (委托同步实现)
+    # ==========================================
+
+    async def aget_tuple(self, config):
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        items = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for item in items:
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id):
+        return await asyncio.to_thread(self.delete_thread, thread_id)
+
+
+def create_checkpointer(path: str = CHECKPOINT_DB_PATH) -> BoundedSqliteSaver:
+    """创建持久化 checkpointer，并在启动时做一次维护"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False)
+    saver = BoundedSqliteSaver(conn)
+    saver.maintenance()
+    return saver
+
+
+def trim_thread_messages(graph, config: Dict, max_messages: int = MAX_THREAD_MESSAGES) -> int:
+    """
+    把 thread 的消息窗口裁剪到最近 max_messages 条。
+    裁剪点对齐到一轮对话的开头 (System/HumanMessage)，避免留下孤立的 ToolMessage。
+    返回删除的消息数量。
+    """
+    state = graph.get_state(config)
+    messages = (state.values or {}).get("messages", []) if state else []
+    if len(messages) <= max_messages:
+        return 0
+
+    cut = len(messages) - max_messages
+    while cut < len(messages) and not isinstance(messages[cut], (HumanMessage, SystemMessage)):
+        cut += 1
+    if cut >= len(messages):
+        return 0
+
+    graph.update_state(
+        config,
+        {"messages": [RemoveMessage(id=m.id) for m in messages[:cut]]},
+        as_node="agent",
+    )
+    return cut
@@ -0,0 +1,229 @@
+"""
+上传文档的临时检索索引
+
+大文件不再整段塞进 prompt：按段落切块，批量向量化后存入进程内的临时
+Chroma 集合 (以文件内容哈希为键，多个会话共享)，Agent 通过
+search_uploaded_document 工具按需取回相关段落。
+向量化失败时自动退回 BM25 词法检索。
+"""
+import os
+import re
+import math
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional
+
+import chromadb
+
+from vector_ops import EMBEDDING_FUNC
+from text_store import TextHandle, TextLike, text_sha256
+
+CHUNK_CHARS = 1200          # 每个段落块的目标长度
+CHUNK_OVERLAP = 200         # 相邻块的重叠字符数
+EMBED_BATCH_SIZE = 128      # 每次向量化请求包含的块数
+MAX_CACHED_DOCS = 8         # 同时保留的文档索引数量
+WINDOW_CHARS = 256 * 1024   # TextHandle 每次读入的字符数
+DOC_INDEX_MODE = os.environ.get("DOC_INDEX_MODE", "embedding")  # embedding / lexical
+
+TOKEN_PATTERN = re.compile(r"[一-鿿]|[^\W_]+", re.UNICODE)
+
+_scratch_client = chromadb.EphemeralClient()
+
+
+def content_hash(text: TextLike) -> str:
+    return text_sha256(text)[:16]
+
+
+def chunk_text(text: str, chunk_chars: int = CHUNK_CHARS, overlap: int = CHUNK_OVERLAP) -> List[Dict]:
+    """
+    按段落贪心切块，过长的段落再硬切。返回 [{"text", "start"}]
+    """
+    chunks = []
+    buf, buf_start, pos = [], 0, 0
+    buf_len = 0
+
+    def _emit():
+        if buf:
+            chunks.append({"text": "\n".join(buf).strip(), "start": buf_start})
+
+    for para in re.split(r"\n\s*\n", text):
+        para_start = text.find(para, pos) if para else pos
+        pos = para_start + len(para)
+        if not para.strip():
+            continue
+
+        # 超长段落：按固定窗口切开
+        while len(para) > chunk_chars:
+            _emit()
+            buf, buf_len = [], 0
+            chunks.append({"text": para[:chunk_chars].strip(), "start": para_start})
+            para = para[chunk_chars - overlap:]
+            para_start += chunk_chars - overlap
+
+        if buf_len + len(para) > chunk_chars and buf:
+            _emit()
+            # 用上一块的结尾作为重叠上下文
+            tail = buf[-1][-overlap:] if overlap else ""
+            buf, buf_len = ([tail] if tail else []), len(tail)
+            buf_start = para_start - len(tail)
+        if not buf:
+            buf_start = para_start
+        buf.append(para)
+        buf_len += len(para)
+
+    _emit()
+    return [c for c in chunks if c["text"]]
+
+
+def chunk_source(source: TextLike, chunk_chars: int = CHUNK_CHARS, overlap: int = CHUNK_OVERLAP) -> List[Dict]:
+    """
+    chunk_text 的通用版本：TextHandle 按段落边界分窗读取后逐窗切块，
+    全文不会整体读入内存 (窗口之间不做重叠)
+    """
+    if not isinstance(source, TextHandle):
+        return chunk_text(source, chunk_chars, overlap)
+    chunks = []
+    for window_start, window in source.iter_windows(WINDOW_CHARS):
+        for c in chunk_text(window, chunk_chars, overlap):
+            c["start"] += window_start
+            chunks.append(c)
+    return chunks
+
+
+def _tokenize(text: str) -> List[str]:
+    return [t.lower() for t in TOKEN_PATTERN.findall(text)]
+
+
+class _BM25:
+    """极简 BM25，用作向量化失败时的退路"""
+
+    def __init__(self, docs: List[str], k1: float = 1.5, b: float = 0.75):
+        self.k1, self.b = k1, b
+        self.tfs = [Counter(_tokenize(d)) for d in docs]
+        self.lengths = [sum(tf.values()) for tf in self.tfs]
+        self.avg_len = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0
+        df = Counter()
+        for tf in self.tfs:
+            df.update(tf.keys())
+        n = len(docs)
+        self.idf = {t: math.log(1 + (n - f + 0.5) / (f + 0.5)) for t, f in df.items()}
+
+    def search(self, query: str, k: int) -> List[tuple]:
+        terms = _tokenize(query)
+        scores = []
+        for i, tf in enumerate(self.tfs):
+            score = 0.0
+            for t in terms:
+                if t not in tf:
+                    continue
+                freq = tf[t]
+                norm = 1 - self.b + self.b * self.lengths[i] / (self.avg_len or 1)
+                score += self.idf.get(t, 0) * freq * (self.k1 + 1) / (freq + self.k1 * norm)
+            if score > 0:
+                scores.append((score, i))
+        scores.sort(reverse=True)
+        return scores[:k]
+
+
+class DocumentIndex:
+    """单个上传文档的索引"""
+
+    def __init__(self, text: TextLike, name: str = None):
+        self.doc_hash = content_hash(text)
+        self.name = name or self.doc_hash
+        self.total_chars = len(text)
+        self.chunks = chunk_source(text)
+        self.collection = None
+        self.bm25 = None
+        self._build()
+
+    def _build(self):
+        texts = [c["text"] for c in self.chunks]
+        if DOC_INDEX_MODE == "embedding":
+            try:
+                self.collection = _scratch_client.get_or_create_collection(
+                    name=f"upload_{self.doc_hash}",
+                    embedding_function=EMBEDDING_FUNC,
+                    metadata={"hnsw:space": "cosine"},
+                )
+                if self.collection.count() != len(texts):
+                    for i in range(0, len(texts), EMBED_BATCH_SIZE):
+                        batch = texts[i : i + EMBED_BATCH_SIZE]
+                        self.collection.add(
+                            documents=batch,
+                            ids=[str(j) for j in range(i, i + len(batch))],
+                        )
+                print(f"📑 Indexed upload {self.doc_hash}: {len(texts)} chunks (embedding)")
+                return
+            except Exception as e:
+                print(f"⚠️ Embedding index failed, falling back to lexical: {e}")
+                self.collection = None
+
+        self.bm25 = _BM25(texts)
+        print(f"📑 Indexed upload {self.doc_hash}: {len(texts)} chunks (lexical)")
+
+    def search(self, query: str, k: int = 4) -> List[Dict]:
+        k = max(1, min(k, len(self.chunks)))
+        if not self.chunks:
+            return []
+
+        if self.collection is not None:
+            try:
+                results = self.collection.query(query_texts=[query], n_results=k)
+                return [
+                    {"chunk": int(cid), "score": round(1 - dist, 4), **self.chunks[int(cid)]}
+                    for cid, dist in zip(results["ids"][0], results["distances"][0])
+                ]
+            except Exception as e:
+                print(f"⚠️ Upload vector search failed, using lexical: {e}")
+                if self.bm25 is None:
+                    self.bm25 = _BM25([c["text"] for c in self.chunks])
+
+        return [
+            {"chunk": i, "score": round(score, 4), **self.chunks[i]}
+            for score, i in self.bm25.search(query, k)
+        ]
+
+    def drop(self):
+        if self.collection is not None:
+            try:
+                _scratch_client.delete_collection(self.collection.name)
+            except Exception:
+                pass
+
+
+# ==========================================
+# 🗂️ 注册表：文件哈希 -> 索引，thread_id -> 文件哈希
+# ==========================================
+
+_lock = threading.Lock()
+_indexes: "OrderedDict[str, DocumentIndex]" = OrderedDict()
+_thread_docs: Dict[str, str] = {}
+
+
+def index_document(text: TextLike, name: str = None) -> DocumentIndex:
+    """获取 (或构建) 文档索引，相同内容只构建一次"""
+    doc_hash = content_hash(text)
+    with _lock:
+        if doc_hash in _indexes:
+            _indexes.move_to_end(doc_hash)
+            return _indexes[doc_hash]
+
+    index = DocumentIndex(text, name)
+    with _lock:
+        _indexes[doc_hash] = index
+        while len(_indexes) > MAX_CACHED_DOCS:
+            _, evicted = _indexes.popitem(last=False)
+            evicted.drop()
+    return index
+
+
+def bind_thread(thread_id: str, index: DocumentIndex):
+    with _lock:
+        _thread_docs[thread_id] = index.doc_hash
+
+
+def get_thread_index(thread_id: str) -> Optional[DocumentIndex]:
+    with _lock:
+        doc_hash = _thread_docs.get(thread_id)
+        return _indexes.get(doc_hash) if doc_hash else None
@@ -0,0 +1,220 @@
+"""
+Notion -> Markdown 导出 (Backup / Export)
+
+把三个数据库的全部页面导出为一个目录下的 Markdown 文件，用于备份与离线重建索引：
+- 每个页面读取完整 block 树 (分页 + 递归子块)，由 notion_ops.blocks_to_markdown 转换
+- 页面读取在线程池中并发执行，所有请求走共享限流器 (bulk 优先级，不挤占对话中的调用)
+- 增量导出：目录下的 .export_manifest.json 记录每页的 last_edited_time，
+  只重新导出上次之后编辑过的页面；已删除 / 改名的页面同步删除旧文件
+
+目录结构:
+    <out_dir>/<Domain>/<标题>-<page_id 前 8 位>.md   (带 YAML front matter)
+    <out_dir>/.export_manifest.json
+
+用法:
+    python export_ops.py backups/notion [--full] [--workers 4]
+"""
+import os
+import re
+import json
+import time
+import argparse
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+import notion_ops
+from rate_limit import map_with_priority
+from tracing import span
+
+EXPORT_WORKERS = int(os.environ.get("EXPORT_WORKERS", "4"))
+MANIFEST_NAME = ".export_manifest.json"
+MAX_SLUG_CHARS = 60
+EDIT_TIME_GRANULARITY = timedelta(minutes=1)  # last_edited_time 只精确到分钟
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def slugify(title: str) -> str:
+    """文件名：保留各语言的文字与数字，其余替换为 -"""
+    slug = re.sub(r"[^\w]+", "-", title, flags=re.UNICODE).strip("-_")
+    return slug[:MAX_SLUG_CHARS].rstrip("-_") or "untitled"
+
+
+def _yaml_str(value: str) -> str:
+    return json.dumps(value, ensure_ascii=False)  # JSON 字符串同时是合法的 YAML 标量
+
+
+def render_page(page: Dict, domain: str, body: str) -> str:
+    tags = ", ".join(_yaml_str(t) for t in notion_ops.page_tags(page))
+    front_matter = [
+        "---",
+        f"title: {_yaml_str(notion_ops.page_title(page))}",
+        f"page_id: {page['id']}",
+        f"url: {page.get('url', '')}",
+        f"domain: {domain}",
+        f"tags: [{tags}]",
+        f"created_time: {page.get('created_time', '')}",
+        f"last_edited_time: {page.get('last_edited_time', '')}",
+        "---",
+        "",
+    ]
+    return "\n".join(front_matter) + body.rstrip() + "\n"
+
+
+def _write_atomic(path: str, text: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class NotionExporter:
+    def __init__(self, out_dir: str, workers: int = EXPORT_WORKERS, full: bool = False):
+        self.out_dir = out_dir
+        self.workers = workers
+        self.full = full
+        self.manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self) -> Dict[str, Any]:
+        try:
+            with open(self.manifest_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {"last_run": None, "pages": {}}
+
+    def _save_manifest(self):
+        _write_atomic(self.manifest_path, json.dumps(self.manifest, ensure_ascii=False, indent=1))
+
+    def _needs_export(self, page: Dict, path: str) -> bool:
+        if self.full:
+            return True
+        entry = self.manifest["pages"].get(page["id"])
+        if not entry or entry.get("path") != path or not os.path.exists(os.path.join(self.out_dir, path)):
+            return True
+        if entry.get("last_edited_time") != page.get("last_edited_time"):
+            return True
+        # 编辑时间只精确到分钟：上次导出与最后编辑落在同一分钟内时，导出之后的改动看不出来
+        edited, exported = _parse_time(page.get("last_edited_time")), _parse_time(entry.get("exported_at"))
+        return not (edited and exported and exported >= edited + EDIT_TIME_GRANULARITY)
+
+    def _export_page(self, job: Dict) -> Dict:
+        started = time.perf_counter()
+        try:
+            body = notion_ops.get_page_markdown(job["page"]["id"])
+            _write_atomic(os.path.join(self.out_dir, job["path"]), render_page(job["page"], job["domain"], body))
+        except Exception as e:
+            return dict(job, error=str(e))
+        return dict(job, seconds=time.perf_counter() - started, chars=len(body))
+
+    def run(self) -> Dict[str, Any]:
+        start = time.perf_counter()
+        report = {"out_dir": self.out_dir, "full": self.full, "pages": 0, "exported": [], "unchanged": 0,
+                  "deleted": [], "errors": []}
+        with span("export.run", full=self.full):
+            # 1. 列出所有页面 (只有属性)，决定哪些需要导出
+            jobs: List[Dict] = []
+            listed = set()
+            complete = True
+            by_database: Dict[str, List[str]] = {}
+            for domain, database_id in notion_ops.domain_databases():
+                if database_id:
+                    by_database.setdefault(database_id, []).append(domain)
+            for database_id, domains in by_database.items():
+                try:
+                    pages = list(notion_ops.list_database_pages(database_id))
+                except Exception as e:
+                    complete = False
+                    report["errors"].append({"database_id": database_id, "stage": "list", "error": str(e)})
+                    print(f"❌ [Export] Failed to list database {database_id}: {e}")
+                    continue
+                for page in pages:
+                    if notion_ops.is_page_deleted(page):
+                        continue
+                    # 多个 domain 共用一个数据库时按 Tags 中的分类归档
+                    domain = next((t for t in notion_ops.page_tags(page) if t in domains), domains[0])
+                    filename = f"{slugify(notion_ops.page_title(page))}-{page['id'].replace('-', '')[:8]}.md"
+                    path = os.path.join(domain, filename)
+                    listed.add(page["id"])
+                    if self._needs_export(page, path):
+                        jobs.append({"page": page, "domain": domain, "path": path})
+                    else:
+                        report["unchanged"] += 1
+            report["pages"] = len(listed)
+            print(f"📤 [Export] {len(listed)} pages listed, {len(jobs)} to export ({report['unchanged']} unchanged)")
+
+            # 2. 并发读取 block 树并写文件
+            exported_at = _now_iso()
+            for result in map_with_priority(self._export_page, jobs, self.workers):
+                page = result["page"]
+                title = notion_ops.page_title(page)
+                if "error" in result:
+                    report["errors"].append({"page_id": page["id"], "title": title, "stage": "export", "error": result["error"]})
+                    continue
+                previous = self.manifest["pages"].get(page["id"])
+                if previous and previous.get("path") != result["path"]:
+                    _remove(os.path.join(self.out_dir, previous["path"]))  # 标题改了，删掉旧文件名
+                self.manifest["pages"][page["id"]] = {
+                    "path": result["path"],
+                    "title": title,
+                    "last_edited_time": page.get("last_edited_time"),
+                    "exported_at": exported_at,
+                }
+                report["exported"].append({"page_id": page["id"], "title": title, "path": result["path"],
+                                           "chars": result["chars"]})
+
+            # 3. 数据库里已经没有的页面：删除导出文件 (列表不完整时跳过)
+            if complete:
+                for page_id in [pid for pid in self.manifest["pages"] if pid not in listed]:
+                    entry = self.manifest["pages"].pop(page_id)
+                    _remove(os.path.join(self.out_dir, entry["path"]))
+                    report["deleted"].append({"page_id": page_id, "title": entry.get("title"), "path": entry["path"]})
+
+            self.manifest["last_run"] = exported_at
+            self._save_manifest()
+
+        report["seconds"] = round(time.perf_counter() - start, 1)
+        rate = len(report["exported"]) / report["seconds"] if report["seconds"] else 0.0
+        print(f"✅ [Export] {len(report['exported'])} exported · {report['unchanged']} unchanged · "
+              f"{len(report['deleted'])} deleted · {len(report['errors'])} errors · "
+              f"{report['seconds']}s ({rate:.1f} pages/s)")
+        return report
+
+
+def export_databases(out_dir: str, workers: int = EXPORT_WORKERS, full: bool = False) -> Dict[str, Any]:
+    return NotionExporter(out_dir, workers=workers, full=full).run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the Notion databases to a directory of Markdown files")
+    parser.add_argument("out_dir", help="export directory (re-runs only export pages edited since the last run)")
+    parser.add_argument("--full", action="store_true", help="re-export every page")
+    parser.add_argument("--workers", type=int, default=EXPORT_WORKERS, help="concurrent page fetches")
+    args = parser.parse_args()
+
+    report = export_databases(args.out_dir, workers=args.workers, full=args.full)
+    for err in report["errors"][:10]:
+        print(f"   ❌ {err.get('title') or err.get('database_id')}: {err['error']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+上传文件的解析结果缓存 (Extraction Cache)
+
+Streamlit 每次交互都会重跑整个脚本，大 PDF / EPUB 不应每次都重新解析。
+以文件内容的 sha256 为键，两级缓存：
+- 磁盘目录 : <sha256>.txt (UTF-8)，进程重启后仍可用，按总字节数淘汰最久未访问的文件
+- 内存 LRU : 只记录每个文件的字符数 / 偏移索引 (不放全文)，命中时连扫描都省掉
+命中时把缓存文件硬链接到会话目录并返回 TextHandle，同一文件重复上传 / 页面重绘时完全跳过解析。
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+from text_store import TextHandle, open_text, link_or_copy
+
+EXTRACT_CACHE_ENABLED = os.environ.get("EXTRACT_CACHE", "1") != "0"
+EXTRACT_CACHE_DIR = os.environ.get("EXTRACT_CACHE_DIR", "./extract_cache")
+EXTRACT_CACHE_MAX_MB = float(os.environ.get("EXTRACT_CACHE_MAX_MB", "512"))
+MAX_INDEXED_ENTRIES = 256      # 内存中保留偏移索引的文件数
+# 解析逻辑变化时递增，旧缓存自然失效
+EXTRACTOR_VERSION = "2"
+
+
+class ExtractionCache:
+    def __init__(self, cache_dir: str = EXTRACT_CACHE_DIR, max_disk_bytes: int = int(EXTRACT_CACHE_MAX_MB * 1024 * 1024),
+                 max_indexed: int = MAX_INDEXED_ENTRIES):
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.max_indexed = max_indexed
+        # key -> (chars, nbytes, sha256, offsets)
+        self._indexes: "OrderedDict[str, Tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evicted_files": 0}
+        self.extract_seconds = 0.0
+
+    @staticmethod
+    def key(source_sha256: str, file_type: str) -> str:
+        return f"{source_sha256}-{file_type}-v{EXTRACTOR_VERSION}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.txt")
+
+    # ==========================================
+    # 🧠 内存 LRU (偏移索引)
+    # ==========================================
+
+    def _remember(self, key: str, handle: TextHandle):
+        with self._lock:
+            self._indexes[key] = (handle.chars, handle.nbytes, handle.sha256, handle._offsets)
+            self._indexes.move_to_end(key)
+            while len(self._indexes) > self.max_indexed:
+                self._indexes.popitem(last=False)
+
+    def _recall(self, key: str) -> Optional[Tuple]:
+        with self._lock:
+            meta = self._indexes.get(key)
+            if meta is not None:
+                self._indexes.move_to_end(key)
+            return meta
+
+    # ==========================================
+    # 💽 磁盘存储
+    # ==========================================
+
+    def _checkout(self, key: str, dest_path: str) -> bool:
+        """把缓存文件链接到 dest_path；不存在 (或刚被淘汰) 时返回 False"""
+        path = self._path(key)
+        try:
+            link_or_copy(path, dest_path)
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            print(f"⚠️ [ExtractCache] Checkout failed, ignoring entry: {e}")
+            return False
+        try:
+            os.utime(path)  # mtime 作为最近访问时间，用于 LRU 淘汰
+        except OSError:
+            pass
+        return True
+
+    def _store(self, key: str, src_path: str):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        try:
+            link_or_copy(src_path, self._path(key))  # 原子替换，其他进程不会读到半个文件
+        except OSError as e:
+            print(f"⚠️ [ExtractCache] Write failed: {e}")
+            return
+        self._evict_disk()
+
+    def _disk_entries(self):
+        entries = []
+        try:
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    if entry.is_file() and entry.name.endswith(".txt"):
+                        st = entry.stat()
+                        entries.append((st.st_mtime, st.st_size, entry.path))
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def _evict_disk(self):
+        entries = self._disk_entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_disk_bytes:
+            return
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                self.counters["evicted_files"] += 1
+            except OSError:
+                pass
+
+    # ==========================================
+    # 🎯 入口
+    # ==========================================
+
+    def get_or_extract(self, source_sha256: str, file_type: str, dest_path: str,
+                       extractor: Callable[[str], TextHandle]) -> TextHandle:
+        """
+        命中缓存时把结果链接到 dest_path 并返回句柄；
+        否则调用 extractor(dest_path) 解析 (写入 dest_path) 再存入缓存。
+        返回的句柄拥有 dest_path，被回收时删除该文件 (缓存中的硬链接不受影响)。
+        空结果不缓存；解析异常原样抛出。
+        """
+        if not EXTRACT_CACHE_ENABLED:
+            return extractor(dest_path)
+
+        key = self.key(source_sha256, file_type)
+        if self._checkout(key, dest_path):
+            meta = self._recall(key)
+            if meta is not None:
+                self.counters["memory_hits"] += 1
+                return TextHandle(dest_path, *meta, owned=True)
+            handle = open_text(dest_path, owned=True)
+            self.counters["disk_hits"] += 1
+            self._remember(key, handle)
+            print(f"💽 [ExtractCache] Disk hit ({len(handle)} chars)")
+            return handle
+
+        self.counters["misses"] += 1
+        start = time.perf_counter()
+        handle = extractor(dest_path)
+        elapsed = time.perf_counter() - start
+        self.extract_seconds += elapsed
+        if len(handle):
+            self._store(key, dest_path)
+            self._remember(key, handle)
+            print(f"💾 [ExtractCache] Cached {len(handle)} chars (parsed in {elapsed:.1f}s)")
+        return handle
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+        for _, _, path in self._disk_entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self) -> Dict:
+        entries = self._disk_entries()
+        return {
+            **self.counters,
+            "indexed_entries": len(self._indexes),
+            "disk_entries": len(entries),
+            "disk_mb": round(sum(size for _, size, _ in entries) / 1024 / 1024, 2),
+            "extract_seconds": round(self.extract_seconds, 2),
+        }
+
+
+extraction_cache = ExtractionCache()
+
+
+def cache_stats() -> Dict:
+    return extraction_cache.stats()
@@ -0,0 +1,378 @@
+"""
+文档解析引擎 (PDF / EPUB / TXT)
+
+- PDF : 按页分批交给进程池并行 extract_text，按页序流式产出；
+        同时在途的批次有上限，内存占用与书的页数无关
+- EPUB: 直接在内存中解析 (不落临时文件)，章节 HTML 用 lxml 去标签 (未安装时退回 html.parser)，
+        章节多时同样交给进程池
+- TXT : 只解码一次 (UTF-8 失败再试 GBK)；来自磁盘时分块增量解码
+每次解析都会记录页/章数、耗时与 pages/s，供侧边栏展示和基准对比。
+"""
+import os
+import sys
+import time
+import logging
+import codecs
+import tempfile
+import warnings
+import multiprocessing
+from io import BytesIO
+from contextlib import contextmanager
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterator, List, Optional, Union
+
+from text_store import TextHandle, write_text
+
+try:
+    import lxml  # noqa: F401  (可选依赖，比 html.parser 快数倍)
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+EXTRACT_WORKERS = int(os.environ.get("EXTRACT_WORKERS", str(min(8, os.cpu_count() or 1))))
+PDF_PAGES_PER_TASK = 8          # 每个进程任务处理的页数 (太小则进程间通信开销占比高)
+PDF_PARALLEL_MIN_PAGES = 24     # 少于该页数直接在当前进程解析，省去进程池开销
+EPUB_PARALLEL_MIN_CHAPTERS = 8
+TXT_BLOCK_BYTES = 1 << 20
+MAX_INFLIGHT_PER_WORKER = 2     # 每个 worker 最多预先派发的任务数，限制已解析未消费的文本量
+
+SUPPORTED_TYPES = ("pdf", "epub", "txt")
+
+# (stage, done, total, elapsed_seconds)，与 summarize_ops 的进度回调一致
+ProgressCallback = Optional[Callable[[str, int, int, float], None]]
+
+
+class ExtractionError(Exception):
+    """文件无法解析 (格式损坏 / 编码不支持 / 类型不支持)"""
+
+
+@dataclass
+class ExtractStats:
+    file_type: str = ""
+    units: int = 0          # PDF 为页数，EPUB 为章节数
+    chars: int = 0
+    seconds: float = 0.0
+    workers: int = 1
+
+    @property
+    def unit_name(self) -> str:
+        return "pages" if self.file_type == "pdf" else "chapters"
+
+    @property
+    def rate(self) -> float:
+        return self.units / self.seconds if self.seconds > 0 else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"{self.units} {self.unit_name} · {self.chars} chars · {self.seconds:.1f}s "
+            f"({self.rate:.1f} {self.unit_name}/s, {self.workers} workers)"
+        )
+
+
+# ==========================================
+# ⚙️ 进程池
+# ==========================================
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+@contextmanager
+def _quiet():
+    """pypdf 遇到不规范的 PDF 会大量输出警告 (部分直接写 stderr)，解析期间屏蔽"""
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore")
+        with open(os.devnull, "w") as devnull:
+            old_stderr = sys.stderr
+            sys.stderr = devnull
+            try:
+                yield
+            finally:
+                sys.stderr = old_stderr
+
+
+def _init_worker():
+    warnings.filterwarnings("ignore")
+    logging.getLogger("pypdf").setLevel(logging.ERROR)
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn：Streamlit / uvicorn 进程里有大量线程，fork 不安全
+        _pool = ProcessPoolExecutor(
+            max_workers=EXTRACT_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        )
+    return _pool
+
+
+def _ordered_map(fn, tasks: list) -> Iterator:
+    """
+    按任务顺序产出结果，同时最多 workers * MAX_INFLIGHT_PER_WORKER 个任务在途。
+    (Executor.map 会一次性提交全部任务，解析快于消费时结果会在内存里堆积)
+    """
+    pool = _get_pool()
+    window = max(1, EXTRACT_WORKERS * MAX_INFLIGHT_PER_WORKER)
+    futures = []
+    next_task = 0
+    try:
+        while next_task < len(tasks) or futures:
+            while next_task < len(tasks) and len(futures) < window:
+                futures.append(pool.submit(fn, *tasks[next_task]))
+                next_task += 1
+            yield futures.pop(0).result()
+    finally:
+        for f in futures:
+            f.cancel()
+
+
+# ==========================================
+# 📕 PDF
+# ==========================================
+
+# worker 进程内缓存已打开的 PdfReader，同一文件的后续批次不再重新解析文档结构
+_reader_cache = {}
+
+
+def _open_reader(path: str):
+    from pypdf import PdfReader
+
+    reader = _reader_cache.get(path)
+    if reader is None:
+        _reader_cache.clear()
+        reader = PdfReader(path, strict=False)  # strict=False 允许更宽松的解析
+        _reader_cache[path] = reader
+    return reader
+
+
+def _pdf_pages(path: str, start: int, end: int) -> List[str]:
+    """进程池任务：提取 [start, end) 页的文本"""
+    reader = _open_reader(path)
+    return [(reader.pages[i].extract_text() or "") for i in range(start, end)]
+
+
+def _serial_pdf_pages(reader) -> Iterator[List[str]]:
+    for page in reader.pages:
+        with _quiet():
+            text = page.extract_text() or ""
+        yield [text]
+
+
+@contextmanager
+def _as_path(source: Union[bytes, str], suffix: str):
+    """worker 进程按路径读取文件；传入的是字节时先写入临时文件"""
+    if isinstance(source, str):
+        yield source
+        return
+    fd, path = tempfile.mkstemp(suffix=suffix, prefix="extract_")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(source)
+        yield path
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def iter_pdf_pages(source: Union[bytes, str], stats: ExtractStats = None,
+                   on_progress: ProgressCallback = None) -> Iterator[str]:
+    """按页序逐页产出 PDF 文本；source 可以是字节或文件路径"""
+    from pypdf import PdfReader
+
+    stats = stats if stats is not None else ExtractStats()
+    stats.file_type = "pdf"
+    start = time.perf_counter()
+
+    with _as_path(source, ".pdf") as path:
+        try:
+            with _quiet():
+                reader = PdfReader(path, strict=False)  # strict=False 允许更宽松的解析
+                total = len(reader.pages)
+        except Exception as e:
+            raise ExtractionError(f"PDF 提取错误: {e}") from e
+
+        if total < PDF_PARALLEL_MIN_PAGES or EXTRACT_WORKERS <= 1:
+            stats.workers = 1
+            batches = _serial_pdf_pages(reader)
+        else:
+            stats.workers = EXTRACT_WORKERS
+            del reader  # 各 worker 自己打开文件
+            tasks = [(path, i, min(i + PDF_PAGES_PER_TASK, total)) for i in range(0, total, PDF_PAGES_PER_TASK)]
+            batches = _ordered_map(_pdf_pages, tasks)
+
+        try:
+            for batch in batches:
+                for text in batch:
+                    stats.units += 1
+                    stats.chars += len(text) + 1
+                    yield text
+                stats.seconds = time.perf_counter() - start
+                if on_progress:
+                    on_progress("pdf", stats.units, total, stats.seconds)
+        except ExtractionError:
+            raise
+        except Exception as e:
+            raise ExtractionError(f"PDF 提取错误: {e}") from e
+        finally:
+            stats.seconds = time.perf_counter() - start
+
+
+# ==========================================
+# 📗 EPUB
+# ==========================================
+
+def _html_to_text(html: bytes) -> str:
+    """进程池任务：去除章节 HTML 的标签"""
+    from bs4 import BeautifulSoup
+
+    with warnings.catch_warnings():
+        # 章节是 XHTML，按 HTML 解析即可，忽略 XMLParsedAsHTMLWarning
+        warnings.filterwarnings("ignore")
+        return BeautifulSoup(html, HTML_PARSER).get_text()
+
+
+def iter_epub_chapters(source: Union[bytes, str], stats: ExtractStats = None,
+                       on_progress: ProgressCallback = None) -> Iterator[str]:
+    """按书中顺序逐章产出 EPUB 文本；source 为字节时 EbookLib 直接读取内存中的 zip"""
+    import ebooklib
+    from ebooklib import epub
+
+    stats = stats if stats is not None else ExtractStats()
+    stats.file_type = "epub"
+    start = time.perf_counter()
+    try:
+        with _quiet():
+            book = epub.read_epub(BytesIO(source) if isinstance(source, bytes) else source)
+        documents = [item.get_content() for item in book.get_items() if item.get_type() == ebooklib.ITEM_DOCUMENT]
+    except Exception as e:
+        raise ExtractionError(f"Error reading EPUB: {e}") from e
+
+    total = len(documents)
+    if total < EPUB_PARALLEL_MIN_CHAPTERS or EXTRACT_WORKERS <= 1:
+        stats.workers = 1
+        chapters = (_html_to_text(html) for html in documents)
+    else:
+        stats.workers = EXTRACT_WORKERS
+        chapters = _ordered_map(_html_to_text, [(html,) for html in documents])
+
+    try:
+        for text in chapters:
+            stats.units += 1
+            stats.chars += len(text) + (stats.units > 1)   # 章节之间的换行
+            stats.seconds = time.perf_counter() - start
+            if on_progress:
+                on_progress("epub", stats.units, total, stats.seconds)
+            yield text
+    except Exception as e:
+        raise ExtractionError(f"Error reading EPUB: {e}") from e
+    finally:
+        stats.seconds = time.perf_counter() - start
+
+
+# ==========================================
+# 📄 TXT
+# ==========================================
+
+def decode_text(data: bytes) -> str:
+    """UTF-8 解码，失败时按 GBK 解码 (兼容中文旧文件)"""
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        pass
+    try:
+        return data.decode("gbk")
+    except UnicodeDecodeError as e:
+        raise ExtractionError("Error: Unsupported text encoding.") from e
+
+
+def _decodes_as(path: str, encoding: str) -> bool:
+    decoder = codecs.getincrementaldecoder(encoding)()
+    try:
+        with open(path, "rb") as f:
+            while True:
+                block = f.read(TXT_BLOCK_BYTES)
+                decoder.decode(block, final=not block)
+                if not block:
+                    return True
+    except UnicodeDecodeError:
+        return False
+
+
+def iter_txt_blocks(source: Union[bytes, str], stats: ExtractStats = None) -> Iterator[str]:
+    """字节直接解码；文件路径则先确定编码，再分块增量解码 (不整体读入内存)"""
+    stats = stats if stats is not None else ExtractStats()
+    stats.file_type = "txt"
+    start = time.perf_counter()
+    if isinstance(source, bytes):
+        text = decode_text(source)
+        stats.units, stats.chars = 1, len(text)
+        stats.seconds = time.perf_counter() - start
+        yield text
+        return
+
+    encoding = next((enc for enc in ("utf-8", "gbk") if _decodes_as(source, enc)), None)
+    if encoding is None:
+        raise ExtractionError("Error: Unsupported text encoding.")
+    decoder = codecs.getincrementaldecoder(encoding)()
+    stats.units = 1
+    with open(source, "rb") as f:
+        while True:
+            block = f.read(TXT_BLOCK_BYTES)
+            text = decoder.decode(block, final=not block)
+            if text:
+                stats.chars += len(text)
+                yield text
+            if not block:
+                break
+    stats.seconds = time.perf_counter() - start
+
+
+# ==========================================
+# 🎯 入口
+# ==========================================
+
+def iter_text(source: Union[bytes, str], file_type: str, stats: ExtractStats = None,
+              on_progress: ProgressCallback = None) -> Iterator[str]:
+    """
+    流式产出文档文本片段，片段直接拼接即为全文：
+    PDF 每页后加换行、EPUB 章节之间加换行 (与旧实现输出一致)，TXT 按块产出。
+    source 为文件内容 (bytes) 或文件路径 (str)。
+    """
+    file_type = file_type.lower()
+    if file_type == "pdf":
+        for page in iter_pdf_pages(source, stats, on_progress):
+            yield page + "\n"
+    elif file_type == "epub":
+        for i, chapter in enumerate(iter_epub_chapters(source, stats, on_progress)):
+            yield ("\n" + chapter) if i else chapter
+    elif file_type == "txt":
+        yield from iter_txt_blocks(source, stats)
+    else:
+        raise ExtractionError(f"Unsupported file type: {file_type}")
+
+
+def extract_text(source: Union[bytes, str], file_type: str, stats: ExtractStats = None,
+                 on_progress: ProgressCallback = None) -> str:
+    """解析整份文档并返回字符串"""
+    stats = stats if stats is not None else ExtractStats()
+    text = "".join(iter_text(source, file_type, stats, on_progress))
+    _report(stats)
+    return text
+
+
+def extract_to_file(source: Union[bytes, str], file_type: str, path: str, stats: ExtractStats = None,
+                    on_progress: ProgressCallback = None, owned: bool = False) -> TextHandle:
+    """解析整份文档并流式写入 path，返回 TextHandle (全文不会整体驻留内存)"""
+    stats = stats if stats is not None else ExtractStats()
+    handle = write_text(iter_text(source, file_type, stats, on_progress), path, owned=owned)
+    _report(stats)
+    return handle
+
+
+def _report(stats: ExtractStats):
+    if stats.file_type != "txt":
+        print(f"📄 [Extract] {stats.file_type.upper()}: {stats.summary()}")
@@ -0,0 +1,277 @@
+"""
+共享 HTTP 连接池 (Transport Layer)
+
+LLM、Embedding、Notion 三类调用统一从这里取 httpx 客户端：
+- 每个服务 (≈ 每个 host) 一个长期存活的 sync / async 客户端，连接 keep-alive 复用
+  async 连接绑定在创建它的 event loop 上：异步传输层按当前运行的 loop 各自维护一个连接池，
+  同一个客户端可以在多个 loop 上使用，但连接只在同一个 loop 内复用。
+  因此同步调用方 (Streamlit) 不在每轮 asyncio.run 新建 loop，而是把所有回合交给
+  agent_graph 的常驻 loop 执行 (见 iter_agent_events)
+- 按服务配置连接池上限，相当于 per-host limits
+- 安装了 h2 且 HTTP2=1 时启用 HTTP/2
+- 通过 httpcore trace 统计新建连接数与复用率，记录在途请求峰值与池饱和次数
+  (在途数按响应头返回为止计算，流式响应的 body 读取不计入)
+"""
+import os
+import time
+import atexit
+import socket
+import asyncio
+import threading
+import weakref
+from typing import Callable, Dict
+
+import httpx
+
+try:
+    import h2  # noqa: F401  (HTTP/2 为可选依赖)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+HTTP2_ENABLED = HTTP2_AVAILABLE and os.environ.get("HTTP2", "1") != "0"
+KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "60"))
+
+# 服务名 -> (最大连接数, 最大空闲 keep-alive 连接数)
+SERVICE_LIMITS = {
+    "llm": (20, 10),
+    "embeddings": (10, 5),
+    "notion": (6, 3),
+}
+DEFAULT_LIMITS = (10, 5)
+DEFAULT_TIMEOUT = httpx.Timeout(120.0, connect=10.0)
+
+
+class PoolStats:
+    """单个服务的连接池统计"""
+
+    def __init__(self, service: str, max_connections: int):
+        self.service = service
+        self.max_connections = max_connections
+        self.requests = 0
+        self.new_connections = 0
+        self.tls_handshakes = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.saturated = 0          # 发起请求时在途数已达上限的次数
+        self.errors = 0
+        self.total_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def on_request(self):
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            if self.in_flight > self.max_connections:
+                self.saturated += 1
+
+    def on_response(self, seconds: float, ok: bool = True):
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+            self.total_seconds += seconds
+            if not ok:
+                self.errors += 1
+
+    def on_trace(self, event_name: str):
+        if event_name == "connection.connect_tcp.complete":
+            with self._lock:
+                self.new_connections += 1
+        elif event_name == "connection.start_tls.complete":
+            with self._lock:
+                self.tls_handshakes += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            reused = max(0, self.requests - self.new_connections)
+            return {
+                "service": self.service,
+                "requests": self.requests,
+                "new_connections": self.new_connections,
+                "tls_handshakes": self.tls_handshakes,
+                "reuse_ratio": round(reused / self.requests, 3) if self.requests else 0.0,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "max_connections": self.max_connections,
+                "saturated": self.saturated,
+                "errors": self.errors,
+                "avg_ms": round(self.total_seconds / self.requests * 1000, 1) if self.requests else 0.0,
+            }
+
+
+_lock = threading.Lock()
+_interceptor = None  # 录制/回放钩子 (见 replay.py)，为 None 时直接走真实连接
+_sync_clients: Dict[str, httpx.Client] = {}
+_async_clients: Dict[str, httpx.AsyncClient] = {}
+_stats: Dict[str, PoolStats] = {}
+
+
+def _limits(service: str) -> httpx.Limits:
+    max_conn, max_keepalive = SERVICE_LIMITS.get(service, DEFAULT_LIMITS)
+    return httpx.Limits(
+        max_connections=max_conn,
+        max_keepalive_connections=max_keepalive,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+
+
+def _get_stats(service: str) -> PoolStats:
+    with _lock:
+        if service not in _stats:
+            _stats[service] = PoolStats(service, SERVICE_LIMITS.get(service, DEFAULT_LIMITS)[0])
+        return _stats[service]
+
+
+class _InstrumentedTransport(httpx.BaseTransport):
+    """包装 HTTPTransport：统计在途请求、耗时，并挂上 httpcore trace 统计新建连接"""
+
+    def __init__(self, inner: httpx.HTTPTransport, stats: PoolStats):
+        self.inner = inner
+        self.stats = stats
+
+    def _trace(self, event_name, info):
+        self.stats.on_trace(event_name)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.extensions["trace"] = self._trace
+        self.stats.on_request()
+        start = time.perf_counter()
+        try:
+            if _interceptor is not None:
+                response = _interceptor.handle_request(self.stats.service, request, self.inner)
+            else:
+                response = self.inner.handle_request(request)
+        except Exception:
+            self.stats.on_response(time.perf_counter() - start, ok=False)
+            raise
+        self.stats.on_response(time.perf_counter() - start, ok=response.status_code < 400)
+        return response
+
+    def close(self):
+        self.inner.close()
+
+
+class _AsyncInstrumentedTransport(httpx.AsyncBaseTransport):
+    """
+    异步版本：底层 AsyncHTTPTransport 按 event loop 分别创建。
+    loop 关闭后其连接池无法再 aclose：这里断开残留的连接后丢弃 (见 _discard)。
+    """
+
+    def __init__(self, factory: Callable[[], httpx.AsyncHTTPTransport], stats: PoolStats):
+        self.factory = factory
+        self.stats = stats
+        self._inners: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncHTTPTransport]" = \
+            weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _inner(self) -> httpx.AsyncHTTPTransport:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            inner = self._inners.get(loop)
+            if inner is None:
+                # 已关闭的 loop 上的连接无法再使用，也无法 aclose：同步关闭底层 socket 后丢弃
+                for stale in [l for l in self._inners if l.is_closed()]:
+                    self._discard(self._inners.pop(stale))
+                inner = self._inners[loop] = self.factory()
+            return inner
+
+    @staticmethod
+    def _discard(inner: httpx.AsyncHTTPTransport):
+        """
+        断开已失效 loop 上残留的 keep-alive 连接：不经过 event loop，直接 shutdown socket
+        (立即结束 TCP 连接；文件描述符随 transport 对象回收时释放)
+        """
+        pool = getattr(inner, "_pool", None)
+        for conn in list(getattr(pool, "connections", []) or []):
+            stream = getattr(getattr(conn, "_connection", None), "_network_stream", None)
+            sock = stream.get_extra_info("socket") if stream is not None else None
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    async def _trace(self, event_name, info):
+        self.stats.on_trace(event_name)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        inner = self._inner()
+        request.extensions["trace"] = self._trace
+        self.stats.on_request()
+        start = time.perf_counter()
+        try:
+            if _interceptor is not None:
+                response = await _interceptor.handle_async_request(self.stats.service, request, inner)
+            else:
+                response = await inner.handle_async_request(request)
+        except Exception:
+            self.stats.on_response(time.perf_counter() - start, ok=False)
+            raise
+        self.stats.on_response(time.perf_counter() - start, ok=response.status_code < 400)
+        return response
+
+    async def aclose(self):
+        with self._lock:
+            inner = self._inners.pop(asyncio.get_running_loop(), None)
+        if inner is not None:
+            await inner.aclose()
+
+
+def get_sync_client(service: str) -> httpx.Client:
+    """获取某个服务共享的同步客户端 (进程内单例)"""
+    with _lock:
+        client = _sync_clients.get(service)
+        if client is not None and not client.is_closed:
+            return client
+
+    transport = _InstrumentedTransport(
+        httpx.HTTPTransport(limits=_limits(service), http2=HTTP2_ENABLED),
+        _get_stats(service),
+    )
+    client = httpx.Client(transport=transport, timeout=DEFAULT_TIMEOUT)
+    with _lock:
+        _sync_clients[service] = client
+    return client
+
+
+def get_async_client(service: str) -> httpx.AsyncClient:
+    """获取某个服务共享的异步客户端 (与同步客户端共用统计；可跨多个 event loop 使用)"""
+    with _lock:
+        client = _async_clients.get(service)
+        if client is not None and not client.is_closed:
+            return client
+
+    transport = _AsyncInstrumentedTransport(
+        lambda: httpx.AsyncHTTPTransport(limits=_limits(service), http2=HTTP2_ENABLED),
+        _get_stats(service),
+    )
+    client = httpx.AsyncClient(transport=transport, timeout=DEFAULT_TIMEOUT)
+    with _lock:
+        _async_clients[service] = client
+    return client
+
+
+def set_interceptor(interceptor) -> None:
+    """
+    安装请求拦截器 (None 表示卸载)。拦截器需实现：
+    handle_request(service, request, inner) / handle_async_request(service, request, inner)
+    对已创建的客户端同样生效。
+    """
+    global _interceptor
+    _interceptor = interceptor
+
+
+def pool_stats() -> Dict[str, Dict]:
+    """所有服务的连接池统计快照"""
+    with _lock:
+        services = list(_stats.values())
+    return {s.service: s.snapshot() for s in services}
+
+
+@atexit.register
+def _close_clients():
+    for client in list(_sync_clients.values()):
+        try:
+            client.close()
+        except Exception:
+            pass
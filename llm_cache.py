@@ -0,0 +1,390 @@
+"""
+LLM 响应缓存 (SQLite)
+
+作为 ChatOpenAI 的 cache= 挂在 get_llm() 上，重复的请求在本地毫秒级返回：
+- 精确层  : sha256(llm_string + 规范化后的 prompt)。llm_string 已包含模型名、参数与绑定的 tools；
+            prompt 去掉每次都不同的字段 (消息 id / response_metadata / usage，工具调用 id 按出现顺序重编号)
+- 语义层  : 只用于纯问答 (最后一条是用户消息、回复不含工具调用)，
+            上文完全相同、最后一问的 embedding 余弦相似度 >= 阈值才算命中
+- 作用范围: 含写入类工具调用 (manage_notion_note) 的回复永不缓存
+所有条目带 TTL，命中率统计可在侧边栏查看。
+"""
+import os
+import json
+import time
+import math
+import sqlite3
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence
+
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+from langchain_core.outputs import Generation
+
+LLM_CACHE_ENABLED = os.environ.get("LLM_CACHE", "1") != "0"
+LLM_CACHE_SEMANTIC = os.environ.get("LLM_CACHE_SEMANTIC", "1") != "0"
+LLM_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", "./llm_cache.db")
+LLM_CACHE_TTL_SECONDS = float(os.environ.get("LLM_CACHE_TTL_HOURS", "24")) * 3600
+LLM_CACHE_SIMILARITY = float(os.environ.get("LLM_CACHE_SIMILARITY", "0.97"))
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "5000"))
+# 写入类工具：模型一旦决定调用它们，这次回复就不进缓存
+WRITE_TOOLS = set(
+    t.strip() for t in os.environ.get("LLM_CACHE_SKIP_TOOLS", "manage_notion_note").split(",") if t.strip()
+)
+PRUNE_EVERY = 100            # 每写入多少条做一次过期清理
+MAX_PENDING_EMBEDDINGS = 64  # lookup 与 update 之间暂存的问题向量数量
+
+KIND_EXACT = "exact"   # 只参与精确匹配
+KIND_QA = "qa"         # 纯问答，可参与语义匹配
+
+HUMAN_MESSAGE_ID = ["langchain", "schema", "messages", "HumanMessage"]
+# 消息上与内容无关、每次运行都会变化的字段 (LangGraph 给每条消息分配新的 uuid)
+VOLATILE_FIELDS = ("id", "response_metadata", "usage_metadata")
+
+
+def _sha(*parts: str) -> str:
+    h = hashlib.sha256()
+    for p in parts:
+        h.update(p.encode("utf-8", "ignore"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def _text_of(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "\n".join(
+            p.get("text", "") if isinstance(p, dict) else str(p) for p in content
+        )
+    return str(content or "")
+
+
+def _tool_call_ids(kwargs: Dict) -> List[str]:
+    ids = [c.get("id") for key in ("tool_calls", "invalid_tool_calls") for c in kwargs.get(key) or []
+           if isinstance(c, dict)]
+    ids += [c.get("id") for c in (kwargs.get("additional_kwargs") or {}).get("tool_calls") or []
+            if isinstance(c, dict)]
+    ids.append(kwargs.get("tool_call_id"))
+    return [i for i in ids if isinstance(i, str) and i]
+
+
+def _replace_strings(value: Any, mapping: Dict[str, str]) -> Any:
+    if isinstance(value, str):
+        return mapping.get(value, value)
+    if isinstance(value, list):
+        return [_replace_strings(v, mapping) for v in value]
+    if isinstance(value, dict):
+        return {k: _replace_strings(v, mapping) for k, v in value.items()}
+    return value
+
+
+def _normalize_messages(prompt: str) -> Optional[list]:
+    """
+    解析 langchain dumps 后的消息列表，去掉易变字段；
+    工具调用 id 由模型随机生成，按出现顺序换成 call_0、call_1 ...，保留调用与结果的对应关系
+    """
+    try:
+        messages = json.loads(prompt)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(messages, list):
+        return None
+    mapping: Dict[str, str] = {}
+    for message in messages:
+        kwargs = message.get("kwargs") if isinstance(message, dict) else None
+        if not isinstance(kwargs, dict):
+            continue
+        for field in VOLATILE_FIELDS:
+            kwargs.pop(field, None)
+        for call_id in _tool_call_ids(kwargs):
+            mapping.setdefault(call_id, f"call_{len(mapping)}")
+    return _replace_strings(messages, mapping) if mapping else messages
+
+
+def _cache_prompt(prompt: str) -> str:
+    """用于计算缓存 key 的 prompt：规范化后的 JSON (无法解析时原样使用)"""
+    messages = _normalize_messages(prompt)
+    return prompt if messages is None else json.dumps(messages, sort_keys=True, ensure_ascii=False)
+
+
+def _split_prompt(prompt: str) -> Optional[tuple]:
+    """
+    prompt 是 (规范化后的) 消息列表 JSON。
+    最后一条是用户消息时返回 (上文 JSON, 最后一问的文本)，否则返回 None
+    """
+    try:
+        messages = json.loads(prompt)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(messages, list) or not messages:
+        return None
+    last = messages[-1]
+    if not isinstance(last, dict) or last.get("id") != HUMAN_MESSAGE_ID:
+        return None
+    question = _text_of(last.get("kwargs", {}).get("content")).strip()
+    if not question:
+        return None
+    return json.dumps(messages[:-1], sort_keys=True), question
+
+
+def _tool_names(generations: Sequence[Generation]) -> List[str]:
+    names = []
+    for gen in generations:
+        message = getattr(gen, "message", None)
+        for call in getattr(message, "tool_calls", None) or []:
+            names.append(call.get("name", ""))
+    return names
+
+
+def _cosine(a: Sequence[float], b: Sequence[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    na = math.sqrt(sum(x * x for x in a))
+    nb = math.sqrt(sum(y * y for y in b))
+    return dot / (na * nb) if na and nb else 0.0
+
+
+class SQLiteResponseCache(BaseCache):
+    """精确 + 语义两层的 LLM 响应缓存"""
+
+    def __init__(
+        self,
+        path: str = LLM_CACHE_PATH,
+        *,
+        ttl_seconds: float = LLM_CACHE_TTL_SECONDS,
+        semantic: bool = LLM_CACHE_SEMANTIC,
+        similarity: float = LLM_CACHE_SIMILARITY,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+        embed_fn=None,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.semantic = semantic
+        self.similarity = similarity
+        self.max_entries = max_entries
+        self._embed_fn = embed_fn
+        self._lock = threading.Lock()
+        self._pending: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._writes = 0
+        self._stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "stored": 0, "skipped_write": 0}
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(
+            """
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                llm_hash TEXT NOT NULL,
+                context_hash TEXT,
+                kind TEXT NOT NULL,
+                embedding BLOB,
+                value TEXT NOT NULL,
+                created REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS idx_llm_cache_ctx ON llm_cache (llm_hash, context_hash, kind);
+            """
+        )
+        self.prune()
+
+    # ==========================================
+    # 🔍 BaseCache 接口
+    # ==========================================
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[Sequence[Generation]]:
+        prompt = _cache_prompt(prompt)
+        key = _sha(llm_string, prompt)
+        cutoff = time.time() - self.ttl_seconds
+
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT value FROM llm_cache WHERE key = ? AND created >= ?", (key, cutoff)
+            ).fetchone()
+            if row:
+                self.conn.execute("UPDATE llm_cache SET hits = hits + 1 WHERE key = ?", (key,))
+                self.conn.commit()
+                self._stats["exact_hits"] += 1
+                return self._decode(row[0])
+
+        hit = self._semantic_lookup(key, prompt, llm_string, cutoff)
+        with self._lock:
+            self._stats["semantic_hits" if hit is not None else "misses"] += 1
+        return hit
+
+    def update(self, prompt: str, llm_string: str, return_val: Sequence[Generation]) -> None:
+        prompt = _cache_prompt(prompt)
+        key = _sha(llm_string, prompt)
+        tools = _tool_names(return_val)
+        if WRITE_TOOLS.intersection(tools):
+            with self._lock:
+                self._pending.pop(key, None)
+                self._stats["skipped_write"] += 1
+            return
+
+        kind, context_hash, embedding = KIND_EXACT, None, None
+        split = _split_prompt(prompt) if self.semantic and not tools else None
+        if split:
+            context, question = split
+            with self._lock:
+                embedding = self._pending.pop(key, None)
+            if embedding is None:
+                embedding = self._embed(question)
+            if embedding is not None:
+                kind, context_hash = KIND_QA, _sha(context)
+
+        try:
+            value = json.dumps([dumps(gen) for gen in return_val])
+        except Exception as e:
+            print(f"⚠️ [LLM Cache] Cannot serialize response: {e}")
+            return
+
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO llm_cache "
+                "(key, llm_hash, context_hash, kind, embedding, value, created, hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+                (
+                    key,
+                    _sha(llm_string),
+                    context_hash,
+                    kind,
+                    array("f", embedding).tobytes() if embedding is not None else None,
+                    value,
+                    time.time(),
+                ),
+            )
+            self.conn.commit()
+            self._stats["stored"] += 1
+            self._writes += 1
+            due = self._writes % PRUNE_EVERY == 0
+        if due:
+            self.prune()
+
+    def clear(self, **kwargs: Any) -> None:
+        with self._lock:
+            self.conn.execute("DELETE FROM llm_cache")
+            self.conn.commit()
+            self._pending.clear()
+
+    # ==========================================
+    # 🧠 语义层
+    # ==========================================
+
+    def _embed(self, text: str) -> Optional[List[float]]:
+        try:
+            if self._embed_fn is None:
+                # 延迟导入：只有启用语义层时才加载向量库
+                from vector_ops import EMBEDDING_FUNC
+                self._embed_fn = EMBEDDING_FUNC
+            return list(self._embed_fn([text])[0])
+        except Exception as e:
+            print(f"⚠️ [LLM Cache] Embedding failed, semantic tier skipped: {e}")
+            return None
+
+    def _semantic_lookup(self, key: str, prompt: str, llm_string: str, cutoff: float):
+        if not self.semantic:
+            return None
+        split = _split_prompt(prompt)
+        if not split:
+            return None
+        context, question = split
+
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT key, embedding, value FROM llm_cache "
+                "WHERE llm_hash = ? AND context_hash = ? AND kind = ? AND created >= ?",
+                (_sha(llm_string), _sha(context), KIND_QA, cutoff),
+            ).fetchall()
+
+        embedding = self._embed(question)
+        if embedding is None:
+            return None
+        # 未命中时暂存向量，update 时直接复用，免得再算一次
+        with self._lock:
+            self._pending[key] = embedding
+            while len(self._pending) > MAX_PENDING_EMBEDDINGS:
+                self._pending.popitem(last=False)
+
+        best_key, best_value, best_score = None, None, 0.0
+        for row_key, blob, value in rows:
+            score = _cosine(embedding, array("f", blob))
+            if score > best_score:
+                best_key, best_value, best_score = row_key, value, score
+        if best_key is None or best_score < self.similarity:
+            return None
+
+        with self._lock:
+            self.conn.execute("UPDATE llm_cache SET hits = hits + 1 WHERE key = ?", (best_key,))
+            self.conn.commit()
+        print(f"🗃️ [LLM Cache] Semantic hit (cos={best_score:.3f})")
+        return self._decode(best_value)
+
+    # ==========================================
+    # 🧹 维护 & 统计
+    # ==========================================
+
+    @staticmethod
+    def _decode(value: str) -> Optional[List[Generation]]:
+        try:
+            return [loads(item, allowed_objects="core") for item in json.loads(value)]
+        except Exception as e:
+            print(f"⚠️ [LLM Cache] Corrupt entry ignored: {e}")
+            return None
+
+    def prune(self) -> int:
+        """删除过期条目，并把总数压到 max_entries 以内 (先删最旧的)"""
+        with self._lock:
+            cur = self.conn.execute(
+                "DELETE FROM llm_cache WHERE created < ?", (time.time() - self.ttl_seconds,)
+            )
+            removed = cur.rowcount
+            cur = self.conn.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                "  SELECT key FROM llm_cache ORDER BY created DESC LIMIT -1 OFFSET ?"
+                ")",
+                (self.max_entries,),
+            )
+            removed += cur.rowcount
+            self.conn.commit()
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            entries, qa_entries, total_hits = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(kind = ?), 0), COALESCE(SUM(hits), 0) FROM llm_cache",
+                (KIND_QA,),
+            ).fetchone()
+        lookups = stats["exact_hits"] + stats["semantic_hits"] + stats["misses"]
+        stats.update({
+            "lookups": lookups,
+            "hit_rate": round((stats["exact_hits"] + stats["semantic_hits"]) / lookups, 3) if lookups else 0.0,
+            "entries": entries,
+            "qa_entries": qa_entries,
+            "lifetime_hits": total_hits,
+        })
+        return stats
+
+
+_cache: Optional[SQLiteResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[SQLiteResponseCache]:
+    """进程内共享的缓存实例；LLM_CACHE=0 时返回 None"""
+    global _cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = SQLiteResponseCache()
+        return _cache
+
+
+def cache_stats() -> Dict[str, Any]:
+    return _cache.stats() if _cache is not None else {"enabled": LLM_CACHE_ENABLED}
@@ -1,6 +1,9 @@
 import os
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
+from http_pool import get_sync_client, get_async_client
+from llm_cache import get_response_cache
+from tracing import llm_tracer
 
 load_dotenv()
 
@@ -18,5 +21,12 @@ def get_llm():
         api_key=os.environ.get("OPENAI_API_KEY"),
         base_url=os.environ.get("OPENAI_BASE_URL"),
         temperature=0.1,
-        streaming=True
+        streaming=True,
+        # 共享连接池：所有 LLM 实例复用同一组 keep-alive 连接
+        http_client=get_sync_client("llm"),
+        http_async_client=get_async_client("llm"),
+        # 本地响应缓存：相同/近似的请求直接命中 (LLM_CACHE=0 关闭)
+        cache=get_response_cache(),
+        # 每次调用记录一个 llm.* span
+        callbacks=[llm_tracer]
     )
\ No newline at end of file
@@ -1,9 +1,12 @@
 import os
 import re
-import requests
-from notion_client import Client
+import time
+from notion_client import Client, APIResponseError
 from dotenv import load_dotenv
 from typing import List, Dict, Any, Optional
+from http_pool import get_sync_client
+from tracing import span
+from rate_limit import notion_limiter
 
 load_dotenv()
 
@@ -13,8 +16,63 @@ NOTION_TOKEN = os.environ.get("NOTION_TOKEN")
 DB_SPANISH_ID = os.environ.get("NOTION_DATABASE_ID")          
 DB_HUMANITIES_ID = os.environ.get("NOTION_DATABASE_ID_HUMANITIES", DB_SPANISH_ID)  
 DB_TECH_ID = os.environ.get("NOTION_DATABASE_ID_TECH", DB_SPANISH_ID)
+NOTION_MAX_RETRIES = int(os.environ.get("NOTION_MAX_RETRIES", "3"))
+RETRY_AFTER_DEFAULT = 1.0           # 429 未带 Retry-After 时的暂停秒数
+# 5xx 时请求可能已经在服务端生效：只对只读调用重试，create / append 重试会产生重复页面或 block
+SERVER_ERROR_CODES = {"internal_server_error", "service_unavailable", "gateway_timeout"}
+CONFLICT_CODE = "conflict_error"    # 409：事务未提交，任何调用都可以重试
+READ_METHOD_SUFFIXES = (".retrieve", ".list", ".query", "search")
+
+# 使用共享连接池中的 Notion 专用客户端 (keep-alive 复用)
+# SDK 自带的重试会绕过共享限流器，关掉后由 _call 统一退避 (旧版 SDK 没有该选项)
+try:
+    notion = Client(auth=NOTION_TOKEN, client=get_sync_client("notion"), retry=False)
+except TypeError:
+    notion = Client(auth=NOTION_TOKEN, client=get_sync_client("notion"))
+
+def _error_code(e: APIResponseError) -> str:
+    return getattr(e.code, "value", e.code)
+
+def _retry_after(e: APIResponseError) -> float:
+    try:
+        return float(e.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return RETRY_AFTER_DEFAULT
 
-notion = Client(auth=NOTION_TOKEN)
+def _retryable(name: str, code: str) -> bool:
+    if code == "rate_limited" or code == CONFLICT_CODE:
+        return True
+    return code in SERVER_ERROR_CODES and name.endswith(READ_METHOD_SUFFIXES)
+
+def _call(name: str, fn, **kwargs):
+    """
+    所有 Notion API 调用的统一入口：记录 notion.<name> span
+    先从跨进程共享的令牌桶取令牌 (优先级见 rate_limit.notion_priority)；
+    429 时通知限流器暂停所有进程后重试；5xx 只对只读调用 (retrieve / list / query / search) 按指数退避重试。
+    例: _call("pages.create", notion.pages.create, parent=..., properties=...)
+    """
+    with span(f"notion.{name}", **{k: v for k, v in kwargs.items() if k in ("block_id", "page_id")}) as s:
+        if s is not None and "children" in kwargs:
+            s.set(blocks=len(kwargs["children"]))
+        waited_ms = 0.0
+        for attempt in range(NOTION_MAX_RETRIES + 1):
+            waited_ms += notion_limiter.acquire()
+            try:
+                result = fn(**kwargs)
+                break
+            except APIResponseError as e:
+                code = _error_code(e)
+                if attempt >= NOTION_MAX_RETRIES or not _retryable(name, code):
+                    raise
+                if code == "rate_limited":
+                    notion_limiter.penalize(_retry_after(e))
+                else:
+                    delay = 2 ** attempt * 0.5
+                    print(f"🔁 [Notion] {name} failed ({code}), retry in {delay:.1f}s")
+                    time.sleep(delay)
+        if s is not None:
+            s.set(rate_wait_ms=round(waited_ms, 1), attempts=attempt + 1)
+        return result
 
 # ==========================================
 # 🔧 核心辅助函数 (Internal Helpers)
@@ -25,79 +83,67 @@ def _safe_str(val: Any) -> str:
     if val is None: return ""
     return str(val).strip()
 
+# 行内样式的词法：一次 split (C 层完成扫描)，奇数位是样式 token，偶数位是普通片段
+# 同一位置按分支顺序优先: 1. 公式 $...$  2. 代码 `...`  3. 链接 [...](...)  4. 加粗 **...**  5. 高亮 ==...==
+_INLINE_PATTERN = re.compile(r'(\$[^\$]+\$|`[^`]+`|\[[^\]]+\]\([^\)]+\)|\*\*[^\*]+\*\*|==[^=]+==)')
+# 只有以这些字符开头的普通片段才可能被当作样式 (见 _classify_part)
+_MARKUP_STARTS = frozenset("$`[*=")
+
+def _link_span(part: str) -> Dict:
+    link_text = part[1:part.index(']')]
+    link_url = part[part.index('(')+1:-1]
+    return {"type": "text", "text": {"content": link_text, "link": {"url": link_url}}}
+
+def _token_span(token: str) -> Dict:
+    """正则匹配到的样式 token，首字符即可确定类型"""
+    first = token[0]
+    if first == '$':
+        return {"type": "equation", "equation": {"expression": token[1:-1]}}
+    if first == '`':
+        return {"type": "text", "text": {"content": token[1:-1]}, "annotations": {"code": True}}
+    if first == '[':
+        return _link_span(token)
+    if first == '*':
+        return {"type": "text", "text": {"content": token[2:-2]}, "annotations": {"bold": True}}
+    return {"type": "text", "text": {"content": token[2:-2]}, "annotations": {"color": "yellow_background"}}
+
+def _classify_part(part: str) -> Dict:
+    """
+    普通片段：以样式字符开头时仍按首尾标记判断 (如单独的 "``" 视为空代码)，与逐段判断的旧实现保持一致
+    """
+    if part[0] not in _MARKUP_STARTS:
+        return {"type": "text", "text": {"content": part}}
+    if part.startswith('$') and part.endswith('$') and len(part) > 2:
+        return {"type": "equation", "equation": {"expression": part[1:-1]}}
+    if part.startswith('`') and part.endswith('`'):
+        return {"type": "text", "text": {"content": part[1:-1]}, "annotations": {"code": True}}
+    if part.startswith('[') and ']' in part and '(' in part and part.endswith(')'):
+        return _link_span(part)
+    if part.startswith('**') and part.endswith('**'):
+        return {"type": "text", "text": {"content": part[2:-2]}, "annotations": {"bold": True}}
+    if part.startswith('==') and part.endswith('=='):
+        return {"type": "text", "text": {"content": part[2:-2]}, "annotations": {"color": "yellow_background"}}
+    return {"type": "text", "text": {"content": part}}
+
 def parse_rich_text(text: str) -> List[Dict]:
     """
     解析 Markdown 行内样式，返回 Notion rich_text 对象数组
     支持: **Bold**, `Code`, [Link](url), $Math$, ==Highlight==
     """
     if not text: return []
-    
-    rich_text = []
-    # 正则逻辑增强：
-    # 1. 行内公式: $...$ (非贪婪匹配)
-    # 2. 代码: `...`
-    # 3. 链接: [...](...)
-    # 4. 加粗: **...**
-    pattern = re.compile(r'(\$[^\$]+\$|`[^`]+`|\[[^\]]+\]\([^\)]+\)|\*\*[^\*]+\*\*)')
-    
-    parts = pattern.split(text)
-    
-    for part in parts:
-        if not part: continue
-        
-        # 🆕 1. 行内公式 $math$
-        if part.startswith('$') and part.endswith('$') and len(part) > 2:
-            content = part[1:-1]
-            rich_text.append({
-                "type": "equation",
-                "equation": {"expression": content}
-            })
 
-        # 2. 行内代码 `code`
-        elif part.startswith('`') and part.endswith('`'):
-            content = part[1:-1]
-            rich_text.append({
-                "type": "text",
-                "text": {"content": content},
-                "annotations": {"code": True}
-            })
-            
-        # 3. 链接 [text](url)
-        elif part.startswith('[') and ']' in part and '(' in part and part.endswith(')'):
-            try:
-                link_text = part[1:part.index(']')]
-                link_url = part[part.index('(')+1:-1]
-                rich_text.append({
-                    "type": "text",
-                    "text": {
-                        "content": link_text, 
-                        "link": {"url": link_url}
-                    }
-                })
-            except:
-                rich_text.append({"type": "text", "text": {"content": part}})
-                
-        # 4. 加粗 **bold**
-        elif part.startswith('**') and part.endswith('**'):
-            content = part[2:-2]
-            rich_text.append({
-                "type": "text",
-                "text": {"content": content},
-                "annotations": {"bold": True}
-            })
-            
-        # 5. 高亮 ==highlight== (新增部分)
-        elif part.startswith('==') and part.endswith('=='):
-            rich_text.append({
-                "type": "text",
-                "text": {"content": part[2:-2]},
-                "annotations": {"color": "yellow_background"} # Notion 高亮样式
-            })
-            
-        # 6. 普通文本
-        else:
-            rich_text.append({"type": "text", "text": {"content": part}})
-            
+    parts = _INLINE_PATTERN.split(text)
+    if len(parts) == 1:
+        return [_classify_part(text)]
+
+    rich_text = []
+    append = rich_text.append
+    if parts[0]:
+        append(_classify_part(parts[0]))
+    for i in range(1, len(parts), 2):
+        append(_token_span(parts[i]))
+        if parts[i + 1]:
+            append(_classify_part(parts[i + 1]))
     return rich_text
 
 def _flush_table(table_rows: List[List[str]]) -> Optional[Dict]:
@@ -145,7 +191,7 @@ def _append_children_in_batches(page_id: str, children: List[Dict]):
     
     for idx, batch in enumerate(batches):
         try:
-            notion.blocks.children.append(block_id=page_id, children=batch)
+            _call("blocks.children.append", notion.blocks.children.append, block_id=page_id, children=batch)
             print(f"   - ✅ Batch {idx + 1}/{len(batches)} uploaded.")
         except Exception as e:
             print(f"   - ❌ Batch {idx + 1} failed: {e}")
@@ -155,45 +201,105 @@ def _append_children_in_batches(page_id: str, children: List[Dict]):
 # 📝 排版引擎 (Parsing Engine)
 # ==========================================
 
+_NUMBERED_PREFIX = re.compile(r'\d+\.\s')
+_TABLE_SEPARATOR_CELL = re.compile(r'[-: ]+')
+# 以这些 Emoji 开头的引用渲染为 Callout (标注框)
+_CALLOUT_EMOJIS = frozenset(["💡", "⚠️", "ℹ️", "✅", "❌", "📌", "🔥", "🧠"])
+_HEADING_PREFIXES = (
+    ('# ', "heading_1"),
+    ('## ', "heading_2"),
+    ('### ', "heading_3"),
+    ('#### ', "heading_3"),  # 🆕 H4 兼容 (####) -> 转为 H3
+)
+
+def _rich_block(block_type: str, text: str) -> Dict:
+    return {"object": "block", "type": block_type, block_type: {"rich_text": parse_rich_text(text)}}
+
+def _line_block(stripped: str) -> Dict:
+    """
+    普通 Markdown 行 -> Block：按首字符分派，每行只判断一次
+    """
+    first = stripped[0]
+
+    # H1 - H3 (+ H4)
+    if first == '#':
+        for prefix, block_type in _HEADING_PREFIXES:
+            if stripped.startswith(prefix):
+                return _rich_block(block_type, stripped[len(prefix):])
+
+    # Lists
+    elif first == '-' or first == '*':
+        if stripped[1:2] == ' ':
+            return _rich_block("bulleted_list_item", stripped[2:])
+
+    elif first.isdigit():
+        m = _NUMBERED_PREFIX.match(stripped)
+        if m:
+            return _rich_block("numbered_list_item", stripped[m.end():])
+
+    # Quote & Callout 智能识别
+    elif first == '>':
+        if stripped[1:2] == ' ':
+            content = stripped[2:].strip()
+            first_char = content[0] if content else ""
+            # 以常用 Emoji 开头，或第二个字符是空格 (LLM 常生成 "> 💡 提示") 时视为 Callout
+            if first_char in _CALLOUT_EMOJIS or (len(content) > 1 and content[1] == " "):
+                text_content = content[1:].strip() if len(content) > 1 else content
+                return {
+                    "object": "block", "type": "callout",
+                    "callout": {
+                        "rich_text": parse_rich_text(text_content),
+                        "icon": {"emoji": first_char},
+                        "color": "gray_background" # 默认灰色背景，好看
+                    }
+                }
+            return _rich_block("quote", content)
+
+    # Paragraph
+    return _rich_block("paragraph", stripped)
+
 def markdown_to_blocks(markdown_text: str) -> List[Dict]:
     """
     核心转换器：Markdown -> Notion Blocks
     支持：Headings, Lists, Quote, Code Block, Table, Rich Text, Math Block
+    单遍扫描：公式块 / 代码块 / 表格用状态机处理，其余行交给 _line_block 按首字符分派
     """
+    if not markdown_text: return []
     blocks = []
-    if not markdown_text: return blocks
-        
-    lines = markdown_text.split('\n')
-    
+
     # --- 状态机变量 ---
     code_mode = False
     code_content = []
     code_lang = "plain text"
-    
-    math_mode = False  # 🆕 新增：公式块模式
+
+    math_mode = False  # 公式块模式
     math_content = []
 
-    table_rows = [] 
+    table_rows = []
+
+    def flush_table():
+        tb = _flush_table(table_rows)
+        if tb: blocks.append(tb)
+        table_rows.clear()
 
-    for line in lines:
+    for line in markdown_text.split('\n'):
         stripped = line.strip()
-        
+        first = stripped[:1]
+
         # ==========================
-        # 🆕 1. 处理独立公式块 ($$)
+        # 1. 处理独立公式块 ($$)
         # ==========================
-        if stripped.startswith("$$"):
+        if first == '$' and stripped.startswith("$$"):
             # 情况 A: 单行公式块 $$ E=mc^2 $$
             if stripped.endswith("$$") and len(stripped) > 2:
-                expr = stripped[2:-2].strip()
                 blocks.append({
                     "object": "block", "type": "equation",
-                    "equation": {"expression": expr}
+                    "equation": {"expression": stripped[2:-2].strip()}
                 })
                 continue
-            
+
             # 情况 B: 多行公式块的开始或结束
             if math_mode:
-                # 结束公式块
                 blocks.append({
                     "object": "block", "type": "equation",
                     "equation": {"expression": "\n".join(math_content)}
@@ -201,15 +307,11 @@ def markdown_to_blocks(markdown_text: str) -> List[Dict]:
                 math_mode = False
                 math_content = []
             else:
-                # 开始公式块
-                # 先结算之前的表格
-                if table_rows:
-                    tb = _flush_table(table_rows)
-                    if tb: blocks.append(tb)
-                    table_rows = []
+                # 开始公式块，先结算之前的表格
+                if table_rows: flush_table()
                 math_mode = True
             continue
-            
+
         if math_mode:
             math_content.append(line) # 保留原始格式
             continue
@@ -217,7 +319,7 @@ def markdown_to_blocks(markdown_text: str) -> List[Dict]:
         # ==========================
         # 2. 处理代码块 (```)
         # ==========================
-        if stripped.startswith("```"):
+        if first == '`' and stripped.startswith("```"):
             if code_mode:
                 blocks.append({
                     "object": "block", "type": "code",
@@ -229,15 +331,11 @@ def markdown_to_blocks(markdown_text: str) -> List[Dict]:
                 code_mode = False
                 code_content = []
             else:
-                if table_rows:
-                    tb = _flush_table(table_rows)
-                    if tb: blocks.append(tb)
-                    table_rows = []
+                if table_rows: flush_table()
                 code_mode = True
-                lang = stripped[3:].strip()
-                code_lang = lang if lang else "plain text"
+                code_lang = stripped[3:].strip() or "plain text"
             continue
-            
+
         if code_mode:
             code_content.append(line)
             continue
@@ -245,112 +343,199 @@ def markdown_to_blocks(markdown_text: str) -> List[Dict]:
         # ==========================
         # 3. 处理表格 (| ... |)
         # ==========================
-        if stripped.startswith('|'):
+        if first == '|':
             clean_cells = [c.strip() for c in stripped.strip('|').split('|')]
-            is_separator = all(re.match(r'^[-: ]+$', c) for c in clean_cells if c)
+            is_separator = all(_TABLE_SEPARATOR_CELL.fullmatch(c) for c in clean_cells if c)
             if not is_separator:
                 table_rows.append(clean_cells)
             continue
-        
-        if table_rows:
-            tb = _flush_table(table_rows)
-            if tb: blocks.append(tb)
-            table_rows = []
+
+        if table_rows: flush_table()
 
         if not stripped: continue
 
         # ==========================
         # 4. 普通 Markdown 解析
         # ==========================
-        
-        # H1 - H3
-        if stripped.startswith('# '):
-            blocks.append({
-                "object": "block", "type": "heading_1",
-                "heading_1": {"rich_text": parse_rich_text(stripped[2:])}
-            })
-        elif stripped.startswith('## '):
-            blocks.append({
-                "object": "block", "type": "heading_2",
-                "heading_2": {"rich_text": parse_rich_text(stripped[3:])}
-            })
-        elif stripped.startswith('### '):
-            blocks.append({
-                "object": "block", "type": "heading_3",
-                "heading_3": {"rich_text": parse_rich_text(stripped[4:])}
-            })
-            
-        # 🆕 H4 兼容 (####) -> 转为 H3
-        elif stripped.startswith('#### '):
-            blocks.append({
-                "object": "block", "type": "heading_3",
-                "heading_3": {"rich_text": parse_rich_text(stripped[5:])}
-            })
-
-        # Lists
-        elif stripped.startswith('- ') or stripped.startswith('* '):
-            blocks.append({
-                "object": "block", "type": "bulleted_list_item",
-                "bulleted_list_item": {"rich_text": parse_rich_text(stripped[2:])}
-            })
-        elif re.match(r'^\d+\.\s', stripped):
-            content = re.sub(r'^\d+\.\s', '', stripped, count=1)
-            blocks.append({
-                "object": "block", "type": "numbered_list_item",
-                "numbered_list_item": {"rich_text": parse_rich_text(content)}
-            })
-            
-        # Quote & Callout 智能识别
-        elif stripped.startswith('> '):
-            content = stripped[2:].strip()
-            # 检测是否以 Emoji 开头 (简单列举常用 Emoji，或者判断首字符)
-            # 这里列举最常用的作为 Callout 触发器
-            callout_emojis = ["💡", "⚠️", "ℹ️", "✅", "❌", "📌", "🔥", "🧠"]
-            first_char = content[0] if content else ""
-            
-            # 如果以这些 Emoji 开头，渲染为 Callout (标注框)
-            if first_char in callout_emojis or (len(content) > 1 and content[1] in [" "]): 
-                # 简单 heuristic: 假设 LLM 生成 "> 💡 提示"
-                # 提取图标
-                icon = first_char
-                text_content = content[1:].strip() if len(content) > 1 else content
-                
-                blocks.append({
-                    "object": "block", "type": "callout",
-                    "callout": {
-                        "rich_text": parse_rich_text(text_content),
-                        "icon": {"emoji": icon},
-                        "color": "gray_background" # 默认灰色背景，好看
-                    }
-                })
-            else:
-                # 否则渲染为普通引用 (Quote)
-                blocks.append({
-                    "object": "block", "type": "quote",
-                    "quote": {"rich_text": parse_rich_text(content)}
-                })
-            
-        # Paragraph
-        else:
-            blocks.append({
-                "object": "block", "type": "paragraph",
-                "paragraph": {"rich_text": parse_rich_text(stripped)}
-            })
+        blocks.append(_line_block(stripped))
 
     # 收尾
-    if table_rows:
-        tb = _flush_table(table_rows)
-        if tb: blocks.append(tb)
-    if code_mode and code_content: # 这里只是简单兜底，不严谨但够用
-        pass
+    if table_rows: flush_table()
     if math_mode and math_content: # 兜底公式
-         blocks.append({
+        blocks.append({
             "object": "block", "type": "equation",
             "equation": {"expression": "\n".join(math_content)}
         })
 
     return blocks
 
+# ==========================================
+# 🔁 反向转换 (Blocks -> Markdown)
+# ==========================================
+
+# annotations -> (左标记, 右标记)，由内到外包裹；color 只还原高亮
+_ANNOTATION_MARKS = [
+    ("code", "`", "`"),
+    ("bold", "**", "**"),
+    ("italic", "*", "*"),
+    ("strikethrough", "~~", "~~"),
+]
+# 连续出现时不空行的列表类 block
+_LIST_TYPES = {"bulleted_list_item", "numbered_list_item", "to_do", "toggle"}
+# 自身没有内容、只承载子块的 block
+_CONTAINER_TYPES = {"column_list", "column", "synced_block"}
+
+def _rich_text_content(item: Dict) -> str:
+    if item.get("type") == "text":
+        return item.get("text", {}).get("content", item.get("plain_text", ""))
+    return item.get("plain_text", "")
+
+def rich_text_to_markdown(rich_text: List[Dict]) -> str:
+    """
+    Notion rich_text 数组 -> Markdown 行内文本 (parse_rich_text 的逆过程)
+    支持: **Bold**, *Italic*, ~~Strike~~, `Code`, [Link](url), $Math$, ==Highlight==
+    """
+    parts = []
+    for item in rich_text or []:
+        if item.get("type") == "equation":
+            parts.append(f"${item['equation']['expression']}$")
+            continue
+
+        content = _rich_text_content(item)
+        core = content.strip()
+        if not core:
+            parts.append(content)
+            continue
+        annotations = item.get("annotations") or {}
+        # 标记必须紧贴文字 (`** x**` 不是合法加粗)，首尾空白挪到标记外面；行内代码里的空白是内容的一部分，原样保留
+        if annotations.get("code"):
+            lead, core, trail = "", content, ""
+        else:
+            lead = content[: len(content) - len(content.lstrip())]
+            trail = content[len(content.rstrip()):]
+
+        for key, left, right in _ANNOTATION_MARKS:
+            if annotations.get(key):
+                core = f"{left}{core}{right}"
+        if annotations.get("color") == "yellow_background":
+            core = f"=={core}=="
+        link = (item.get("text") or {}).get("link") or ({"url": item["href"]} if item.get("href") else None)
+        if link and link.get("url"):
+            core = f"[{core}]({link['url']})"
+        parts.append(f"{lead}{core}{trail}")
+    return "".join(parts)
+
+def _plain(rich_text: List[Dict]) -> str:
+    return "".join(_rich_text_content(t) for t in rich_text or [])
+
+def _table_to_markdown(block: Dict) -> List[str]:
+    rows = [
+        [rich_text_to_markdown(cell).replace("|", "\\|").replace("\n", " ") for cell in row["table_row"]["cells"]]
+        # 从 Notion 读取的表格行在 block["children"]，markdown_to_blocks 生成的在 block["table"]["children"]
+        for row in block.get("children") or block["table"].get("children") or []
+        if row.get("type") == "table_row"
+    ]
+    if not rows:
+        return []
+    lines = ["| " + " | ".join(row) + " |" for row in rows]
+    # 没有表头时补一个空表头，保证是合法的 Markdown 表格
+    if block["table"].get("has_column_header", True):
+        header, body = lines[:1], lines[1:]
+    else:
+        header, body = ["| " + " | ".join([" "] * len(rows[0])) + " |"], lines
+    return header + ["| " + " | ".join(["---"] * len(rows[0])) + " |"] + body
+
+def _file_url(payload: Dict) -> str:
+    return (payload.get("file") or payload.get("external") or {}).get("url", "") or payload.get("url", "")
+
+def _block_to_lines(block: Dict, number: int) -> List[str]:
+    """单个 block -> Markdown 行 (不含子块)"""
+    b_type = block.get("type")
+    payload = block.get(b_type) or {}
+    text = rich_text_to_markdown(payload.get("rich_text", []))
+
+    if b_type == "paragraph":
+        return [text]
+    if b_type in ("heading_1", "heading_2", "heading_3"):
+        return [f"{'#' * int(b_type[-1])} {text}"]
+    if b_type == "bulleted_list_item":
+        return [f"- {text}"]
+    if b_type == "numbered_list_item":
+        return [f"{number}. {text}"]
+    if b_type == "to_do":
+        return [f"- [{'x' if payload.get('checked') else ' '}] {text}"]
+    if b_type == "toggle":
+        return [f"- {text}"]
+    if b_type == "quote":
+        return [f"> {line}" for line in text.split("\n")]
+    if b_type == "callout":
+        icon = (payload.get("icon") or {}).get("emoji", "💡")
+        lines = text.split("\n")
+        return [f"> {icon} {lines[0]}"] + [f"> {line}" for line in lines[1:]]
+    if b_type == "code":
+        lang = payload.get("language", "plain text")
+        return [f"```{'' if lang == 'plain text' else lang}", _plain(payload.get("rich_text", [])), "```"]
+    if b_type == "equation":
+        expression = payload.get("expression", "")
+        return ["$$", expression, "$$"] if "\n" in expression else [f"$$ {expression} $$"]
+    if b_type == "divider":
+        return ["---"]
+    if b_type == "table":
+        return _table_to_markdown(block)
+    if b_type in ("image", "video", "file", "pdf", "audio"):
+        caption = _plain(payload.get("caption", [])) or b_type
+        return [f"{'!' if b_type == 'image' else ''}[{caption}]({_file_url(payload)})"]
+    if b_type in ("bookmark", "embed", "link_preview"):
+        url = payload.get("url", "")
+        return [f"[{_plain(payload.get('caption', [])) or url}]({url})"]
+    if b_type == "child_page":
+        return [f"📄 {payload.get('title', 'Untitled')}"]
+    if b_type == "child_database":
+        return [f"🗂️ {payload.get('title', 'Untitled')}"]
+    if text:
+        return [text]
+    return [f"<!-- unsupported block: {b_type} -->"]
+
+def blocks_to_markdown(blocks: List[Dict], indent: int = 0) -> str:
+    """
+    核心转换器：Notion Blocks -> Markdown (markdown_to_blocks 的逆过程)
+    blocks 可带 "children" 字段 (get_block_tree 的结果)，子块缩进 4 个空格。
+    连续的列表项之间不空行，其余 block 之间空一行。
+    """
+    out: List[str] = []
+    prefix = " " * indent
+    number = 0
+    previous = None
+    for block in blocks or []:
+        b_type = block.get("type")
+        number = number + 1 if b_type == "numbered_list_item" else 0
+        is_item = b_type in _LIST_TYPES
+        if b_type in _CONTAINER_TYPES:
+            # 分栏 / 同步块本身没有内容，子块按同级展开
+            child_md = blocks_to_markdown(block.get("children", []), indent)
+            if child_md:
+                if out:
+                    out.append("")
+                out.append(child_md)
+            previous = b_type
+            continue
+        if out and not (is_item and previous in _LIST_TYPES):
+            out.append("")
+
+        # 子块整体缩进 (代码块的多行内容也要逐行缩进)
+        for line in "\n".join(_block_to_lines(block, number)).split("\n"):
+            out.append(f"{prefix}{line}" if line else line)
+
+        children = block.get("children")
+        if children and b_type != "table":
+            child_md = blocks_to_markdown(children, indent + 4)
+            if child_md:
+                if not is_item:
+                    out.append("")
+                out.append(child_md)
+        previous = b_type
+    return "\n".join(out)
+
 # ==========================================
 # 🚀 业务逻辑操作 (Public API)
 # ==========================================
@@ -388,7 +573,8 @@ def create_general_note(data: Dict, target_db_id: str, original_url: str = None)
         initial_batch = children[:100]
         remaining_blocks = children[100:]
         
-        response = notion.pages.create(
+        response = _call(
+            "pages.create", notion.pages.create,
             parent={"database_id": target_db_id},
             properties={
                 "Name": {"title": [{"text": {"content": title}}]},
@@ -478,12 +664,12 @@ def overwrite_page_content(page_id: str, draft_data: Dict) -> bool:
         start_cursor = None
         
         while has_more:
-            response = notion.blocks.children.list(block_id=page_id, start_cursor=start_cursor)
+            response = _call("blocks.children.list", notion.blocks.children.list, block_id=page_id, start_cursor=start_cursor)
             blocks = response.get("results", [])
             
             # 2. 逐个删除 (Notion API 不支持批量删除，只能一个个删)
             for b in blocks:
-                notion.blocks.delete(block_id=b["id"])
+                _call("blocks.delete", notion.blocks.delete, block_id=b["id"])
             
             has_more = response.get("has_more")
             start_cursor = response.get("next_cursor")
@@ -498,31 +684,142 @@ def overwrite_page_content(page_id: str, draft_data: Dict) -> bool:
         return False
 
 
+def _block_lines(blocks: List[Dict]) -> List[str]:
+    lines = []
+    for b in blocks:
+        b_type = b.get("type")
+        # 提取 rich_text
+        if "rich_text" in b.get(b_type, {}):
+            text_objs = b[b_type]["rich_text"]
+            plain = "".join([t.get("plain_text", "") for t in text_objs])
+            if plain: lines.append(plain)
+
+        # 提取代码
+        elif b_type == "code":
+            text_objs = b["code"].get("rich_text", [])
+            code = "".join([t.get("plain_text", "") for t in text_objs])
+            lines.append(f"```\n{code}\n```")
+
+        # get_block_tree 读出的子块 (列表嵌套、toggle 内容等)
+        if b.get("children"):
+            lines.extend(_block_lines(b["children"]))
+    return lines
+
+
 def get_page_text(page_id: str) -> str:
     """
     读取页面纯文本 (用于 LLM 上下文)
     """
     print(f"📖 [Notion Ops] Reading {page_id}...")
     try:
-        response = notion.blocks.children.list(block_id=page_id)
-        blocks = response.get("results", [])
-        
-        lines = []
-        for b in blocks:
-            b_type = b.get("type")
-            # 提取 rich_text
-            if "rich_text" in b.get(b_type, {}):
-                text_objs = b[b_type]["rich_text"]
-                plain = "".join([t.get("plain_text", "") for t in text_objs])
-                if plain: lines.append(plain)
-            
-            # 提取代码
-            elif b_type == "code":
-                text_objs = b["code"].get("rich_text", [])
-                code = "".join([t.get("plain_text", "") for t in text_objs])
-                lines.append(f"```\n{code}\n```")
-
-        return "\n\n".join(lines)
+        response = _call("blocks.children.list", notion.blocks.children.list, block_id=page_id)
+        return "\n\n".join(_block_lines(response.get("results", [])))
     except Exception as e:
         print(f"❌ Read Failed: {e}")
-        return ""
\ No newline at end of file
+        return ""
+
+
+def read_page_note(page_id: str) -> Dict[str, str]:
+    """
+    读取整页 (分页 + 子块，见 get_block_tree) 并拆成 summary (开头的 💡 Callout) 与正文。
+    与 get_page_text 不同，失败时直接抛出异常 (对账需要区分"读取失败"与"空页面")。
+    """
+    blocks = get_block_tree(page_id)
+    summary = ""
+    if blocks and blocks[0].get("type") == "callout":
+        summary = "".join(t.get("plain_text", "") for t in blocks[0]["callout"].get("rich_text", []))
+        blocks = blocks[1:]
+    return {"summary": summary, "body": "\n\n".join(_block_lines(blocks))}
+
+
+def page_title(page: Dict) -> str:
+    for prop in page.get("properties", {}).values():
+        if prop.get("type") == "title":
+            return "".join(t.get("plain_text", "") for t in prop.get("title", [])) or "Untitled"
+    return "Untitled"
+
+
+def page_tags(page: Dict) -> List[str]:
+    tags = page.get("properties", {}).get("Tags", {})
+    return [t.get("name", "") for t in tags.get("multi_select", [])] if tags.get("type") == "multi_select" else []
+
+
+def is_page_deleted(page: Dict) -> bool:
+    return bool(page.get("archived") or page.get("in_trash"))
+
+
+def retrieve_page(page_id: str) -> Optional[Dict]:
+    """读取页面属性；页面不存在 (或无权访问) 时返回 None，其他错误抛出"""
+    try:
+        return _call("pages.retrieve", notion.pages.retrieve, page_id=page_id)
+    except APIResponseError as e:
+        if _error_code(e) == "object_not_found":
+            return None
+        raise
+
+
+def list_database_pages(database_id: str, page_size: int = 100):
+    """
+    分页遍历数据库中的所有页面 (只含属性与 last_edited_time，不含正文)。
+    新版 API (2025-09-03 起) 数据库下挂若干 data source，需逐个 query；旧版 SDK 直接 databases.query。
+    """
+    if hasattr(notion, "data_sources"):
+        database = _call("databases.retrieve", notion.databases.retrieve, database_id=database_id)
+        sources = [(notion.data_sources.query, {"data_source_id": ds["id"]}) for ds in database.get("data_sources", [])]
+    else:
+        sources = [(notion.databases.query, {"database_id": database_id})]
+
+    for query, target in sources:
+        start_cursor = None
+        while True:
+            kwargs = dict(target, page_size=page_size)
+            if start_cursor:
+                kwargs["start_cursor"] = start_cursor
+            response = _call("databases.query", query, **kwargs)
+            for page in response.get("results", []):
+                if page.get("object") == "page":
+                    yield page
+            if not response.get("has_more"):
+                break
+            start_cursor = response.get("next_cursor")
+
+
+def domain_databases() -> List[tuple]:
+    """(domain, database_id)，顺序同 manage_notion_note 的分类；多个 domain 可能共用一个数据库"""
+    return [
+        ("Spanish", DB_SPANISH_ID),
+        ("Tech", DB_TECH_ID),
+        ("Humanities", DB_HUMANITIES_ID),
+    ]
+
+
+def list_children(block_id: str) -> List[Dict]:
+    """分页读取一个 block 的全部直接子块"""
+    children = []
+    start_cursor = None
+    while True:
+        kwargs = {"block_id": block_id, "page_size": 100}
+        if start_cursor:
+            kwargs["start_cursor"] = start_cursor
+        response = _call("blocks.children.list", notion.blocks.children.list, **kwargs)
+        children.extend(response.get("results", []))
+        if not response.get("has_more"):
+            return children
+        start_cursor = response.get("next_cursor")
+
+
+def get_block_tree(block_id: str) -> List[Dict]:
+    """
+    读取完整的 block 树：子块放在各 block 的 "children" 字段中。
+    子页面 / 子数据库不展开 (它们是独立页面)。失败时抛出异常。
+    """
+    blocks = list_children(block_id)
+    for block in blocks:
+        if block.get("has_children") and block.get("type") not in ("child_page", "child_database"):
+            block["children"] = get_block_tree(block["id"])
+    return blocks
+
+
+def get_page_markdown(page_id: str) -> str:
+    """读取整页并转为 Markdown (无 100 个 block 的上限)"""
+    return blocks_to_markdown(get_block_tree(page_id))
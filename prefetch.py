@@ -0,0 +1,147 @@
+"""
+检索预取 (Speculative Prefetch)
+
+KNOWLEDGE 类请求按 SOP 第一步几乎总是 search_knowledge_base。
+与其等第一次 LLM 调用返回后再检索，不如在模型思考的同时，
+用用户输入在后台线程里先跑一次向量检索：
+- run_agent / arun_agent 进入 Graph 前调用 start()，回合结束调用 finish()
+- 工具收到的 query 与用户输入足够接近 (词重合度) 时直接复用预取结果
+- 命中 / 未命中 / 白跑 / 等待耗时都有计数，便于调整阈值
+"""
+import os
+import re
+import time
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import vector_ops
+
+PREFETCH_ENABLED = os.environ.get("SEARCH_PREFETCH", "1") != "0"
+PREFETCH_MIN_OVERLAP = float(os.environ.get("PREFETCH_MIN_OVERLAP", "0.6"))  # query 词在用户输入中出现的比例
+PREFETCH_RESULTS = 8            # 取工具允许的最大 k，按 domain / k 过滤在工具侧完成
+PREFETCH_QUERY_CHARS = 500      # 长输入 (整篇笔记) 只取开头做检索
+PREFETCH_WAIT_SECONDS = 10.0
+
+# 明显是音频请求时不预取 (SOP PATH A 不检索)
+AUDIO_HINTS = re.compile(
+    r"\b(audio|audiobook|read\s+(?:it\s+|this\s+)?aloud|tts|speech|voz)\b|朗读|语音|音频|有声书",
+    re.IGNORECASE,
+)
+WORD_PATTERN = re.compile(r"[a-z0-9áéíóúüñ]+|[一-鿿]", re.IGNORECASE)
+STOPWORDS = {
+    "the", "and", "for", "about", "note", "notes", "my", "a", "an", "of", "to", "in", "on", "me", "please",
+    "save", "update", "create", "merge", "search", "find", "what", "do", "does", "is", "are", "say",
+    "de", "la", "el", "los", "las", "que", "y", "en", "sobre", "mis", "notas",
+}
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="prefetch")
+
+
+def _terms(text: str) -> set:
+    return {w for w in (m.lower() for m in WORD_PATTERN.findall(text or "")) if w not in STOPWORDS}
+
+
+def overlap(query: str, source_terms: set) -> float:
+    """query 中的词有多大比例出现在用户输入里 (模型的检索词通常是输入的浓缩)"""
+    terms = _terms(query)
+    if not terms:
+        return 0.0
+    return len(terms & source_terms) / len(terms)
+
+
+class _Prefetch:
+    __slots__ = ("query", "terms", "future", "started", "used")
+
+    def __init__(self, query: str, future):
+        self.query = query
+        self.terms = _terms(query)
+        self.future = future
+        self.started = time.perf_counter()
+        self.used = False
+
+
+class SearchPrefetcher:
+    def __init__(self):
+        self._active: Dict[str, _Prefetch] = {}
+        self._lock = threading.Lock()
+        self.counters = {"started": 0, "skipped": 0, "hits": 0, "misses": 0, "used": 0, "unused": 0, "errors": 0}
+        self.wait_ms = 0.0
+        self.saved_ms = 0.0
+
+    def start(self, thread_id: str, user_input: str):
+        """在后台开始检索；调用方随后发起第一次 LLM 调用"""
+        if not PREFETCH_ENABLED or not thread_id:
+            return
+        query = (user_input or "").strip()[:PREFETCH_QUERY_CHARS]
+        if len(_terms(query)) < 2 or AUDIO_HINTS.search(query):
+            self.counters["skipped"] += 1
+            return
+        # 复制上下文：预取的 vector span 挂在本轮 trace 下
+        ctx = contextvars.copy_context()
+        future = _executor.submit(ctx.run, vector_ops.search_memories, query, PREFETCH_RESULTS, "All")
+        with self._lock:
+            self._active[thread_id] = _Prefetch(query, future)
+            self.counters["started"] += 1
+
+    def take(self, thread_id: str, query: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        工具侧调用：query 与预取输入足够接近时返回预取的候选 (按距离排序，未按 domain 过滤)，
+        否则返回 None，由工具自行检索。
+        """
+        with self._lock:
+            entry = self._active.get(thread_id) if thread_id else None
+        if entry is None:
+            return None
+        if overlap(query, entry.terms) < PREFETCH_MIN_OVERLAP:
+            self.counters["misses"] += 1
+            print(f"🔮 [Prefetch] Miss: '{query[:40]}' vs '{entry.query[:40]}'")
+            return None
+
+        wait_start = time.perf_counter()
+        try:
+            candidates = entry.future.result(timeout=PREFETCH_WAIT_SECONDS)
+        except Exception as e:
+            self.counters["errors"] += 1
+            print(f"⚠️ [Prefetch] Failed, searching normally: {e}")
+            return None
+        waited = (time.perf_counter() - wait_start) * 1000
+        with self._lock:
+            self.counters["hits"] += 1
+            self.wait_ms += waited
+            # 预取耗时里没有被等待的部分，就是和 LLM 调用重叠掉的时间
+            if not entry.used:
+                self.counters["used"] += 1
+                self.saved_ms += max(0.0, (time.perf_counter() - entry.started) * 1000 - waited)
+            entry.used = True
+        print(f"🔮 [Prefetch] Hit for '{query[:40]}' (waited {waited:.0f} ms)")
+        return candidates
+
+    def finish(self, thread_id: str):
+        """回合结束：丢弃预取结果，没被用到的记为 unused"""
+        with self._lock:
+            entry = self._active.pop(thread_id, None) if thread_id else None
+            if entry is not None and not entry.used:
+                self.counters["unused"] += 1
+        if entry is not None and not entry.used:
+            entry.future.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        c = self.counters
+        lookups = c["hits"] + c["misses"]
+        return {
+            **c,
+            "hit_rate": round(c["hits"] / lookups, 3) if lookups else 0.0,
+            # 预取中真正被工具用上的比例 (越低说明白跑越多)
+            "precision": round(c["used"] / c["started"], 3) if c["started"] else 0.0,
+            "avg_wait_ms": round(self.wait_ms / c["hits"], 1) if c["hits"] else 0.0,
+            "saved_ms": round(self.saved_ms, 1),
+        }
+
+
+prefetcher = SearchPrefetcher()
+
+
+def prefetch_stats() -> Dict[str, Any]:
+    return prefetcher.stats()
@@ -0,0 +1,282 @@
+"""
+跨进程共享的 Notion 限流器 (Shared Token Bucket)
+
+多个 Streamlit 会话、API 服务、写队列 worker、批量任务各自调用 Notion，
+单进程内的限流挡不住整体超限 (Notion 对每个 integration 平均约 3 req/s)。
+这里用 SQLite 文件做一个所有进程共用的令牌桶：
+- 每次 Notion 调用前 acquire() 一个令牌，BEGIN IMMEDIATE 保证跨进程原子扣减
+- 优先级：正在排队的高优先级调用者存在时，低优先级不取令牌；同级按排队先后 (FIFO)
+  排队记录带过期时间，进程崩溃留下的记录几秒后自动失效
+- 收到 429 时 penalize()：清空令牌并按 Retry-After 暂停所有进程，避免各自重试形成错误风暴
+- 按优先级统计获取次数、等待耗时 (平均 / p95 / 最大)、429 次数
+当前调用的优先级放在 contextvar 里：with notion_priority(PRIORITY_BULK): ...
+"""
+import os
+import time
+import uuid
+import sqlite3
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List
+
+NOTION_RATE_LIMIT = float(os.environ.get("NOTION_RATE_LIMIT", "3"))      # 每秒令牌数，0 表示不限流
+NOTION_RATE_BURST = float(os.environ.get("NOTION_RATE_BURST", "3"))      # 桶容量 (允许的突发请求数)
+NOTION_RATE_LIMIT_PATH = os.environ.get("NOTION_RATE_LIMIT_PATH", "./rate_limit.db")
+WAITER_TTL_SECONDS = 2.0        # 排队记录的有效期，等待期间不断续期
+MAX_POLL_SECONDS = 0.5          # 单次睡眠上限 (保证能及时续期、及时看到 429 暂停解除)
+WAIT_SAMPLES = 512              # 每个优先级保留的等待耗时样本数 (计算 p95)
+
+# 数值越小越优先
+PRIORITY_INTERACTIVE = 0        # 用户正在等待结果的调用 (对话内直接写入 / 读取)
+PRIORITY_QUEUED = 1             # 写队列中的笔记写入 (用户已拿到回执)
+PRIORITY_BULK = 2               # 批量读取 / 同步 / 导出等后台任务
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_QUEUED: "queued", PRIORITY_BULK: "bulk"}
+
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar("notion_priority", default=PRIORITY_INTERACTIVE)
+
+
+@contextmanager
+def notion_priority(priority: int):
+    """块内发起的 Notion 调用使用指定优先级 (线程池任务需 copy_context 才能继承)"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+def map_with_priority(fn: Callable, items: List, workers: int, priority: int = PRIORITY_BULK) -> List:
+    """并发执行 fn(item) 并按顺序返回结果；每个任务在复制的上下文中以指定优先级调用 Notion"""
+    def _run(item):
+        with notion_priority(priority):
+            return fn(item)
+
+    if not items:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="notion-bulk") as executor:
+        futures = [executor.submit(contextvars.copy_context().run, _run, item) for item in items]
+        return [f.result() for f in futures]
+
+
+class _WaitStats:
+    def __init__(self):
+        self.acquired = 0
+        self.waited = 0             # 需要等待 (> 1 ms) 的次数
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+        self.samples = deque(maxlen=WAIT_SAMPLES)
+
+    def record(self, wait_ms: float):
+        self.acquired += 1
+        self.total_wait_ms += wait_ms
+        self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+        self.samples.append(wait_ms)
+        if wait_ms > 1.0:
+            self.waited += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        ordered = sorted(self.samples)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] if ordered else 0.0
+        return {
+            "acquired": self.acquired,
+            "waited": self.waited,
+            "avg_wait_ms": round(self.total_wait_ms / self.acquired, 1) if self.acquired else 0.0,
+            "p95_wait_ms": round(p95, 1),
+            "max_wait_ms": round(self.max_wait_ms, 1),
+        }
+
+
+class SharedRateLimiter:
+    def __init__(self, name: str = "notion", rate: float = NOTION_RATE_LIMIT, burst: float = NOTION_RATE_BURST,
+                 path: str = NOTION_RATE_LIMIT_PATH):
+        self.name = name
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+        self._stats: Dict[int, _WaitStats] = {}
+        self.counters = {"throttled": 0, "penalty_seconds": 0.0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    # ==========================================
+    # 🗄️ 存储
+    # ==========================================
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)
+            conn.executescript(
+                """
+                PRAGMA journal_mode=WAL;
+                PRAGMA synchronous=NORMAL;
+                CREATE TABLE IF NOT EXISTS buckets (
+                    name TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL,
+                    blocked_until REAL NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS waiters (
+                    id TEXT PRIMARY KEY,
+                    bucket TEXT NOT NULL,
+                    priority INTEGER NOT NULL,
+                    since REAL NOT NULL,
+                    expires REAL NOT NULL
+                );
+                """
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)",
+                (self.name, self.burst, time.time()),
+            )
+            self._conn = conn
+        return self._conn
+
+    def _try_take(self, waiter_id: str, priority: int, since: float, cost: float) -> float:
+        """
+        尝试取令牌：成功返回 0，否则登记 (续期) 排队记录并返回建议的睡眠秒数。
+        整个判断在一个 IMMEDIATE 事务里，多进程之间串行。
+        """
+        with self._lock:
+            conn = self._db()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                tokens, updated, blocked_until = conn.execute(
+                    "SELECT tokens, updated, blocked_until FROM buckets WHERE name = ?", (self.name,)
+                ).fetchone()
+                tokens = min(self.burst, tokens + max(0.0, now - updated) * self.rate)
+                conn.execute("DELETE FROM waiters WHERE bucket = ? AND expires < ?", (self.name, now))
+                ahead = conn.execute(
+                    "SELECT COUNT(*) FROM waiters WHERE bucket = ? AND id != ? "
+                    "AND (priority < ? OR (priority = ? AND since < ?))",
+                    (self.name, waiter_id, priority, priority, since),
+                ).fetchone()[0]
+
+                if now >= blocked_until and tokens >= cost and not ahead:
+                    conn.execute("UPDATE buckets SET tokens = ?, updated = ? WHERE name = ?",
+                                 (tokens - cost, now, self.name))
+                    conn.execute("DELETE FROM waiters WHERE id = ?", (waiter_id,))
+                    conn.execute("COMMIT")
+                    return 0.0
+
+                conn.execute("UPDATE buckets SET tokens = ?, updated = ? WHERE name = ?", (tokens, now, self.name))
+                conn.execute(
+                    "INSERT OR REPLACE INTO waiters (id, bucket, priority, since, expires) VALUES (?, ?, ?, ?, ?)",
+                    (waiter_id, self.name, priority, since, now + WAITER_TTL_SECONDS),
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+        # 排在别人后面时按令牌生成间隔轮询；排在队首时睡到令牌够用 / 暂停结束
+        wait = max(blocked_until - now, (cost - tokens) / self.rate, 0.0)
+        if ahead:
+            wait = max(wait, 1.0 / self.rate)
+        return min(max(wait, 0.005), MAX_POLL_SECONDS)
+
+    def _leave(self, waiter_id: str):
+        with self._lock:
+            self._db().execute("DELETE FROM waiters WHERE id = ?", (waiter_id,))
+
+    # ==========================================
+    # 🎯 入口
+    # ==========================================
+
+    def acquire(self, priority: int = None, cost: float = 1.0) -> float:
+        """阻塞直到取得令牌，返回等待的毫秒数"""
+        if not self.enabled:
+            return 0.0
+        priority = current_priority() if priority is None else priority
+        cost = min(cost, self.burst)
+        waiter_id = uuid.uuid4().hex
+        start = time.perf_counter()
+        since = time.time()
+        try:
+            while True:
+                try:
+                    wait = self._try_take(waiter_id, priority, since, cost)
+                except sqlite3.Error as e:
+                    # 限流存储不可用时不阻塞业务调用
+                    print(f"⚠️ [RateLimit] Limiter unavailable, proceeding: {e}")
+                    break
+                if wait == 0.0:
+                    break
+                time.sleep(wait)
+        except BaseException:
+            self._leave(waiter_id)
+            raise
+        wait_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self._stats.setdefault(priority, _WaitStats()).record(wait_ms)
+        return wait_ms
+
+    def penalize(self, retry_after: float):
+        """收到 429：清空令牌并让所有进程暂停 retry_after 秒"""
+        if not self.enabled:
+            return
+        retry_after = max(retry_after, 1.0 / self.rate)
+        with self._lock:
+            self.counters["throttled"] += 1
+            self.counters["penalty_seconds"] += retry_after
+            try:
+                now = time.time()
+                self._db().execute(
+                    "UPDATE buckets SET tokens = 0, updated = ?, blocked_until = MAX(blocked_until, ?) WHERE name = ?",
+                    (now, now + retry_after, self.name),
+                )
+            except sqlite3.Error as e:
+                print(f"⚠️ [RateLimit] Failed to record penalty: {e}")
+        print(f"🚦 [RateLimit] {self.name} throttled, pausing all callers for {retry_after:.1f}s")
+
+    def stats(self) -> Dict[str, Any]:
+        shared = {}
+        if self.enabled:
+            try:
+                with self._lock:
+                    conn = self._db()
+                    now = time.time()
+                    tokens, updated, blocked_until = conn.execute(
+                        "SELECT tokens, updated, blocked_until FROM buckets WHERE name = ?", (self.name,)
+                    ).fetchone()
+                    waiting = conn.execute(
+                        "SELECT COUNT(*) FROM waiters WHERE bucket = ? AND expires >= ?", (self.name, now)
+                    ).fetchone()[0]
+                shared = {
+                    "tokens": round(min(self.burst, tokens + max(0.0, now - updated) * self.rate), 2),
+                    "waiting": waiting,
+                    "paused_seconds": round(max(0.0, blocked_until - now), 1),
+                }
+            except sqlite3.Error:
+                pass
+        with self._lock:
+            by_priority = {PRIORITY_NAMES.get(p, str(p)): s.snapshot() for p, s in sorted(self._stats.items())}
+        return {
+            "enabled": self.enabled,
+            "rate": self.rate,
+            "burst": self.burst,
+            **shared,
+            "throttled": self.counters["throttled"],
+            "penalty_seconds": round(self.counters["penalty_seconds"], 1),
+            "by_priority": by_priority,
+        }
+
+
+notion_limiter = SharedRateLimiter()
+
+
+def rate_limit_stats() -> Dict[str, Any]:
+    return notion_limiter.stats()
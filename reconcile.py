@@ -0,0 +1,326 @@
+"""
+Notion ↔ 向量库对账 (Reconciliation)
+
+manage_notion_note 的向量同步是尽力而为：add_memory 失败、在 Notion 里手动编辑 / 删除页面，
+都会让 chroma_db 与 Notion 慢慢漂移 (Agent 拿着已删除页面的 id 去覆盖)。
+对账流程：
+1. 分页列出三个数据库的全部页面 (只取属性与 last_edited_time)，分页遍历向量库全部记录
+2. 逐页比较：
+   - Notion 有、向量库没有            -> 读取正文并索引 (added)
+   - 两边都有，last_edited_time 未变   -> 跳过 (unchanged)；
+     向量库记录的索引时间晚于最后编辑时间的旧记录只补写时间戳 (stamped)
+   - 两边都有，编辑时间变了            -> 读取正文比较内容哈希，变了才重新向量化 (reembedded)，
+     否则只更新时间戳 (stamped)
+   - 向量库有、数据库列表里没有        -> 单独确认页面已删除 / 归档后删除向量 (deleted)，
+     页面仍存在 (被移到别处) 时保留 (unlisted)
+3. Notion 读取在线程池中并发执行 (走共享限流器的 bulk 优先级)，向量写入按批 upsert
+4. 输出差异报告 (控制台 + JSON)
+
+任何数据库列表读取失败时不删除任何记录 (避免因一次网络错误清空索引)。
+
+用法:
+    python reconcile.py [--dry-run] [--workers 4] [--report logs/reconcile.json]
+"""
+import os
+import json
+import time
+import hashlib
+import argparse
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import notion_ops
+import vector_ops
+from rate_limit import map_with_priority
+from tracing import span
+
+RECONCILE_WORKERS = int(os.environ.get("RECONCILE_WORKERS", "4"))
+RECONCILE_REPORT_DIR = os.environ.get("RECONCILE_REPORT_DIR", "./logs")
+EMBED_BATCH = 32                            # 每次 upsert (一次 embedding 请求) 的页面数
+EDIT_TIME_GRANULARITY = timedelta(minutes=1)  # Notion 的 last_edited_time 只精确到分钟
+# 向量库 metadata 中对账使用的字段
+META_EDITED = "notion_edited"
+META_HASH = "content_hash"
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def semantic_text(title: str, summary: str, body: str) -> str:
+    """与 write_note_job 写入时的索引文本格式一致"""
+    return f"Title: {title}\nSummary: {summary}\n\n{body}"
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8", "ignore")).hexdigest()[:16]
+
+
+class Reconciler:
+    def __init__(self, workers: int = RECONCILE_WORKERS, dry_run: bool = False):
+        self.workers = workers
+        self.dry_run = dry_run
+        self.report: Dict[str, Any] = {
+            "started_at": _now_iso(),
+            "dry_run": dry_run,
+            "databases": {},
+            "notion_pages": 0,
+            "indexed": 0,
+            "unchanged": 0,
+            "stamped": [],
+            "added": [],
+            "reembedded": [],
+            "deleted": [],
+            "unlisted": [],
+            "skipped": [],
+            "errors": [],
+        }
+
+    # ==========================================
+    # 📋 收集两边的状态
+    # ==========================================
+
+    def _list_notion(self) -> Tuple[Dict[str, Dict], bool]:
+        """page_id -> {"page", "domains"}；第二个返回值表示是否所有数据库都完整列出"""
+        by_database: Dict[str, List[str]] = {}
+        for domain, database_id in notion_ops.domain_databases():
+            if database_id:
+                by_database.setdefault(database_id, []).append(domain)
+
+        pages: Dict[str, Dict] = {}
+        complete = True
+        for database_id, domains in by_database.items():
+            count = 0
+            try:
+                for page in notion_ops.list_database_pages(database_id):
+                    pages[page["id"]] = {"page": page, "domains": domains}
+                    count += 1
+            except Exception as e:
+                complete = False
+                self.report["errors"].append({"database_id": database_id, "stage": "list", "error": str(e)})
+                print(f"❌ [Reconcile] Failed to list database {database_id}: {e}")
+            self.report["databases"][database_id] = {"domains": domains, "pages": count}
+        self.report["notion_pages"] = len(pages)
+        return pages, complete
+
+    @staticmethod
+    def _domain_for(entry: Dict, meta: Dict) -> str:
+        """优先用页面 Tags 中的分类，其次沿用已索引的 domain，最后取数据库对应的第一个 domain"""
+        domains = entry["domains"]
+        for tag in notion_ops.page_tags(entry["page"]):
+            if tag in domains:
+                return tag
+        if meta.get("domain") in domains:
+            return meta["domain"]
+        return domains[0]
+
+    @staticmethod
+    def _is_fresh(page: Dict, meta: Dict) -> Optional[str]:
+        """无需读取正文时返回原因：unchanged / stamp"""
+        edited = page.get("last_edited_time")
+        if edited and meta.get(META_EDITED) == edited:
+            return "unchanged"
+        edited_at, indexed_at = _parse_time(edited), _parse_time(meta.get("indexed_at"))
+        if edited_at and indexed_at and indexed_at >= edited_at + EDIT_TIME_GRANULARITY:
+            return "stamp"
+        return None
+
+    # ==========================================
+    # 🔧 修复
+    # ==========================================
+
+    def _read(self, job: Dict) -> Dict:
+        try:
+            note = notion_ops.read_page_note(job["page_id"])
+        except Exception as e:
+            return dict(job, error=str(e))
+        text = semantic_text(job["title"], note["summary"], note["body"])
+        empty = not (note["summary"].strip() or note["body"].strip())
+        return dict(job, summary=note["summary"], text=text, hash=content_hash(text), empty=empty)
+
+    def _confirm_orphan(self, page_id: str) -> Dict:
+        try:
+            page = notion_ops.retrieve_page(page_id)
+        except Exception as e:
+            return {"page_id": page_id, "error": str(e)}
+        return {"page_id": page_id, "gone": page is None or notion_ops.is_page_deleted(page)}
+
+    def _entry(self, job: Dict, **extra) -> Dict:
+        return {"page_id": job["page_id"], "title": job["title"], **extra}
+
+    def _apply(self, reads: List[Dict], stamps: List[Dict]):
+        upserts, updates = [], []
+        for job in reads:
+            if "error" in job:
+                self.report["errors"].append(self._entry(job, stage="read", error=job["error"]))
+                continue
+            if job["kind"] == "changed" and job["meta"].get(META_HASH) == job["hash"]:
+                stamps.append(job)
+                continue
+            if job["empty"]:
+                self.report["skipped"].append(self._entry(job, reason="empty page"))
+                continue
+            upserts.append(job)
+
+        for job in stamps:
+            meta = {META_EDITED: job["edited"]}
+            if "hash" in job:
+                meta[META_HASH] = job["hash"]
+            updates.append((job["page_id"], meta))
+            self.report["stamped"].append(self._entry(job))
+
+        for job in upserts:
+            bucket = "added" if job["kind"] == "missing" else "reembedded"
+            self.report[bucket].append(self._entry(job, reason=job.get("reason", job["kind"])))
+
+        if self.dry_run:
+            return
+        if updates:
+            try:
+                vector_ops.update_metadata([pid for pid, _ in updates], [m for _, m in updates])
+            except Exception as e:
+                self.report["errors"].append({"stage": "stamp", "pages": len(updates), "error": str(e)})
+        for i in range(0, len(upserts), EMBED_BATCH):
+            batch = upserts[i:i + EMBED_BATCH]
+            items = [{
+                "page_id": job["page_id"],
+                "text": job["text"],
+                "title": job["title"],
+                "domain": job["domain"],
+                "metadata": {
+                    "summary": job["summary"],
+                    "type": job["meta"].get("type", "note"),
+                    "url": job["url"],
+                    "indexed_at": _now_iso(),
+                    META_EDITED: job["edited"],
+                    META_HASH: job["hash"],
+                },
+            } for job in batch]
+            try:
+                vector_ops.upsert_memories(items)
+                print(f"💾 [Reconcile] Upserted {i + len(batch)}/{len(upserts)} pages")
+            except Exception as e:
+                for job in batch:
+                    self.report["errors"].append(self._entry(job, stage="embed", error=str(e)))
+
+    def run(self) -> Dict[str, Any]:
+        start = time.perf_counter()
+        with span("reconcile.run", dry_run=self.dry_run):
+            pages, complete = self._list_notion()
+            index = dict(vector_ops.iter_all_memories())
+            self.report["indexed"] = len(index)
+            print(f"📋 [Reconcile] Notion: {len(pages)} pages · Vector DB: {len(index)} entries")
+
+            reads, stamps, orphans = [], [], []
+            for page_id, entry in pages.items():
+                page = entry["page"]
+                meta = index.get(page_id)
+                if notion_ops.is_page_deleted(page):
+                    if meta is not None:
+                        orphans.append(page_id)
+                    continue
+                job = {
+                    "page_id": page_id,
+                    "title": notion_ops.page_title(page),
+                    "edited": page.get("last_edited_time", ""),
+                    "url": page.get("url", ""),
+                    "meta": meta or {},
+                    "domain": self._domain_for(entry, meta or {}),
+                }
+                if meta is None:
+                    reads.append(dict(job, kind="missing"))
+                    continue
+                fresh = self._is_fresh(page, meta)
+                if fresh == "unchanged":
+                    self.report["unchanged"] += 1
+                elif fresh == "stamp":
+                    stamps.append(job)
+                else:
+                    reason = "edited" if meta.get(META_HASH) else "legacy"
+                    reads.append(dict(job, kind="changed", reason=reason))
+            orphans.extend(pid for pid in index if pid not in pages)
+
+            print(f"🔧 [Reconcile] Reading {len(reads)} pages, confirming {len(orphans)} orphans...")
+            reads = map_with_priority(self._read, reads, self.workers)
+            self._apply(reads, stamps)
+
+            if not complete:
+                self.report["errors"].append({"stage": "orphans", "error": "database listing incomplete, nothing deleted"})
+            else:
+                confirmed = map_with_priority(self._confirm_orphan, orphans, self.workers)
+                gone = []
+                for result in confirmed:
+                    meta = index.get(result["page_id"], {})
+                    entry = {"page_id": result["page_id"], "title": meta.get("title", "Untitled")}
+                    if "error" in result:
+                        self.report["errors"].append(dict(entry, stage="confirm", error=result["error"]))
+                    elif result["gone"]:
+                        gone.append(result["page_id"])
+                        self.report["deleted"].append(entry)
+                    else:
+                        self.report["unlisted"].append(entry)
+                if gone and not self.dry_run:
+                    try:
+                        vector_ops.delete_memories(gone)
+                    except Exception as e:
+                        self.report["errors"].append({"stage": "delete", "pages": len(gone), "error": str(e)})
+
+        self.report["seconds"] = round(time.perf_counter() - start, 1)
+        return self.report
+
+
+def reconcile(workers: int = RECONCILE_WORKERS, dry_run: bool = False) -> Dict[str, Any]:
+    return Reconciler(workers=workers, dry_run=dry_run).run()
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    mode = " (dry run)" if report["dry_run"] else ""
+    lines = [
+        f"🧾 Reconciliation{mode}: {report['notion_pages']} Notion pages vs {report['indexed']} indexed "
+        f"in {report.get('seconds', 0)}s",
+        f"   = unchanged {report['unchanged']} · stamped {len(report['stamped'])}",
+    ]
+    for key, icon in (("added", "+"), ("reembedded", "~"), ("deleted", "-"), ("unlisted", "?"), ("skipped", "!")):
+        items = report[key]
+        if not items:
+            continue
+        lines.append(f"   {icon} {key} {len(items)}")
+        for item in items[:20]:
+            reason = f" [{item['reason']}]" if item.get("reason") else ""
+            lines.append(f"       {icon} {item['title']} ({item['page_id']}){reason}")
+        if len(items) > 20:
+            lines.append(f"       ... {len(items) - 20} more")
+    if report["errors"]:
+        lines.append(f"   ❌ errors {len(report['errors'])}")
+        for err in report["errors"][:10]:
+            lines.append(f"       ❌ {err.get('stage')}: {err.get('title') or err.get('database_id') or ''} {err['error']}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconcile the Notion databases with the vector store")
+    parser.add_argument("--dry-run", action="store_true", help="report drift without changing the vector store")
+    parser.add_argument("--workers", type=int, default=RECONCILE_WORKERS, help="concurrent Notion readers")
+    parser.add_argument("--report", default=None, help="where to write the JSON report")
+    args = parser.parse_args()
+
+    report = reconcile(workers=args.workers, dry_run=args.dry_run)
+    print(format_report(report))
+    path = args.report or os.path.join(RECONCILE_REPORT_DIR, f"reconcile-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"📄 Report written to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""
+录制 / 回放 (Record & Replay)
+
+把一次脚本化会话里所有外部依赖的响应录成 fixture，之后完全离线回放：
+- LLM / Embedding / Notion : 在 http_pool 的共享传输层拦截 HTTP 请求与响应
+- TTS                      : 替换 TTSService 的后端，录下每段合成出的音频文件
+回放时可按录制时的耗时、按比例缩放或固定延迟模拟网络，
+这样 agent_graph / tools / notion_ops 的改动可以在确定性的输入下对比耗时。
+
+fixture 目录结构:
+    http.jsonl     每行一个 HTTP 交换 (service, method, url, key, status, headers, body, latency_ms)
+    tts.jsonl      每行一次 TTS 合成 (key, file, latency_ms)
+    tts/           录制下来的音频文件
+
+用法:
+    with record("fixtures/agent"):  ...   # 需要真实的 API Key
+    with replay("fixtures/agent"):  ...   # 离线
+"""
+import os
+import json
+import time
+import base64
+import shutil
+import asyncio
+import hashlib
+import threading
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import httpx
+
+import http_pool
+from audio_ops import tts_service
+from tts_backends import TTSBackend, get_backend
+
+# 响应体已被完整读出并解码，这些头不能原样回放
+_DROP_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection"}
+
+
+class ReplayMiss(Exception):
+    """回放时找不到对应的录制记录"""
+
+
+def _request_key(request: httpx.Request) -> str:
+    h = hashlib.sha256()
+    h.update(request.method.encode())
+    h.update(str(request.url).encode())
+    h.update(request.content or b"")
+    return h.hexdigest()[:24]
+
+
+def _endpoint(service: str, request: httpx.Request) -> str:
+    return f"{service} {request.method} {request.url.path}"
+
+
+def _encode_body(body: bytes) -> Dict:
+    try:
+        return {"text": body.decode("utf-8")}
+    except UnicodeDecodeError:
+        return {"base64": base64.b64encode(body).decode("ascii")}
+
+
+def _decode_body(entry: Dict) -> bytes:
+    if "base64" in entry["body"]:
+        return base64.b64decode(entry["body"]["base64"])
+    return entry["body"]["text"].encode("utf-8")
+
+
+def _tts_key(text: str, voice: str, rate: str) -> str:
+    return hashlib.sha256(f"{voice}\x00{rate}\x00{text}".encode("utf-8")).hexdigest()[:24]
+
+
+# ==========================================
+# 🔴 录制
+# ==========================================
+
+class Recorder:
+    def __init__(self, fixture_dir: str):
+        self.fixture_dir = fixture_dir
+        self.http: List[Dict] = []
+        self.tts: List[Dict] = []
+        self._lock = threading.Lock()
+
+    def _entry(self, service, request, response, body, latency_ms) -> Dict:
+        return {
+            "service": service,
+            "method": request.method,
+            "url": str(request.url),
+            "endpoint": _endpoint(service, request),
+            "key": _request_key(request),
+            "status": response.status_code,
+            "headers": {k: v for k, v in response.headers.items() if k.lower() not in _DROP_HEADERS},
+            "body": _encode_body(body),
+            "latency_ms": round(latency_ms, 1),
+        }
+
+    @staticmethod
+    def _rebuild(response: httpx.Response, body: bytes, request: httpx.Request) -> httpx.Response:
+        headers = [(k, v) for k, v in response.headers.items() if k.lower() not in _DROP_HEADERS]
+        return httpx.Response(response.status_code, headers=headers, content=body, request=request)
+
+    def handle_request(self, service, request, inner):
+        start = time.perf_counter()
+        response = inner.handle_request(request)
+        body = response.read()
+        response.close()
+        with self._lock:
+            self.http.append(self._entry(service, request, response, body, (time.perf_counter() - start) * 1000))
+        return self._rebuild(response, body, request)
+
+    async def handle_async_request(self, service, request, inner):
+        start = time.perf_counter()
+        response = await inner.handle_async_request(request)
+        body = await response.aread()
+        await response.aclose()
+        with self._lock:
+            self.http.append(self._entry(service, request, response, body, (time.perf_counter() - start) * 1000))
+        return self._rebuild(response, body, request)
+
+    def save(self):
+        os.makedirs(os.path.join(self.fixture_dir, "tts"), exist_ok=True)
+        with open(os.path.join(self.fixture_dir, "http.jsonl"), "w", encoding="utf-8") as f:
+            for entry in self.http:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        with open(os.path.join(self.fixture_dir, "tts.jsonl"), "w", encoding="utf-8") as f:
+            for entry in self.tts:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        print(f"🔴 [Replay] Recorded {len(self.http)} HTTP exchanges and {len(self.tts)} TTS segments -> {self.fixture_dir}")
+
+
+class RecordingTTSBackend(TTSBackend):
+    """包装真实后端，合成后把音频文件复制进 fixture"""
+    name = "recording"
+
+    def __init__(self, inner: TTSBackend, recorder: Recorder):
+        self.inner = inner
+        self.recorder = recorder
+        self.audio_format = inner.audio_format
+
+    async def synthesize(self, text, voice, rate, output_path):
+        start = time.perf_counter()
+        await self.inner.synthesize(text, voice, rate, output_path)
+        latency_ms = (time.perf_counter() - start) * 1000
+        key = _tts_key(text, voice, rate)
+        filename = f"{key}.{self.audio_format}"
+        os.makedirs(os.path.join(self.recorder.fixture_dir, "tts"), exist_ok=True)
+        shutil.copyfile(output_path, os.path.join(self.recorder.fixture_dir, "tts", filename))
+        with self.recorder._lock:
+            self.recorder.tts.append({
+                "key": key, "file": filename, "format": self.audio_format, "latency_ms": round(latency_ms, 1),
+            })
+
+
+# ==========================================
+# ▶️ 回放
+# ==========================================
+
+class Replayer:
+    """
+    匹配规则：先按请求指纹 (method + url + body) 精确匹配，同一指纹的多次录制按顺序取用；
+    找不到时退回同一 endpoint 下尚未使用的下一条记录 (应对请求体里的细微差异)。
+    latency: "recorded" 使用录制耗时 (乘以 latency_scale)；数字表示固定毫秒数。
+    """
+
+    def __init__(self, fixture_dir: str, latency="recorded", latency_scale: float = 1.0):
+        self.fixture_dir = fixture_dir
+        self.latency = latency
+        self.latency_scale = latency_scale
+        self.by_key: Dict[str, deque] = defaultdict(deque)
+        self.by_endpoint: Dict[str, deque] = defaultdict(deque)
+        self.tts: Dict[str, deque] = defaultdict(deque)
+        self.used = set()
+        self.stats = {"exact": 0, "fallback": 0, "miss": 0, "tts": 0}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        http_path = os.path.join(self.fixture_dir, "http.jsonl")
+        if not os.path.exists(http_path):
+            raise FileNotFoundError(f"No fixture at {http_path}; record one first.")
+        with open(http_path, encoding="utf-8") as f:
+            for i, line in enumerate(f):
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                entry["_id"] = i
+                self.by_key[entry["key"]].append(entry)
+                self.by_endpoint[entry["endpoint"]].append(entry)
+        tts_path = os.path.join(self.fixture_dir, "tts.jsonl")
+        if os.path.exists(tts_path):
+            with open(tts_path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.tts[entry["key"]].append(entry)
+
+    def _delay_seconds(self, recorded_ms: float) -> float:
+        if self.latency == "recorded":
+            return recorded_ms * self.latency_scale / 1000
+        return float(self.latency) / 1000
+
+    @staticmethod
+    def _take(queue: deque, used: set) -> Optional[Dict]:
+        while queue:
+            entry = queue[0]
+            if entry["_id"] in used:
+                queue.popleft()
+                continue
+            # 同一指纹只剩最后一条时保留它，允许重复请求复用
+            if len(queue) > 1:
+                queue.popleft()
+            return entry
+        return None
+
+    def _match(self, service: str, request: httpx.Request) -> Dict:
+        with self._lock:
+            entry = self._take(self.by_key.get(_request_key(request), deque()), set())
+            kind = "exact"
+            if entry is None:
+                entry = self._take(self.by_endpoint.get(_endpoint(service, request), deque()), self.used)
+                kind = "fallback"
+            if entry is None:
+                self.stats["miss"] += 1
+                raise ReplayMiss(f"No recording for {_endpoint(service, request)}")
+            self.used.add(entry["_id"])
+            self.stats[kind] += 1
+            return entry
+
+    @staticmethod
+    def _response(entry: Dict, request: httpx.Request) -> httpx.Response:
+        return httpx.Response(entry["status"], headers=entry["headers"], content=_decode_body(entry), request=request)
+
+    def handle_request(self, service, request, inner):
+        entry = self._match(service, request)
+        time.sleep(self._delay_seconds(entry["latency_ms"]))
+        return self._response(entry, request)
+
+    async def handle_async_request(self, service, request, inner):
+        entry = self._match(service, request)
+        await asyncio.sleep(self._delay_seconds(entry["latency_ms"]))
+        return self._response(entry, request)
+
+
+class ReplayTTSBackend(TTSBackend):
+    """回放录制的音频文件"""
+    name = "replay"
+
+    def __init__(self, replayer: Replayer, audio_format: str = "mp3"):
+        self.replayer = replayer
+        # 以录制时的格式为准，audio_ops 会按它解码
+        formats = {e["format"] for queue in replayer.tts.values() for e in queue}
+        self.audio_format = formats.pop() if len(formats) == 1 else audio_format
+
+    async def synthesize(self, text, voice, rate, output_path):
+        key = _tts_key(text, voice, rate)
+        with self.replayer._lock:
+            queue = self.replayer.tts.get(key)
+            if not queue:
+                self.replayer.stats["miss"] += 1
+                raise ReplayMiss(f"No TTS recording for: {text[:30]}")
+            entry = queue[0] if len(queue) == 1 else queue.popleft()
+            self.replayer.stats["tts"] += 1
+        await asyncio.sleep(self.replayer._delay_seconds(entry["latency_ms"]))
+        shutil.copyfile(os.path.join(self.replayer.fixture_dir, "tts", entry["file"]), output_path)
+
+
+# ==========================================
+# 🎛️ 入口
+# ==========================================
+
+@contextmanager
+def record(fixture_dir: str):
+    recorder = Recorder(fixture_dir)
+    previous_backend = tts_service.backend
+    http_pool.set_interceptor(recorder)
+    tts_service.backend = RecordingTTSBackend(previous_backend or get_backend(), recorder)
+    try:
+        yield recorder
+    finally:
+        http_pool.set_interceptor(None)
+        tts_service.backend = previous_backend
+        recorder.save()
+
+
+@contextmanager
+def replay(fixture_dir: str, latency="recorded", latency_scale: float = 1.0):
+    replayer = Replayer(fixture_dir, latency=latency, latency_scale=latency_scale)
+    previous_backend = tts_service.backend
+    http_pool.set_interceptor(replayer)
+    tts_service.backend = ReplayTTSBackend(replayer, (previous_backend or get_backend()).audio_format)
+    try:
+        yield replayer
+    finally:
+        http_pool.set_interceptor(None)
+        tts_service.backend = previous_backend
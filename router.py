@@ -0,0 +1,162 @@
+"""
+规则快速路由 (Fast-Path Router)
+
+在进入 LangGraph 之前，用关键词/正则和简单的语种检测识别"明确"的意图：
+- AUDIO : "朗读/read aloud/lee en voz alta: <text>" -> 直接调用 convert_text_to_audio
+- SEARCH: "搜索笔记 X / search my notes for X"     -> 直接调用 search_knowledge_base
+其余情况 (含混合意图、需要读取附件等) 一律交给 Graph。
+每次路由决策都会写入 JSONL 日志，便于离线审计准确率。
+"""
+import os
+import re
+import json
+import time
+from dataclasses import dataclass, asdict
+from typing import Optional
+
+ROUTER_ENABLED = os.environ.get("ROUTER_ENABLED", "1") != "0"
+ROUTER_LOG_PATH = os.environ.get("ROUTER_LOG_PATH", "logs/routing.jsonl")
+
+ROUTE_AUDIO = "audio"
+ROUTE_SEARCH = "search"
+ROUTE_GRAPH = "graph"
+
+# ==========================================
+# 🔤 规则表
+# ==========================================
+
+# 动词与冒号之间只允许出现这些修饰 (语种 / 礼貌用语 / 指代)，其他内容说明指令不止"朗读"
+AUDIO_TAIL = (
+    r"(?:\s*(?:please|for\s+me|to\s+me|(?:of\s+)?(?:this|the\s+following)(?:\s+text)?|text"
+    r"|(?:in\s+)?(?:english|spanish|chinese|mandarin)|(?:en\s+)?(?:español|inglés|chino)"
+    r"|用?(?:英语|英文|西班牙语|西语|中文|普通话)|por\s+favor|[,，(（)）\-]))*\s*"
+)
+
+# 音频意图：动词 + 可选的语言说明，紧跟冒号/换行再接正文
+AUDIO_PATTERN = re.compile(
+    r"^\s*(?:please\s+|请|帮我|por favor,?\s+)?"
+    r"(?:read\s+(?:this\s+|it\s+|the following\s+)?(?:text\s+)?(?:aloud|out loud|for me|to me)"
+    r"|text[\s-]*to[\s-]*speech|tts"
+    r"|(?:convert|turn)\s+(?:this|it|the following)?\s*(?:text\s+)?(?:in)?to\s+(?:audio|speech|voice)"
+    r"|generate\s+(?:an?\s+)?(?:audio|speech)"
+    r"|speak\s+(?:this|it)"
+    r"|朗读|读出来|念出来|转成?语音|转为语音|生成(?:语音|音频)|把(?:下面|以下)?(?:这段)?(?:话|文字|内容)?转成?(?:\S{0,6})?语音"
+    r"|lee(?:lo|r)?\s+(?:esto\s+)?en\s+voz\s+alta|convierte\s+(?:esto\s+)?(?:a|en)\s+(?:audio|voz)|genera\s+(?:un\s+)?audio)"
+    + AUDIO_TAIL +
+    r"[:：\n]\s*(?P<text>.+)$",
+    re.IGNORECASE | re.DOTALL,
+)
+
+# 纯检索意图：只查不写
+SEARCH_PATTERN = re.compile(
+    r"^\s*(?:"
+    r"(?:search|look\s+up|find)\s+(?:in\s+)?(?:my\s+)?(?:notes|knowledge\s*base|notion)\s+(?:for|about|on)\s+(?P<en>.+)"
+    r"|(?:find|search)\s+(?:my\s+)?notes\s+(?:about|on)\s+(?P<en2>.+)"
+    r"|(?:搜索|查找|查一下|搜一下)(?:我的)?(?:笔记|知识库)(?:里|中)?(?:关于|有没有)?(?P<zh>.+)"
+    r"|busca(?:r)?\s+(?:en\s+)?(?:mis\s+)?notas\s+(?:sobre|de)\s+(?P<es>.+)"
+    r")$",
+    re.IGNORECASE | re.DOTALL,
+)
+
+# 出现这些词说明是写入/混合意图，必须交给 LLM 决策
+MIXED_HINTS = re.compile(
+    r"\b(save|create|write|update|merge|overwrite|summari[sz]e|explain|translate|notion page|and then)\b"
+    r"|保存|新建|创建|写入|整理|合并|更新|总结|解释|翻译|然后"
+    r"|\b(guarda|crea|escribe|resume|explica|traduce)\b",
+    re.IGNORECASE,
+)
+
+# 显式的语种说明优先于自动检测
+LANGUAGE_HINTS = [
+    (re.compile(r"\b(in\s+english|english)\b|英语|英文", re.IGNORECASE), "en"),
+    (re.compile(r"\b(in\s+spanish|spanish|en\s+español|español)\b|西班牙语|西语", re.IGNORECASE), "es"),
+    (re.compile(r"\b(in\s+chinese|chinese|mandarin)\b|中文|普通话", re.IGNORECASE), "zh"),
+]
+
+SPANISH_CHARS = re.compile(r"[ñáéíóúü¿¡]", re.IGNORECASE)
+SPANISH_WORDS = re.compile(r"\b(el|la|los|las|de|que|y|en|es|por|para|con|una|un|del|muy)\b", re.IGNORECASE)
+ENGLISH_WORDS = re.compile(r"\b(the|and|is|are|of|to|in|that|it|with|for|this|you)\b", re.IGNORECASE)
+CJK_CHARS = re.compile(r"[一-鿿]")
+
+
+@dataclass
+class RouteDecision:
+    route: str
+    reason: str
+    text: Optional[str] = None
+    query: Optional[str] = None
+    language: Optional[str] = None
+
+
+def detect_language(text: str) -> str:
+    """极简语种检测：中文字符占比 > 西语特征 > 英语常用词，默认 es"""
+    if not text:
+        return "es"
+    sample = text[:2000]
+    if len(CJK_CHARS.findall(sample)) > len(sample) * 0.2:
+        return "zh"
+    es_score = len(SPANISH_WORDS.findall(sample)) + 3 * len(SPANISH_CHARS.findall(sample))
+    en_score = len(ENGLISH_WORDS.findall(sample))
+    if en_score > es_score:
+        return "en"
+    return "es"
+
+
+def _explicit_language(instruction: str) -> Optional[str]:
+    for pattern, code in LANGUAGE_HINTS:
+        if pattern.search(instruction):
+            return code
+    return None
+
+
+def route_request(user_input: str, has_file: bool = False) -> RouteDecision:
+    """根据规则返回路由决策；无法确定时返回 ROUTE_GRAPH"""
+    if not ROUTER_ENABLED:
+        return RouteDecision(ROUTE_GRAPH, "router disabled")
+    if not user_input or not user_input.strip():
+        return RouteDecision(ROUTE_GRAPH, "empty input")
+
+    # 1. 音频：必须带有待朗读的正文
+    audio_match = AUDIO_PATTERN.match(user_input)
+    if audio_match:
+        text = audio_match.group("text").strip()
+        instruction = user_input[: audio_match.start("text")]
+        # 正文里出现写入/解释等意图时无法区分"朗读这段话"和"再做点别的"，交给 Graph
+        if MIXED_HINTS.search(user_input):
+            return RouteDecision(ROUTE_GRAPH, "audio intent mixed with another intent")
+        if len(text) < 2:
+            return RouteDecision(ROUTE_GRAPH, "audio intent without inline text")
+        language = _explicit_language(instruction) or detect_language(text)
+        return RouteDecision(ROUTE_AUDIO, "audio keyword + inline text", text=text, language=language)
+
+    # 2. 纯检索：附件存在时可能是"把附件和笔记对比"，交给 Graph
+    search_match = SEARCH_PATTERN.match(user_input)
+    if search_match and not has_file:
+        query = next(g for g in search_match.groups() if g).strip(" ?？。.")
+        if MIXED_HINTS.search(user_input):
+            return RouteDecision(ROUTE_GRAPH, "search intent mixed with another intent")
+        if len(query) < 2:
+            return RouteDecision(ROUTE_GRAPH, "search intent without query")
+        return RouteDecision(ROUTE_SEARCH, "search keyword", query=query)
+
+    return RouteDecision(ROUTE_GRAPH, "no fast-path rule matched")
+
+
+def log_decision(decision: RouteDecision, user_input: str, thread_id: str = None, elapsed_ms: float = None):
+    """追加写入路由审计日志 (JSONL)"""
+    record = {
+        "ts": time.time(),
+        "thread_id": thread_id,
+        "input": user_input[:200],
+        "elapsed_ms": elapsed_ms,
+        **asdict(decision),
+    }
+    if record.get("text"):
+        record["text"] = record["text"][:200]
+    try:
+        os.makedirs(os.path.dirname(ROUTER_LOG_PATH) or ".", exist_ok=True)
+        with open(ROUTER_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except Exception as e:
+        print(f"⚠️ Router log failed: {e}")
+    print(f"🚦 [Router] {decision.route.upper()} ({decision.reason})")
@@ -0,0 +1,253 @@
+"""
+无界面的 Agent HTTP 服务 (ASGI)
+
+让脚本/自动化/多个用户同时驱动同一个知识库：
+- POST /v1/turns          : 执行一轮对话，返回与 run_agent 相同结构的结果
+- POST /v1/turns/stream   : 同上，以 SSE 推送 arun_agent 的 token / 工具事件
+- GET  /v1/jobs/{job_id}  : 查询 Notion 后写任务状态
+- GET  /v1/metrics        : 排队/执行/拒绝计数、等待与执行耗时 p50/p95
+调度规则：
+- 全局最多 SERVER_WORKERS 轮同时执行 (有界 worker 池)
+- 同一个 thread_id 的请求严格按到达顺序串行执行
+- 已接纳 (排队 + 执行中) 的请求超过 SERVER_MAX_PENDING 时直接返回 429
+
+启动: python server.py  (或 uvicorn server:app)
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, Optional
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+
+from agent_graph import run_agent, arun_agent
+from write_queue import write_queue
+from http_pool import pool_stats
+from llm_cache import cache_stats
+from prefetch import prefetch_stats
+from rate_limit import rate_limit_stats
+
+SERVER_HOST = os.environ.get("SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.environ.get("SERVER_PORT", "8000"))
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", "4"))         # 同时执行的对话轮数
+SERVER_MAX_PENDING = int(os.environ.get("SERVER_MAX_PENDING", "32"))  # 排队 + 执行中的上限
+RETRY_AFTER_SECONDS = 5
+LATENCY_SAMPLES = 1000
+
+
+class TurnRequest(BaseModel):
+    input: str
+    thread_id: Optional[str] = None
+    file_content: Optional[str] = None
+
+
+def _percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))], 1)
+
+
+class TurnScheduler:
+    """
+    有界调度器：
+    1. 准入控制 —— 超过 max_pending 直接拒绝
+    2. 按 thread_id 排队 —— asyncio.Lock 是 FIFO 的，保证同一会话的顺序
+    3. 全局执行槽 —— 先拿到会话锁再占用执行槽，避免空占槽位
+    """
+
+    def __init__(self, workers: int = SERVER_WORKERS, max_pending: int = SERVER_MAX_PENDING):
+        self.workers = max(1, workers)
+        self.max_pending = max(self.workers, max_pending)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="turn")
+        self._slots = asyncio.Semaphore(self.workers)
+        self._thread_locks: Dict[str, asyncio.Lock] = {}
+        self._thread_waiters: Dict[str, int] = {}
+        self.pending = 0
+        self.running = 0
+        self.counters = {"accepted": 0, "rejected": 0, "completed": 0, "failed": 0}
+        self.queue_ms = deque(maxlen=LATENCY_SAMPLES)
+        self.run_ms = deque(maxlen=LATENCY_SAMPLES)
+
+    def admit(self) -> Callable[[], None]:
+        """
+        准入：成功时返回 release()，调用方必须保证最终调用一次 (重复调用无副作用)。
+        名额不跟 slot() 绑定：流式响应可能还没开始执行生成器，客户端就已断开。
+        """
+        if self.pending >= self.max_pending:
+            self.counters["rejected"] += 1
+            raise HTTPException(
+                status_code=429,
+                detail=f"Server busy: {self.pending} turns pending (limit {self.max_pending}).",
+                headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+            )
+        self.pending += 1
+        self.counters["accepted"] += 1
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self.pending -= 1
+
+        return release
+
+    @asynccontextmanager
+    async def slot(self, thread_id: str):
+        """按会话顺序 + 全局并发上限获取执行权；yield 排队耗时 (ms)"""
+        enqueued = time.perf_counter()
+        lock = self._thread_locks.setdefault(thread_id, asyncio.Lock())
+        self._thread_waiters[thread_id] = self._thread_waiters.get(thread_id, 0) + 1
+        try:
+            async with lock:
+                async with self._slots:
+                    started = time.perf_counter()
+                    queued_ms = (started - enqueued) * 1000
+                    self.queue_ms.append(queued_ms)
+                    self.running += 1
+                    try:
+                        yield queued_ms
+                    finally:
+                        self.running -= 1
+                        self.run_ms.append((time.perf_counter() - started) * 1000)
+        finally:
+            self._thread_waiters[thread_id] -= 1
+            if self._thread_waiters[thread_id] == 0:
+                # 没有后续请求的会话锁及时释放，避免字典无限增长
+                self._thread_waiters.pop(thread_id, None)
+                self._thread_locks.pop(thread_id, None)
+
+    def metrics(self) -> Dict:
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "running": self.running,
+            "queued": self.pending - self.running,
+            "active_threads": len(self._thread_locks),
+            **self.counters,
+            "queue_ms": {"p50": _percentile(self.queue_ms, 0.5), "p95": _percentile(self.queue_ms, 0.95)},
+            "run_ms": {"p50": _percentile(self.run_ms, 0.5), "p95": _percentile(self.run_ms, 0.95)},
+        }
+
+
+scheduler: Optional[TurnScheduler] = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global scheduler
+    scheduler = TurnScheduler()
+    print(f"🛰️ Agent service ready: {scheduler.workers} workers, {scheduler.max_pending} max pending")
+    yield
+    scheduler.executor.shutdown(wait=False, cancel_futures=True)
+
+
+app = FastAPI(title="Notion Knowledge Agent", lifespan=lifespan)
+
+
+@app.get("/healthz")
+async def healthz():
+    return {"ok": True}
+
+
+@app.post("/v1/turns")
+async def create_turn(req: TurnRequest):
+    thread_id = req.thread_id or str(uuid.uuid4())
+    release = scheduler.admit()
+    try:
+        async with scheduler.slot(thread_id) as queued_ms:
+            started = time.perf_counter()
+            loop = asyncio.get_running_loop()
+            try:
+                result = await loop.run_in_executor(
+                    scheduler.executor, run_agent, req.input, req.file_content, thread_id
+                )
+            except Exception as e:
+                scheduler.counters["failed"] += 1
+                raise HTTPException(status_code=500, detail=str(e))
+            run_ms = (time.perf_counter() - started) * 1000
+    finally:
+        release()
+
+    scheduler.counters["failed" if result.get("type") == "error" else "completed"] += 1
+    return {
+        "thread_id": thread_id,
+        "result": result,
+        "timings": {"queue_ms": round(queued_ms, 1), "run_ms": round(run_ms, 1)},
+    }
+
+
+def _sse(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+class _AdmittedStreamingResponse(StreamingResponse):
+    """响应结束 (正常完成 / 客户端断开 / 生成器从未开始) 时都归还准入名额"""
+
+    def __init__(self, content, release: Callable[[], None], **kwargs):
+        super().__init__(content, **kwargs)
+        self.release = release
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.release()
+
+
+@app.post("/v1/turns/stream")
+async def stream_turn(req: TurnRequest):
+    thread_id = req.thread_id or str(uuid.uuid4())
+    release = scheduler.admit()
+
+    async def _events():
+        # 客户端中途断开时，会话锁与执行槽由 slot() 的 finally 归还
+        try:
+            async with scheduler.slot(thread_id) as queued_ms:
+                yield _sse("accepted", {"thread_id": thread_id, "queue_ms": round(queued_ms, 1)})
+                async for event in arun_agent(req.input, req.file_content, thread_id):
+                    if event.kind == "done":
+                        scheduler.counters["failed" if event.data.get("type") == "error" else "completed"] += 1
+                    elif event.kind == "error":
+                        scheduler.counters["failed"] += 1
+                    yield _sse(event.kind, event.data)
+        finally:
+            release()
+
+    return _AdmittedStreamingResponse(_events(), release, media_type="text/event-stream")
+
+
+@app.get("/v1/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = write_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    job.pop("payload", None)  # 正文可能很长，只返回状态
+    return job
+
+
+@app.get("/v1/metrics")
+async def metrics():
+    return JSONResponse({
+        "scheduler": scheduler.metrics(),
+        "write_queue": write_queue.stats(),
+        "http_pools": pool_stats(),
+        "llm_cache": cache_stats(),
+        "search_prefetch": prefetch_stats(),
+        "notion_rate_limit": rate_limit_stats(),
+    })
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host=SERVER_HOST, port=SERVER_PORT)
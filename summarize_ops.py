@@ -0,0 +1,191 @@
+"""
+大文件 Map-Reduce 摘要流水线
+
+整本书不再塞进一次对话：
+1. Map    : 按段落切成若干节，有限并发地逐节提炼要点
+2. Reduce : 分组逐层合并，直到得到一篇结构化 Markdown 笔记
+3. Write  : 通过 manage_notion_note 写入 Notion 并同步向量库
+每个阶段都会通过 on_progress 回调汇报进度与耗时，供 UI 展示。
+"""
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional, Union
+
+from langchain_core.messages import SystemMessage, HumanMessage
+
+from llm_core import get_llm
+from doc_index import chunk_text
+from text_store import TextHandle, TextLike, TextSlice
+from tools import manage_notion_note
+
+SECTION_CHARS = 12000                                              # 每节送入 Map 的字符数
+REDUCE_GROUP_CHARS = 16000                                         # Reduce 时每组的字符上限
+SUMMARY_CONCURRENCY = int(os.environ.get("SUMMARY_CONCURRENCY", "4"))  # 同时进行的 LLM 调用数
+
+MAP_PROMPT = """You are summarizing one section of a long document for a personal knowledge base.
+Extract the key ideas, definitions, arguments, examples and any vocabulary worth remembering.
+Write concise Markdown bullet points. Keep the original language of the document. No preamble."""
+
+REDUCE_PROMPT = """You are merging partial notes of the same document into one coherent set of notes.
+Remove duplicates, keep the document's order, group related points under `##` headings.
+Write Markdown only. Keep the original language of the document. No preamble."""
+
+FINAL_PROMPT = """Turn the following merged notes into a polished Notion note.
+Output EXACTLY this format:
+TITLE: <short title>
+SUMMARY: <one or two sentence summary>
+---
+<the full note in Markdown: `##` sections, bullet points, tables where useful, `> 💡` callouts for key insights>"""
+
+ProgressCallback = Callable[[str, int, int, float], None]
+
+
+def split_sections(text: TextLike, section_chars: int = SECTION_CHARS) -> List[Union[str, TextSlice]]:
+    """
+    按段落边界切节 (不重叠)。
+    TextHandle 只记录每节的区间 (TextSlice)，Map 阶段调用 LLM 时才读取该节文本。
+    """
+    if isinstance(text, TextHandle):
+        return [
+            TextSlice(text, start, start + len(window))
+            for start, window in text.iter_windows(section_chars)
+            if window.strip()
+        ]
+    return [c["text"] for c in chunk_text(text, chunk_chars=section_chars, overlap=0)]
+
+
+def _call_llm(llm, system_prompt: str, content: Union[str, TextSlice]) -> str:
+    response = llm.invoke([SystemMessage(content=system_prompt), HumanMessage(content=str(content))])
+    return response.content.strip()
+
+
+def _parallel_map(llm, system_prompt: str, inputs: List[Union[str, TextSlice]], stage: str, on_progress: ProgressCallback) -> List[str]:
+    """有限并发地对 inputs 调用 LLM，结果保持原顺序"""
+    start = time.perf_counter()
+    results: List[Optional[str]] = [None] * len(inputs)
+    done = 0
+
+    with ThreadPoolExecutor(max_workers=SUMMARY_CONCURRENCY) as executor:
+        futures = {executor.submit(_call_llm, llm, system_prompt, text): i for i, text in enumerate(inputs)}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                print(f"   - ❌ {stage} #{i + 1} failed: {e}")
+                results[i] = ""
+            done += 1
+            on_progress(stage, done, len(inputs), time.perf_counter() - start)
+
+    return [r for r in results if r]
+
+
+def _group(texts: List[str], limit: int) -> List[str]:
+    groups, current, size = [], [], 0
+    for t in texts:
+        if current and size + len(t) > limit:
+            groups.append("\n\n---\n\n".join(current))
+            current, size = [], 0
+        current.append(t)
+        size += len(t)
+    if current:
+        groups.append("\n\n---\n\n".join(current))
+    return groups
+
+
+def _parse_final(output: str, fallback_title: str) -> Dict[str, str]:
+    title_match = re.search(r"^TITLE:\s*(.+)$", output, re.MULTILINE)
+    summary_match = re.search(r"^SUMMARY:\s*(.+)$", output, re.MULTILINE)
+    body = output.split("\n---\n", 1)[1] if "\n---\n" in output else output
+    return {
+        "title": title_match.group(1).strip() if title_match else fallback_title,
+        "summary": summary_match.group(1).strip() if summary_match else "",
+        "markdown": body.strip(),
+    }
+
+
+def summarize_document(
+    text: TextLike,
+    title_hint: str = "Document Notes",
+    on_progress: ProgressCallback = None,
+) -> Optional[Dict]:
+    """
+    Map-Reduce 生成结构化笔记
+    返回 {"title", "summary", "markdown", "timings": {stage: seconds}, "sections": n}
+    """
+    on_progress = on_progress or (lambda stage, done, total, elapsed: None)
+    llm = get_llm()
+    timings = {}
+
+    sections = split_sections(text)
+    if not sections:
+        return None
+    print(f"📚 Map-Reduce summarizing {len(text)} chars in {len(sections)} sections...")
+
+    # 1. Map
+    t0 = time.perf_counter()
+    partials = _parallel_map(llm, MAP_PROMPT, sections, "map", on_progress)
+    timings["map"] = time.perf_counter() - t0
+    if not partials:
+        return None
+
+    # 2. Reduce (逐层合并，直到只剩一组)
+    level = 0
+    t0 = time.perf_counter()
+    while len(partials) > 1:
+        level += 1
+        groups = _group(partials, REDUCE_GROUP_CHARS)
+        if len(groups) == len(partials):
+            # 单条就已超过组上限，强制两两合并以保证收敛
+            groups = ["\n\n---\n\n".join(partials[i : i + 2]) for i in range(0, len(partials), 2)]
+        partials = _parallel_map(llm, REDUCE_PROMPT, groups, f"reduce-{level}", on_progress)
+        if not partials:
+            return None
+    timings["reduce"] = time.perf_counter() - t0
+
+    # 3. Final formatting
+    t0 = time.perf_counter()
+    final = _call_llm(llm, FINAL_PROMPT, partials[0])
+    timings["final"] = time.perf_counter() - t0
+    on_progress("final", 1, 1, timings["final"])
+
+    note = _parse_final(final, title_hint)
+    note["timings"] = timings
+    note["sections"] = len(sections)
+    return note
+
+
+def ingest_document(
+    text: TextLike,
+    category: str = "Humanities",
+    title_hint: str = "Document Notes",
+    on_progress: ProgressCallback = None,
+) -> Dict:
+    """
+    完整流水线：摘要 -> 写入 Notion -> 同步向量库
+    返回 {"ok", "message", "note", "timings"}
+    """
+    on_progress = on_progress or (lambda stage, done, total, elapsed: None)
+    note = summarize_document(text, title_hint, on_progress)
+    if not note:
+        return {"ok": False, "message": "❌ Summarization produced no content.", "note": None, "timings": {}}
+
+    t0 = time.perf_counter()
+    message = manage_notion_note.invoke({
+        "action": "create",
+        "title": note["title"],
+        "content_markdown": note["markdown"],
+        "summary": note["summary"] or note["title"],
+        "category": category,
+    })
+    note["timings"]["write"] = time.perf_counter() - t0
+    on_progress("write", 1, 1, note["timings"]["write"])
+
+    return {
+        "ok": message.startswith("✅") or message.startswith("⚠️"),
+        "message": message,
+        "note": note,
+        "timings": note["timings"],
+    }
@@ -0,0 +1,26 @@
+"""
+markdown_to_blocks / parse_rich_text 生成的结构互不共享可变对象。
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from notion_ops import markdown_to_blocks, parse_rich_text  # noqa: E402
+
+
+def test_annotations_are_not_shared_between_spans():
+    spans = parse_rich_text("**a** `b` ==c== **d** `e` ==f==")
+    annotated = [s["annotations"] for s in spans if "annotations" in s]
+    assert len(annotated) == 6
+    assert len({id(a) for a in annotated}) == len(annotated)
+
+
+def test_mutating_one_block_does_not_leak_into_another():
+    blocks = markdown_to_blocks("**first**\n\n**second**")
+    first = blocks[0]["paragraph"]["rich_text"][0]
+    second = blocks[1]["paragraph"]["rich_text"][0]
+
+    first["annotations"]["color"] = "red"
+    assert second["annotations"] == {"bold": True}
+    assert markdown_to_blocks("**third**")[0]["paragraph"]["rich_text"][0]["annotations"] == {"bold": True}
@@ -0,0 +1,150 @@
+"""
+write_queue 的领取顺序、幂等去重、退避重试与死信测试。
+
+测试里不启动 worker 线程，直接调用 _claim / _finish / _fail 单步推进队列。
+"""
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import write_queue as wq  # noqa: E402
+from write_queue import PermanentJobError, WriteQueue  # noqa: E402
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    q = WriteQueue(path=str(tmp_path / "queue.db"), workers=1, max_attempts=3)
+    monkeypatch.setattr(q, "_ensure_started", lambda: None)
+    return q
+
+
+def _make_ready(q, job_id):
+    q._execute("UPDATE jobs SET next_run_at = ? WHERE id = ?", (time.time() - 1, job_id))
+
+
+# ==========================================
+# 📄 同一页面按提交顺序串行
+# ==========================================
+
+def test_same_page_jobs_run_in_submission_order(queue):
+    first = queue.enqueue("note", {"v": 1}, page_id="page-a")
+    second = queue.enqueue("note", {"v": 2}, page_id="page-a")
+    other = queue.enqueue("note", {"v": 3}, page_id="page-b")
+
+    claimed = queue._claim()
+    assert claimed["id"] == first["id"]
+    # page-a 的第一个任务还在执行，第二个不可领取；其他页面不受影响
+    assert queue._claim()["id"] == other["id"]
+    assert queue._claim() is None
+
+    queue._finish(claimed, {})
+    assert queue._claim()["id"] == second["id"]
+
+
+def test_retrying_job_blocks_newer_job_for_same_page(queue):
+    first = queue.enqueue("note", {"v": 1}, page_id="page-a")
+    second = queue.enqueue("note", {"v": 2}, page_id="page-a")
+
+    queue._fail(queue._claim(), RuntimeError("boom"))
+    # 旧任务在退避中：新任务不能抢先写入，否则旧内容重试后会覆盖新内容
+    assert queue._claim() is None
+
+    _make_ready(queue, first["id"])
+    claimed = queue._claim()
+    assert claimed["id"] == first["id"]
+    queue._finish(claimed, {})
+    assert queue._claim()["id"] == second["id"]
+
+
+def test_jobs_without_page_are_not_serialized(queue):
+    a = queue.enqueue("note", {"v": 1})
+    b = queue.enqueue("note", {"v": 2})
+    assert {queue._claim()["id"], queue._claim()["id"]} == {a["id"], b["id"]}
+
+
+def test_expired_lease_is_reclaimed_before_newer_job(queue):
+    first = queue.enqueue("note", {"v": 1}, page_id="page-a")
+    queue.enqueue("note", {"v": 2}, page_id="page-a")
+    queue._claim()
+    queue._execute("UPDATE jobs SET lease_until = ? WHERE id = ?", (time.time() - 1, first["id"]))
+
+    reclaimed = queue._claim()
+    assert reclaimed["id"] == first["id"]
+    assert reclaimed["attempts"] == 2
+
+
+# ==========================================
+# ♻️ 幂等去重
+# ==========================================
+
+def test_duplicate_submission_reuses_job(queue):
+    first = queue.enqueue("note", {"v": 1}, page_id="page-a")
+    assert queue.enqueue("note", {"v": 1}, page_id="page-a")["id"] == first["id"]
+
+    queue._finish(queue._claim(), {})
+    assert queue.enqueue("note", {"v": 1}, page_id="page-a")["id"] == first["id"]
+
+
+def test_dedup_expires_after_window(queue, monkeypatch):
+    first = queue.enqueue("note", {"v": 1})
+    queue._finish(queue._claim(), {})
+
+    monkeypatch.setattr(wq, "DEDUP_SECONDS", 0.0)
+    queue._execute("UPDATE jobs SET updated = ? WHERE id = ?", (time.time() - 1, first["id"]))
+    again = queue.enqueue("note", {"v": 1})
+    assert again["id"] != first["id"]
+    assert again["status"] == wq.STATUS_QUEUED
+    # 旧任务保留记录，只是让出了幂等键
+    assert queue.get(first["id"])["status"] == wq.STATUS_DONE
+
+
+# ==========================================
+# 🔁 退避重试与死信
+# ==========================================
+
+def test_failure_backs_off_exponentially(queue):
+    job = queue.enqueue("note", {"v": 1})
+
+    for attempt in (1, 2):
+        claimed = queue._claim()
+        assert claimed["attempts"] == attempt
+        before = time.time()
+        queue._fail(claimed, RuntimeError("boom"))
+        record = queue.get(job["id"])
+        assert record["status"] == wq.STATUS_QUEUED
+        assert record["last_error"] == "boom"
+        expected = wq.BACKOFF_BASE_SECONDS * 2 ** (attempt - 1)
+        assert record["next_run_at"] == pytest.approx(before + expected, abs=1.0)
+        assert queue._claim() is None
+        _make_ready(queue, job["id"])
+
+
+def test_exhausted_attempts_dead_letter_and_retry(queue):
+    job = queue.enqueue("note", {"v": 1})
+    for _ in range(queue.max_attempts):
+        queue._fail(queue._claim(), RuntimeError("boom"))
+        _make_ready(queue, job["id"])
+
+    assert queue.get(job["id"])["status"] == wq.STATUS_DEAD
+    assert queue._claim() is None
+
+    assert queue.retry(job["id"])
+    record = queue.get(job["id"])
+    assert record["status"] == wq.STATUS_QUEUED
+    assert record["attempts"] == 0
+
+
+def test_permanent_error_dead_letters_immediately(queue):
+    job = queue.enqueue("note", {"v": 1}, page_id="page-a")
+    newer = queue.enqueue("note", {"v": 2}, page_id="page-a")
+    queue._fail(queue._claim(), PermanentJobError("page deleted"))
+
+    assert queue.get(job["id"])["status"] == wq.STATUS_DEAD
+    # 死信任务不再阻塞同一页面的后续任务
+    assert queue._claim()["id"] == newer["id"]
+    # 死信任务不拦截重新提交
+    assert queue.enqueue("note", {"v": 1}, page_id="page-a")["id"] != job["id"]
@@ -0,0 +1,282 @@
+"""
+大文本的磁盘存储 (Disk-Spooled Text)
+
+上传的整本书不再以字符串形式常驻 session_state：
+- 上传文件按块落盘 (边写边算 sha256)，解析器按路径读取
+- 解析出的文本流式写入 UTF-8 文件，session_state 里只放 TextHandle
+- TextHandle 通过 mmap 按需读取切片；每 INDEX_STRIDE 个字符记录一次字节偏移，
+  任意 [start, end) 切片只解码附近的字节
+下游 (附件预览 / 文档索引 / Map-Reduce 摘要) 同时接受 str 与 TextHandle。
+"""
+import os
+import mmap
+import codecs
+import hashlib
+import shutil
+import tempfile
+import threading
+import weakref
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+
+UPLOAD_SPOOL_DIR = os.environ.get("UPLOAD_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "agent_uploads"))
+INDEX_STRIDE = 65536            # 每多少个字符记录一个字节偏移
+READ_BLOCK_BYTES = 1 << 20      # 落盘 / 扫描时每次读写的字节数
+
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class TextHandle:
+    """
+    磁盘上一段 UTF-8 文本的只读句柄。
+    len() 为字符数；owned=True 时句柄被回收后删除文件 (会话结束 / 换了新文件)。
+    """
+
+    def __init__(self, path: str, chars: int, nbytes: int, sha256: str, offsets: List[int], owned: bool = False):
+        self.path = path
+        self.chars = chars
+        self.nbytes = nbytes
+        self.sha256 = sha256
+        self._offsets = offsets     # _offsets[i] = 第 i * INDEX_STRIDE 个字符的字节偏移
+        self._file = None
+        self._mm = None
+        self._lock = threading.Lock()
+        if owned:
+            weakref.finalize(self, _remove_file, path)
+
+    def __len__(self) -> int:
+        return self.chars
+
+    def __repr__(self) -> str:
+        return f"TextHandle({os.path.basename(self.path)}, {self.chars} chars)"
+
+    def _map(self):
+        if self._mm is None:
+            with self._lock:
+                if self._mm is None:
+                    self._file = open(self.path, "rb")
+                    self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mm
+
+    def slice(self, start: int = 0, end: Optional[int] = None) -> str:
+        """读取 [start, end) 字符 (语义同 str 切片，不支持负数步长)"""
+        end = self.chars if end is None else end
+        start = max(0, start if start >= 0 else self.chars + start)
+        end = min(self.chars, end if end >= 0 else self.chars + end)
+        if start >= end:
+            return ""
+        first = start // INDEX_STRIDE
+        last = (end - 1) // INDEX_STRIDE + 1
+        byte_start = self._offsets[first]
+        byte_end = self._offsets[last] if last < len(self._offsets) else self.nbytes
+        text = self._map()[byte_start:byte_end].decode("utf-8")
+        offset = start - first * INDEX_STRIDE
+        return text[offset: offset + (end - start)]
+
+    def __getitem__(self, key) -> str:
+        if isinstance(key, slice) and key.step in (None, 1):
+            return self.slice(key.start or 0, key.stop)
+        raise TypeError("TextHandle only supports contiguous slices")
+
+    def read(self) -> str:
+        """整段读出 (只应用于小文件)"""
+        return self.slice(0, self.chars)
+
+    def iter_windows(self, window_chars: int, boundary: str = "\n\n") -> Iterator[Tuple[int, str]]:
+        """
+        依次产出 (起始字符位置, 文本)，每段约 window_chars 个字符，
+        尽量在后半段的 boundary (段落分隔) 处切开。各段首尾相接、不重叠。
+        """
+        pos = 0
+        while pos < self.chars:
+            window = self.slice(pos, pos + window_chars)
+            if pos + len(window) < self.chars:
+                cut = window.rfind(boundary, window_chars // 2)
+                if cut > 0:
+                    window = window[: cut + len(boundary)]
+            yield pos, window
+            pos += len(window)
+
+    def close(self):
+        with self._lock:
+            if self._mm is not None:
+                self._mm.close()
+                self._mm = None
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class TextSlice:
+    """TextHandle 上的一段区间，str() 时才读取 (Map-Reduce 的节)"""
+
+    __slots__ = ("handle", "start", "end")
+
+    def __init__(self, handle: TextHandle, start: int, end: int):
+        self.handle = handle
+        self.start = start
+        self.end = end
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def __str__(self) -> str:
+        return self.handle.slice(self.start, self.end)
+
+
+TextLike = Union[str, TextHandle]
+
+
+# ==========================================
+# ✍️ 写入
+# ==========================================
+
+class TextWriter:
+    """流式写入文本，同时统计字符数、sha256 与字符 -> 字节偏移索引"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "wb")
+        self._sha = hashlib.sha256()
+        self._offsets = [0]
+        self.chars = 0
+        self.nbytes = 0
+
+    def write(self, text: str):
+        if not text:
+            return
+        # 写到第 k * INDEX_STRIDE 个字符时记录它的字节偏移
+        pos = 0
+        while self.chars + (len(text) - pos) > len(self._offsets) * INDEX_STRIDE:
+            cut = pos + len(self._offsets) * INDEX_STRIDE - self.chars
+            self._emit(text[pos:cut])
+            pos = cut
+            self._offsets.append(self.nbytes)
+        self._emit(text[pos:])
+
+    def _emit(self, text: str):
+        if not text:
+            return
+        data = text.encode("utf-8", "replace")
+        self._file.write(data)
+        self._sha.update(data)
+        self.chars += len(text)
+        self.nbytes += len(data)
+
+    def close(self, owned: bool = False) -> TextHandle:
+        self._file.close()
+        return TextHandle(self.path, self.chars, self.nbytes, self._sha.hexdigest(), self._offsets, owned=owned)
+
+    def abort(self):
+        self._file.close()
+        _remove_file(self.path)
+
+
+def write_text(pieces: Iterable[str], path: str, owned: bool = False) -> TextHandle:
+    """把文本片段依次写入 path 并返回句柄；出错时删除半成品文件"""
+    writer = TextWriter(path)
+    try:
+        for piece in pieces:
+            writer.write(piece)
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.close(owned=owned)
+
+
+def open_text(path: str, owned: bool = False) -> TextHandle:
+    """为已有的 UTF-8 文件建立偏移索引 (分块扫描，不整体读入内存)"""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    sha = hashlib.sha256()
+    offsets = [0]
+    chars = nbytes = consumed = 0   # consumed: 已解码字符对应的字节数
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(READ_BLOCK_BYTES)
+            text = decoder.decode(block, final=not block)
+            sha.update(block)
+            nbytes += len(block)
+            pos = 0
+            while chars + (len(text) - pos) > len(offsets) * INDEX_STRIDE:
+                cut = pos + len(offsets) * INDEX_STRIDE - chars
+                consumed += len(text[pos:cut].encode("utf-8", "replace"))
+                chars += cut - pos
+                pos = cut
+                offsets.append(consumed)
+            consumed += len(text[pos:].encode("utf-8", "replace"))
+            chars += len(text) - pos
+            if not block:
+                break
+    return TextHandle(path, chars, nbytes, sha.hexdigest(), offsets, owned=owned)
+
+
+# ==========================================
+# 📥 上传落盘
+# ==========================================
+
+def session_dir(session_id: str) -> str:
+    path = os.path.join(UPLOAD_SPOOL_DIR, session_id)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def spool_upload(stream, directory: str, suffix: str = "") -> Tuple[str, str]:
+    """把上传流按块写入 directory 下的临时文件，返回 (路径, 内容 sha256)"""
+    os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix=suffix, prefix="upload_", dir=directory)
+    sha = hashlib.sha256()
+    if hasattr(stream, "seek"):
+        stream.seek(0)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                block = stream.read(READ_BLOCK_BYTES)
+                if not block:
+                    break
+                sha.update(block)
+                f.write(block)
+    except BaseException:
+        _remove_file(path)
+        raise
+    return path, sha.hexdigest()
+
+
+def link_or_copy(src: str, dst: str):
+    """优先硬链接 (不占额外空间，源文件被淘汰后仍可读)，跨设备时复制"""
+    tmp = f"{dst}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+# ==========================================
+# 🔀 str / TextHandle 通用访问
+# ==========================================
+
+def text_sha256(text: TextLike) -> str:
+    if isinstance(text, TextHandle):
+        return text.sha256
+    return hashlib.sha256(text.encode("utf-8", "ignore")).hexdigest()
+
+
+def text_preview(text: TextLike, chars: int) -> str:
+    return text.slice(0, chars) if isinstance(text, TextHandle) else text[:chars]
+
+
+def read_text(text: TextLike) -> str:
+    return text.read() if isinstance(text, TextHandle) else text
+
+
+def has_text(text: Optional[TextLike]) -> bool:
+    """非空且不全是空白"""
+    if not text:
+        return False
+    if isinstance(text, TextHandle):
+        return len(text) > READ_BLOCK_BYTES or bool(text.slice(0, READ_BLOCK_BYTES).strip())
+    return bool(text.strip())
@@ -1,32 +1,167 @@
+import os
+import re
 import json
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from langchain_core.tools import tool
+from langchain_core.messages import ToolMessage
+from langchain_core.runnables import RunnableConfig
 from typing import Optional, List
-from audio_ops import generate_audio_file
+from audio_ops import submit_audio_job
+from tracing import span
 import vector_ops
 import notion_ops
+import audiobook_ops
+import doc_index
+from prefetch import prefetcher, PREFETCH_RESULTS
+from write_queue import write_queue, WRITE_QUEUE_ENABLED, PermanentJobError
+from rate_limit import notion_priority, PRIORITY_QUEUED
+
+AUDIO_TIMEOUT_SECONDS = 300
+
+# --- 工具执行策略 ---
+# 同一步中的多个 tool call 并发执行 (每个 graph step 最多 TOOL_MAX_CONCURRENCY 个)，
+# 每个工具有独立的超时时间，超时后向 Agent 返回错误消息而不是卡住整轮对话。
+TOOL_MAX_CONCURRENCY = int(os.environ.get("TOOL_MAX_CONCURRENCY", "4"))
+DEFAULT_TOOL_TIMEOUT = 120
+TOOL_TIMEOUTS = {
+    "search_knowledge_base": 30,
+    "search_uploaded_document": 30,
+    "manage_notion_note": 180,
+    "convert_text_to_audio": AUDIO_TIMEOUT_SECONDS + 10,
+    "generate_audiobook": 900,
+}
+# 仅用于实现超时的执行线程池；真正的并发上限由 TOOL_MAX_CONCURRENCY 控制
+_timeout_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="tool")
+
+# --- 知识库检索 ---
+SEARCH_TOP_K = int(os.environ.get("SEARCH_TOP_K", "4"))
+SEARCH_MATCH_DISTANCE = float(os.environ.get("SEARCH_MATCH_DISTANCE", "0.7"))   # 低于该距离视为同一主题
+SEARCH_MAX_DISTANCE = float(os.environ.get("SEARCH_MAX_DISTANCE", "1.2"))      # 超过该距离的候选直接丢弃
+SEARCH_CHAR_BUDGET = int(os.environ.get("SEARCH_CHAR_BUDGET", "3000"))
+
+# --- 检索结果压缩 ---
+# 候选按距离排序，每个只保留标题 / page_id / 距离 / 摘要 / 短片段；
+# 最佳匹配若低于 SEARCH_MATCH_DISTANCE 则附带较长正文，供 overwrite 合并使用。
+# 整个 JSON 不超过 SEARCH_CHAR_BUDGET 个字符 (约 SEARCH_CHAR_BUDGET / 4 tokens)。
+SUMMARY_CHARS = 160
+SNIPPET_CHARS = 200
+MERGE_CONTENT_CHARS = 1500
+
+DOMAIN_HINTS = [
+    ("Spanish", re.compile(
+        r"\b(spanish|español|espanol|castellano|subjunctive|subjuntivo|conjugat\w*|verbos?|preterite|pretérito)\b"
+        r"|西班牙语|西语|[ñ¿¡]", re.IGNORECASE)),
+    ("Tech", re.compile(
+        r"\b(python|javascript|typescript|java|rust|golang|sql|api|docker|kubernetes|linux|git|code|coding|"
+        r"programming|algorithm|database|llm|langchain|react|css|html|http|server|bug)\b"
+        r"|编程|代码|算法|数据库|程序", re.IGNORECASE)),
+    ("Humanities", re.compile(
+        r"\b(history|philosophy|literature|novel|poem|poetry|art|religion|culture|sociology|psychology)\b"
+        r"|历史|哲学|文学|小说|诗|艺术|宗教|文化", re.IGNORECASE)),
+]
+
+
+def _infer_domain(query: str) -> str:
+    """只有恰好一个领域的关键词命中时才缩小范围，否则全库搜索"""
+    hits = [name for name, pattern in DOMAIN_HINTS if pattern.search(query or "")]
+    return hits[0] if len(hits) == 1 else "All"
+
+
+def _clip(text: str, limit: int) -> str:
+    text = " ".join((text or "").split())
+    return text if len(text) <= limit else text[:limit].rstrip() + "…"
+
+
+def _compact_search_result(domain: str, candidates: List[dict]) -> str:
+    best = candidates[0]
+    is_match = best["distance"] < SEARCH_MATCH_DISTANCE
+    result = {
+        "found": is_match,
+        "domain": domain,
+        "suggestion": "overwrite" if is_match else "create",
+        "target_page_id": best["page_id"] if is_match else None,
+        "candidates": [],
+    }
+    for rank, c in enumerate(candidates, 1):
+        meta = c.get("metadata") or {}
+        item = {
+            "rank": rank,
+            "title": c.get("title"),
+            "page_id": c["page_id"],
+            "distance": round(c["distance"], 3),
+            "summary": _clip(meta.get("summary", ""), SUMMARY_CHARS),
+            "snippet": _clip(meta.get("content", ""), SNIPPET_CHARS),
+        }
+        if rank == 1 and is_match:
+            item["existing_content"] = (meta.get("content") or "")[:MERGE_CONTENT_CHARS]
+            item.pop("snippet")
+        result["candidates"].append(item)
+        if rank > 1 and len(json.dumps(result, ensure_ascii=False)) > SEARCH_CHAR_BUDGET:
+            # 超出预算：丢掉这个候选，后面的距离更远，也不再加入
+            result["candidates"].pop()
+            break
+    return json.dumps(result, ensure_ascii=False, separators=(",", ":"))
+
+
+def _filter_candidates(candidates: List[dict], domain: str, k: int) -> Optional[List[dict]]:
+    """
+    在全库预取结果上按 domain / 距离 / k 过滤。
+    预取只有全库最近的 PREFETCH_RESULTS 条：领域内不足 k 条、且全库还有更多阈值内的笔记时，
+    领域内真正的 top-k 可能不在其中，返回 None 让调用方走按领域检索。
+    """
+    if domain and domain != "All":
+        in_domain = [c for c in candidates if (c.get("metadata") or {}).get("domain") == domain]
+        exhausted = len(candidates) < PREFETCH_RESULTS or candidates[-1]["distance"] >= SEARCH_MAX_DISTANCE
+        if len(in_domain) < k and not exhausted:
+            return None
+        candidates = in_domain
+    return [c for c in candidates if c["distance"] < SEARCH_MAX_DISTANCE][:k]
+
 
 @tool
-def search_knowledge_base(query: str) -> str:
+def search_knowledge_base(query: str, config: RunnableConfig, domain: Optional[str] = None, k: int = SEARCH_TOP_K) -> str:
     """
     REQUIRED step before writing.
-    Search the database to check if a topic already exists.
+    Returns the top-k existing notes ranked by distance (lower = closer), so you can decide
+    create vs. overwrite in ONE call: follow "suggestion" unless the user says otherwise.
+    The best match (if close enough) includes "existing_content" for merging.
     Useful for finding duplicate notes or answering questions.
+
+    Args:
+        query: Topic or question to look up.
+        domain: "Spanish", "Tech", "Humanities" or "All". Omit to infer it from the query.
+        k: Number of candidates to return (1-8).
     """
-    print(f"🕵️ [Tool] Searching: {query}...")
-    # 强制全库搜索
-    result = vector_ops.search_memory(query, domain="All")
-    
-    if result.get("match"):
-        return json.dumps({
-            "found": True,
-            "title": result.get("title"),
-            "page_id": result.get("page_id"),
-            "summary": result.get("metadata", {}).get("summary", ""),
-            # 截取一部分内容给 LLM 参考，避免 Token 爆炸
-            "existing_content": result.get("metadata", {}).get("content", "")[:1500] 
-        }, ensure_ascii=False)
-    else:
-        return json.dumps({"found": False, "message": "No relevant notes found."})
+    k = max(1, min(int(k or SEARCH_TOP_K), 8))
+    target_domain = domain or _infer_domain(query)
+    print(f"🕵️ [Tool] Searching: {query}... (domain={target_domain}, k={k})")
+
+    # 本轮开始时已在后台用用户输入检索过，query 足够接近时直接复用
+    prefetched = prefetcher.take((config or {}).get("configurable", {}).get("thread_id"), query)
+
+    def _search(search_domain: str) -> List[dict]:
+        if prefetched is not None:
+            filtered = _filter_candidates(prefetched, search_domain, k)
+            if filtered is not None:
+                return filtered
+        return vector_ops.search_memories(query, n_results=k, domain=search_domain, threshold=SEARCH_MAX_DISTANCE)
+
+    candidates = _search(target_domain)
+    has_match = candidates and candidates[0]["distance"] < SEARCH_MATCH_DISTANCE
+    if not has_match and domain is None and target_domain != "All":
+        # 推断的领域可能不准，没有命中时退回全库
+        target_domain = "All"
+        candidates = _search("All")
+
+    if not candidates:
+        return json.dumps(
+            {"found": False, "suggestion": "create", "message": "No relevant notes found."},
+            ensure_ascii=False,
+        )
+    return _compact_search_result(target_domain, candidates)
+
 
 @tool
 def manage_notion_note(
@@ -40,6 +175,8 @@ def manage_notion_note(
     """
     The ONLY tool to write/save content to Notion.
     It automatically syncs the new content to the Vector Database for future retrieval.
+    The write runs in the background: a "queued" reply means the note WILL be saved,
+    so do not call this tool again for the same note.
     
     Args:
         action: "create" (for new notes) OR "overwrite" (for merging/updating).
@@ -50,7 +187,93 @@ def manage_notion_note(
         target_page_id: REQUIRED if action is "overwrite". The ID of the page to update.
     """
     print(f"✍️ [Tool] Action: {action.upper()} | Title: {title}")
-    
+
+    if action == "overwrite" and not target_page_id:
+        return "Error: target_page_id is required for overwrite action."
+
+    deleted_page_reply = (
+        f"❌ Critical Error: Failed to overwrite page {target_page_id}. "
+        "The page might have been deleted in Notion manually. "
+        "STOP retrying with this ID. "
+        "Please execute `manage_notion_note` again with action='create' to generate a NEW page."
+    )
+
+    payload = {
+        "action": action,
+        "title": title,
+        "content_markdown": content_markdown,
+        "summary": summary,
+        "category": category,
+        "target_page_id": target_page_id,
+    }
+
+    # 后写模式：入队后立即返回，Notion 写入与向量同步由后台 worker 完成
+    if WRITE_QUEUE_ENABLED:
+        # 覆盖写入前先确认页面还在：后台失败时 Agent 已经拿到回执，无法再让它改用 create
+        if action == "overwrite" and _page_missing(target_page_id):
+            return deleted_page_reply
+        job = write_queue.enqueue(NOTE_JOB_KIND, payload, page_id=target_page_id)
+        if job["status"] == "done" and job["page_id"]:
+            return f"✅ Success! Note already saved (job {job['id']}).\n🔗 URL: {_notion_url(job['page_id'])}"
+        if action == "overwrite":
+            return (
+                f"✅ Note queued for saving (job {job['id']}). The page will be overwritten "
+                f"and re-indexed in the background.\n🔗 URL: {_notion_url(target_page_id)}"
+            )
+        return (
+            f"✅ Note queued for saving (job {job['id']}). It is being created in Notion and "
+            "indexed in the background; the link will show up in the write queue panel."
+        )
+
+    # 同步模式 (WRITE_QUEUE=0)：保持原有的阻塞行为与错误提示
+    state = {}
+    try:
+        result = write_note_job(payload, state, lambda **kw: state.update(kw))
+        return f"✅ Success! Note saved to Notion and indexed in Vector DB.\n🔗 URL: {result['url']}"
+    except VectorSyncError as e:
+        return f"⚠️ Note saved to Notion, but Vector Sync failed: {e}"
+    except Exception:
+        if action == "overwrite":
+            # 🔥 关键修复：告诉 Agent 这个 ID 坏了，别再试了！
+            return deleted_page_reply
+        return "❌ Failed to save note to Notion."
+
+
+# ==========================================
+# 📝 笔记写入任务 (同步模式与后写队列共用)
+# ==========================================
+
+NOTE_JOB_KIND = "notion_note"
+
+
+class VectorSyncError(Exception):
+    """Notion 已写入，但向量库同步失败"""
+
+
+def _notion_url(page_id: str) -> str:
+    return f"https://www.notion.so/{page_id.replace('-', '')}"
+
+
+def _page_missing(page_id: str) -> bool:
+    """页面不存在 / 已删除 (进回收站) 时为 True；读取失败时不下结论，返回 False"""
+    try:
+        page = notion_ops.retrieve_page(page_id)
+    except Exception as e:
+        print(f"⚠️ [Tool] Could not check page {page_id}: {e}")
+        return False
+    return page is None or notion_ops.is_page_deleted(page)
+
+
+def write_note_job(payload: dict, state: dict, checkpoint) -> dict:
+    """
+    两步写入：Notion 页面 -> 向量库。
+    每步完成后 checkpoint 记录进度，重试时跳过已完成的 Notion 步骤，避免重复建页。
+    """
+    title = payload["title"]
+    summary = payload["summary"]
+    content_markdown = payload["content_markdown"]
+    category = payload.get("category") or "General"
+
     # 1. 构造数据包
     draft_data = {
         "title": title,
@@ -58,7 +281,7 @@ def manage_notion_note(
         "markdown_body": content_markdown, # 新版 ops 核心依赖这个字段
         "tags": [category, "AI-Auto"]
     }
-    
+
     # 2. 映射数据库 ID
     # (确保 .env 里配了这些 ID，或者 notion_ops 里有默认回退)
     db_map = {
@@ -68,54 +291,56 @@ def manage_notion_note(
     }
     target_db_id = db_map.get(category, notion_ops.DB_HUMANITIES_ID)
 
-    # 3. 执行 Notion 操作
-    current_page_id = None
-    success = False
-
-    if action == "overwrite":
-        if not target_page_id:
-            return "Error: target_page_id is required for overwrite action."
-        success = notion_ops.overwrite_page_content(target_page_id, draft_data)
-        if success:
-            current_page_id = target_page_id
+    # 3. 执行 Notion 操作 (已完成则跳过)
+    current_page_id = state.get("page_id")
+    if not state.get("notion_done"):
+        if payload["action"] == "overwrite":
+            if not notion_ops.overwrite_page_content(payload["target_page_id"], draft_data):
+                if _page_missing(payload["target_page_id"]):
+                    # 页面已被删除：重试没有意义，直接进入死信
+                    raise PermanentJobError(
+                        f"Page {payload['target_page_id']} no longer exists; create a new note instead"
+                    )
+                raise RuntimeError(f"Failed to overwrite page {payload['target_page_id']}")
+            current_page_id = payload["target_page_id"]
         else:
-            # 🔥 关键修复：告诉 Agent 这个 ID 坏了，别再试了！
-            return (
-                f"❌ Critical Error: Failed to overwrite page {target_page_id}. "
-                "The page might have been deleted in Notion manually. "
-                "STOP retrying with this ID. "
-                "Please execute `manage_notion_note` again with action='create' to generate a NEW page."
-            )
-            
-    else:
-        # Action = create
-        current_page_id = notion_ops.create_general_note(draft_data, target_db_id)
-        if current_page_id:
-            success = True
+            current_page_id = notion_ops.create_general_note(draft_data, target_db_id)
+            if not current_page_id:
+                raise RuntimeError("Failed to create Notion page")
+        checkpoint(page_id=current_page_id, notion_done=True)
 
     # 4. 🔥 关键同步：写入向量库 (Vector Sync)
-    if success and current_page_id:
-        print(f"💾 [Tool] Syncing to Vector DB: {current_page_id}...")
-        try:
-            # 构造完整的语义文本用于索引：标题 + 摘要 + 正文
-            full_semantic_text = f"Title: {title}\nSummary: {summary}\n\n{content_markdown}"
-            
-            vector_ops.add_memory(
-                page_id=current_page_id,
-                text=full_semantic_text, # 使用完整 Markdown 进行索引
-                title=title,
-                domain=category,
-                metadata={
-                    "summary": summary,
-                    "type": "note",
-                    "content": content_markdown[:2000] # 存入 metadata 供检索时预览
-                }
-            )
-            return f"✅ Success! Note saved to Notion and indexed in Vector DB.\n🔗 URL: https://www.notion.so/{current_page_id.replace('-', '')}"
-        except Exception as e:
-            return f"⚠️ Note saved to Notion, but Vector Sync failed: {e}"
-            
-    return "❌ Failed to save note to Notion."
+    print(f"💾 [Tool] Syncing to Vector DB: {current_page_id}...")
+    # 构造完整的语义文本用于索引：标题 + 摘要 + 正文
+    full_semantic_text = f"Title: {title}\nSummary: {summary}\n\n{content_markdown}"
+    try:
+        stored = vector_ops.add_memory(
+            page_id=current_page_id,
+            text=full_semantic_text, # 使用完整 Markdown 进行索引
+            title=title,
+            domain=category,
+            metadata={
+                "summary": summary,
+                "type": "note",
+                "content": content_markdown[:2000] # 存入 metadata 供检索时预览
+            }
+        )
+    except Exception as e:
+        raise VectorSyncError(str(e)) from e
+    if not stored:
+        raise VectorSyncError("vector store rejected the note")
+
+    return {"page_id": current_page_id, "url": _notion_url(current_page_id)}
+
+
+def _queued_note_job(payload: dict, state: dict, checkpoint) -> dict:
+    """写队列 worker 中执行：用户已拿到回执，Notion 调用让位于交互请求"""
+    with notion_priority(PRIORITY_QUEUED):
+        return write_note_job(payload, state, checkpoint)
+
+
+if WRITE_QUEUE_ENABLED:
+    write_queue.register_handler(NOTE_JOB_KIND, _queued_note_job)
 
 # [新增] 定义转语音工具
 @tool
@@ -128,13 +353,127 @@ def convert_text_to_audio(text: str, language: str = "es"):
         text: The text content to be converted to audio.
         language: The target language code. Use "es" for Spanish, "en" for English. Default is "es".
     """
-    # 调用后端生成函数
-    file_path = generate_audio_file(text, language)
+    # 提交到后台 TTS 服务，拿到句柄后等待 (其他会话的任务可同时进行)
+    job = submit_audio_job(text, language)
+    try:
+        file_path = job.result(timeout=AUDIO_TIMEOUT_SECONDS)
+    except TimeoutError:
+        # 不能带 "File path:"：前端会把它当成已完成的文件去播放
+        return (f"⏳ Audio is still being generated in the background (job {job.job_id}) and is not ready yet. "
+                f"Ask again with the same text later to get the file.")
     
     if file_path:
         return f"✅ Audio generated successfully! File path: {file_path}"
     else:
         return "❌ Failed to generate audio file."
 
+@tool
+def generate_audiobook(
+    page_ids: Optional[List[str]] = None,
+    query: Optional[str] = None,
+    domain: Optional[str] = None,
+    title: Optional[str] = None,
+    language: str = "es",
+    limit: int = 10
+) -> str:
+    """
+    Builds ONE chapterized audio file from existing Notion notes (bulk audio / lesson playlist).
+    The note content is loaded directly from Notion, so DO NOT pass note text yourself.
+    Use this when the user wants to listen to saved notes, e.g. "read my Spanish notes about verbs".
+    
+    Args:
+        page_ids: Explicit Notion page IDs, one chapter per page (highest priority).
+        query: Semantic search query; the top matching notes become the chapters.
+        domain: "Spanish", "Tech" or "Humanities"; used alone it takes the most recently saved/updated notes of that domain.
+        title: Optional title of the audiobook.
+        language: "es" for Spanish, "en" for English. Default is "es".
+        limit: Maximum number of chapters when using query/domain.
+    """
+    print(f"📚 [Tool] Audiobook | ids={page_ids} query={query} domain={domain}")
+    book = audiobook_ops.generate_audiobook(
+        page_ids=page_ids, query=query, domain=domain,
+        title=title, language=language, limit=limit
+    )
+    if not book:
+        return "❌ Failed to build audiobook: no matching notes or audio generation failed."
+
+    chapter_lines = "\n".join(
+        f"{i + 1}. {c['title']} ({c['start_ms'] // 1000}s)" for i, c in enumerate(book["chapters"])
+    )
+    failed = f"\n⚠️ Skipped: {', '.join(c['title'] for c in book['failed'])}" if book["failed"] else ""
+    return f"✅ Audiobook generated with {len(book['chapters'])} chapters:\n{chapter_lines}{failed}\nFile path: {book['path']}"
+
+@tool
+def search_uploaded_document(query: str, config: RunnableConfig, k: int = 4) -> str:
+    """
+    Retrieve the most relevant passages from the file the user uploaded in this conversation.
+    Use this whenever you need the content of an attached document (questions, summaries, quotes).
+    Call it several times with different queries to cover different parts of a long document.
+    
+    Args:
+        query: What to look for in the uploaded document.
+        k: Number of passages to return (1-8).
+    """
+    thread_id = config.get("configurable", {}).get("thread_id")
+    index = doc_index.get_thread_index(thread_id)
+    if index is None:
+        return json.dumps({"found": False, "message": "No uploaded document in this conversation."})
+
+    print(f"📑 [Tool] Searching upload: {query}...")
+    passages = index.search(query, k=max(1, min(k, 8)))
+    return json.dumps({
+        "found": bool(passages),
+        "document": index.name,
+        "total_chunks": len(index.chunks),
+        "passages": [
+            {"chunk": p["chunk"], "offset": p["start"], "score": p["score"], "text": p["text"]}
+            for p in passages
+        ]
+    }, ensure_ascii=False)
+
+# ==========================================
+# ⏱️ 工具超时包装 (供 ToolNode 使用)
+# ==========================================
+
+def _timeout_message(request, timeout: float) -> ToolMessage:
+    name = request.tool_call["name"]
+    print(f"⏰ [Tool] {name} timed out after {timeout}s")
+    return ToolMessage(
+        content=f"❌ Tool '{name}' timed out after {timeout}s. Do not retry with the same input.",
+        tool_call_id=request.tool_call["id"],
+        name=name,
+        status="error",
+    )
+
+
+def _traced_execute(request, execute):
+    with span(f"tool.{request.tool_call['name']}"):
+        return execute(request)
+
+
+async def _atraced_execute(request, execute):
+    with span(f"tool.{request.tool_call['name']}"):
+        return await execute(request)
+
+
+def run_tool_with_timeout(request, execute):
+    """同步执行路径：在独立线程中运行工具并限时等待 (超时的线程会在后台自然结束)"""
+    timeout = TOOL_TIMEOUTS.get(request.tool_call["name"], DEFAULT_TOOL_TIMEOUT)
+    ctx = contextvars.copy_context()
+    future = _timeout_executor.submit(ctx.run, _traced_execute, request, execute)
+    try:
+        return future.result(timeout=timeout)
+    except TimeoutError:
+        return _timeout_message(request, timeout)
+
+
+async def arun_tool_with_timeout(request, execute):
+    """异步执行路径"""
+    timeout = TOOL_TIMEOUTS.get(request.tool_call["name"], DEFAULT_TOOL_TIMEOUT)
+    try:
+        return await asyncio.wait_for(_atraced_execute(request, execute), timeout=timeout)
+    except asyncio.TimeoutError:
+        return _timeout_message(request, timeout)
+
 # 导出工具列表
-tools_list = [search_knowledge_base, manage_notion_note, convert_text_to_audio]
\ No newline at end of file
+tools_list = [search_knowledge_base, manage_notion_note, convert_text_to_audio, generate_audiobook, search_uploaded_document]
\ No newline at end of file
@@ -0,0 +1,305 @@
+"""
+轻量级链路追踪 (Tracing)
+
+一轮对话 = 一个 trace，run_agent 为根 span，其下挂：
+LLM 调用、工具执行、向量库读写、Notion API 调用、TTS 分段合成。
+- span 通过 contextvars 自动找到父节点；跨线程/跨 event loop 时显式传 parent
+- 每个 span 结束即追加写入 JSONL (字段沿用 OpenTelemetry 的 span 命名，便于导入)
+- 进程内保留最近的 span，供 Streamlit 调试面板画瀑布图、统计 p50/p95
+"""
+import os
+import json
+import time
+import uuid
+import inspect
+import threading
+import functools
+import contextvars
+from collections import deque, defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+TRACING_ENABLED = os.environ.get("TRACING_ENABLED", "1") != "0"
+TRACE_LOG_PATH = os.environ.get("TRACE_LOG_PATH", "logs/traces.jsonl")
+SERVICE_NAME = "notion-agent"
+MAX_BUFFERED_SPANS = 5000
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """一次计时操作；end() 之后写入导出器"""
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start_ns", "end_ns", "attributes", "status", "error")
+
+    def __init__(self, name: str, parent: "Span" = None, attributes: Dict[str, Any] = None):
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes or {})
+        self.status = "OK"
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error: BaseException = None):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.status = "ERROR"
+            self.error = f"{type(error).__name__}: {error}"
+        _exporter.export(self)
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns or time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+    def to_otel(self) -> Dict[str, Any]:
+        """OTLP/JSON 风格的 span 记录"""
+        record = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "attributes": {k: _attr_value(v) for k, v in self.attributes.items()},
+            "status": {"code": self.status},
+            "resource": {"service.name": SERVICE_NAME},
+        }
+        if self.error:
+            record["status"]["message"] = self.error
+        return record
+
+
+def _attr_value(value: Any):
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    text = str(value)
+    return text if len(text) <= 200 else text[:200] + "…"
+
+
+class _Exporter:
+    """JSONL 导出 + 内存环形缓冲"""
+
+    def __init__(self, path: str, max_spans: int):
+        self.path = path
+        self.spans: deque = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+        self._file = None
+
+    def export(self, span: Span):
+        record = span.to_otel()
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self.spans.append(record)
+            try:
+                if self._file is None:
+                    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                    self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+                self._file.write(line + "\n")
+            except Exception as e:
+                print(f"⚠️ Trace export failed: {e}")
+
+    def snapshot(self) -> List[Dict]:
+        with self._lock:
+            return list(self.spans)
+
+
+_exporter = _Exporter(TRACE_LOG_PATH, MAX_BUFFERED_SPANS)
+
+
+# ==========================================
+# 🧭 Span API
+# ==========================================
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def start_span(name: str, parent: Span = None, **attributes) -> Optional[Span]:
+    """手动开始一个 span (不设为当前 span)，调用方负责 end()"""
+    if not TRACING_ENABLED:
+        return None
+    return Span(name, parent or _current_span.get(), attributes)
+
+
+@contextmanager
+def span(name: str, parent: Span = None, **attributes):
+    """
+    with span("notion.pages.create", blocks=100) as s: ...
+    块内创建的 span 自动成为它的子节点；TRACING_ENABLED=0 时 s 为 None
+    """
+    if not TRACING_ENABLED:
+        yield None
+        return
+    s = Span(name, parent or _current_span.get(), attributes)
+    token = _current_span.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.end(error=e)
+        raise
+    finally:
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # 异步生成器被其他上下文关闭时 token 无法复位，忽略即可
+            pass
+        s.end()
+
+
+def traced(name: str = None):
+    """装饰器：把整个函数调用包成一个 span (支持 async 函数)"""
+
+    def decorator(fn):
+        span_name = name or fn.__qualname__
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+class LLMTracingHandler(BaseCallbackHandler):
+    """LangChain 回调：为每次 chat model 调用记录 llm.<model> span"""
+
+    run_inline = True  # 在调用方线程/上下文中执行，才能拿到正确的父 span
+
+    def __init__(self):
+        self._spans: Dict[Any, Span] = {}
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        params = kwargs.get("invocation_params") or {}
+        model = params.get("model_name") or params.get("model") or "chat"
+        s = start_span(f"llm.{model}", messages=sum(len(m) for m in messages))
+        if s is not None:
+            with self._lock:
+                self._spans[run_id] = s
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self._lock:
+            s = self._spans.pop(run_id, None)
+        if s is None:
+            return
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if not usage:
+            for gens in response.generations:
+                for gen in gens:
+                    meta = getattr(getattr(gen, "message", None), "usage_metadata", None)
+                    if meta:
+                        usage = {"prompt_tokens": meta.get("input_tokens"), "completion_tokens": meta.get("output_tokens")}
+        s.set(**{k: v for k, v in usage.items() if k in ("prompt_tokens", "completion_tokens")})
+        s.end()
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            s = self._spans.pop(run_id, None)
+        if s is not None:
+            s.end(error=error)
+
+
+llm_tracer = LLMTracingHandler()
+
+
+# ==========================================
+# 📊 查询 & 聚合 (供调试面板使用)
+# ==========================================
+
+def recent_traces(limit: int = 10) -> List[Dict]:
+    """最近结束的根 span 列表 (新的在前)"""
+    roots = [s for s in _exporter.snapshot() if not s["parentSpanId"]]
+    return list(reversed(roots))[:limit]
+
+
+def get_trace(trace_id: str) -> List[Dict]:
+    """某个 trace 的全部 span，按开始时间排序，附带相对毫秒偏移与层级"""
+    spans = [s for s in _exporter.snapshot() if s["traceId"] == trace_id]
+    if not spans:
+        return []
+    t0 = min(s["startTimeUnixNano"] for s in spans)
+    by_id = {s["spanId"]: s for s in spans}
+
+    def depth(s):
+        d = 0
+        while s["parentSpanId"] in by_id and d < 20:
+            s = by_id[s["parentSpanId"]]
+            d += 1
+        return d
+
+    rows = []
+    for s in sorted(spans, key=lambda s: s["startTimeUnixNano"]):
+        rows.append({
+            "name": s["name"],
+            "span_id": s["spanId"],
+            "depth": depth(s),
+            "start_ms": (s["startTimeUnixNano"] - t0) / 1e6,
+            "end_ms": (s["endTimeUnixNano"] - t0) / 1e6,
+            "duration_ms": (s["endTimeUnixNano"] - s["startTimeUnixNano"]) / 1e6,
+            "status": s["status"]["code"],
+        })
+    return rows
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[idx]
+
+
+def aggregate(spans: List[Dict] = None) -> List[Dict]:
+    """按 span 名统计 count / p50 / p95 / max (毫秒)，按 p95 降序"""
+    spans = spans if spans is not None else _exporter.snapshot()
+    durations = defaultdict(list)
+    errors = defaultdict(int)
+    for s in spans:
+        durations[s["name"]].append((s["endTimeUnixNano"] - s["startTimeUnixNano"]) / 1e6)
+        if s["status"]["code"] != "OK":
+            errors[s["name"]] += 1
+
+    rows = []
+    for name, values in durations.items():
+        values.sort()
+        rows.append({
+            "name": name,
+            "count": len(values),
+            "p50_ms": round(_percentile(values, 0.5), 1),
+            "p95_ms": round(_percentile(values, 0.95), 1),
+            "max_ms": round(values[-1], 1),
+            "errors": errors[name],
+        })
+    rows.sort(key=lambda r: r["p95_ms"], reverse=True)
+    return rows
+
+
+def load_spans(path: str = TRACE_LOG_PATH) -> List[Dict]:
+    """从 JSONL 读回历史 span (离线分析用)"""
+    spans = []
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    spans.append(json.loads(line))
+    except FileNotFoundError:
+        pass
+    return spans
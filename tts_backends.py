@@ -0,0 +1,124 @@
+"""
+TTS 后端抽象
+
+audio_ops 通过 TTSBackend 接口合成每一个文本片段，默认使用微软 Edge TTS。
+SyntheticTTSBackend 完全离线，按文本长度生成确定性的 PCM/MP3 音频，
+并支持配置延迟与故障注入，用于测试和基准测试音频流水线。
+"""
+import os
+import math
+import array
+import wave
+import random
+import asyncio
+import hashlib
+import edge_tts
+
+
+class TTSBackendError(Exception):
+    """后端合成失败 (包括故障注入)"""
+
+
+class TTSBackend:
+    """
+    TTS 后端基类：把一段文本合成为音频文件
+    子类需要实现 synthesize，并声明输出的 audio_format ("mp3" / "wav")
+    """
+    name = "base"
+    audio_format = "mp3"
+
+    async def synthesize(self, text: str, voice: str, rate: str, output_path: str) -> None:
+        raise NotImplementedError
+
+
+class EdgeTTSBackend(TTSBackend):
+    """微软 Edge TTS (需要网络)"""
+    name = "edge"
+    audio_format = "mp3"
+
+    async def synthesize(self, text, voice, rate, output_path):
+        communicate = edge_tts.Communicate(text, voice, rate=rate)
+        await communicate.save(output_path)
+
+
+class SyntheticTTSBackend(TTSBackend):
+    """
+    离线合成后端：
+    - 时长按语速估算 (chars_per_second)，与真实朗读时长同量级
+    - 音高由文本哈希决定，同样的输入永远得到同样的字节
+    - latency / latency_per_char 模拟网络与合成耗时
+    - failure_rate 按文本哈希确定性地注入失败
+    """
+    name = "synthetic"
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        latency_per_char: float = 0.0,
+        failure_rate: float = 0.0,
+        chars_per_second: float = 14.0,
+        sample_rate: int = 24000,
+        audio_format: str = "wav",
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.latency_per_char = latency_per_char
+        self.failure_rate = failure_rate
+        self.chars_per_second = chars_per_second
+        self.sample_rate = sample_rate
+        self.audio_format = audio_format
+        self.seed = seed
+
+    def _digest(self, text: str) -> int:
+        raw = hashlib.sha256(f"{self.seed}:{text}".encode("utf-8")).digest()
+        return int.from_bytes(raw[:8], "big")
+
+    def render_pcm(self, text: str) -> bytes:
+        """生成 16-bit 单声道 PCM 数据 (整周期平铺，避免逐采样计算)"""
+        digest = self._digest(text)
+        freq = 180 + digest % 240
+        period = max(2, self.sample_rate // freq)
+        one_period = array.array("h", (
+            int(8000 * math.sin(2 * math.pi * i / period)) for i in range(period)
+        )).tobytes()
+
+        duration = max(0.3, len(text) / self.chars_per_second)
+        total_samples = int(duration * self.sample_rate)
+        repeats, rest = divmod(total_samples, period)
+        return one_period * repeats + one_period[: rest * 2]
+
+    async def synthesize(self, text, voice, rate, output_path):
+        delay = self.latency + self.latency_per_char * len(text)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        if self.failure_rate and random.Random(self._digest(text)).random() < self.failure_rate:
+            raise TTSBackendError(f"Injected failure for segment: {text[:20]}...")
+
+        pcm = self.render_pcm(text)
+        if self.audio_format == "wav":
+            with wave.open(output_path, "wb") as wav:
+                wav.setnchannels(1)
+                wav.setsampwidth(2)
+                wav.setframerate(self.sample_rate)
+                wav.writeframes(pcm)
+        else:
+            # MP3 编码依赖 ffmpeg，与正式流水线的环境要求一致
+            from pydub import AudioSegment
+            segment = AudioSegment(pcm, sample_width=2, frame_rate=self.sample_rate, channels=1)
+            segment.export(output_path, format=self.audio_format)
+
+
+BACKENDS = {
+    "edge": EdgeTTSBackend,
+    "synthetic": SyntheticTTSBackend,
+}
+
+
+def get_backend(name: str = None) -> TTSBackend:
+    """按名称创建后端，默认读取环境变量 TTS_BACKEND (edge / synthetic)"""
+    name = (name or os.environ.get("TTS_BACKEND", "edge")).lower()
+    if name not in BACKENDS:
+        print(f"⚠️ Unknown TTS backend '{name}', falling back to edge.")
+        name = "edge"
+    return BACKENDS[name]()
@@ -1,8 +1,11 @@
 import os
 import chromadb
+from datetime import datetime, timezone
 from dotenv import load_dotenv
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, Iterator, List, Tuple
 from langchain_openai import OpenAIEmbeddings 
+from http_pool import get_sync_client, get_async_client
+from tracing import traced
 
 load_dotenv()
 
@@ -20,7 +23,9 @@ class OpenRouterEmbeddingFunction:
             model="text-embedding-3-small",
             openai_api_key=api_key,
             openai_api_base=api_base,
-            check_embedding_ctx_length=False
+            check_embedding_ctx_length=False,
+            http_client=get_sync_client("embeddings"),
+            http_async_client=get_async_client("embeddings")
         )
     # Chroma 需要的 name 属性
     def name(self):
@@ -40,16 +45,15 @@ collection = client.get_or_create_collection(
     embedding_function=EMBEDDING_FUNC
 )
 
-def add_memory(
+def _prepare_memory(
     page_id: str,
-    text: str, 
-    *,
+    text: str,
     title: str = None,
-    domain: str = None, 
+    domain: str = None,
     metadata: Optional[Dict[str, Any]] = None,
-):
+) -> Optional[Tuple[str, Dict[str, str]]]:
     """
-    将页面内容存入向量数据库
+    构造写入向量库的 (embedding 文本, metadata)；内容过短返回 None
     """
     final_metadata = dict(metadata) if metadata else {}
 
@@ -57,19 +61,18 @@ def add_memory(
     final_domain = domain or final_metadata.get("domain") or "General"
 
     if not text or not isinstance(text, str) or len(text.strip()) < 10:
-        print("❌ VectorOps: content too short or missing, skip memory.")
-        return False
+        return None
 
     # ✅ 只保留 domain 作为唯一分类字段
     final_metadata["title"] = final_title
     final_metadata["domain"] = final_domain
     final_metadata["content"] = text[:3000]
     final_metadata.setdefault("url", "")
+    # 对账 (reconcile.py) 用：索引时间晚于 Notion 最后编辑时间的页面无需重新读取
+    final_metadata.setdefault("indexed_at", datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z"))
 
     cleaned_metadata = {k: str(v) for k, v in final_metadata.items() if v is not None}
 
-    print(f"💾 Vectorizing memory: {final_title}...")
-
     summary_text = final_metadata.get("summary", "")
     dense_content = text[:3000].replace("\n", " ")
 
@@ -79,9 +82,32 @@ def add_memory(
         f"Summary: {summary_text}\n"
         f"Snippet: {dense_content}"
     )
+    return embedding_text, cleaned_metadata
+
+
+@traced("vector.add_memory")
+def add_memory(
+    page_id: str,
+    text: str, 
+    *,
+    title: str = None,
+    domain: str = None, 
+    metadata: Optional[Dict[str, Any]] = None,
+):
+    """
+    将页面内容存入向量数据库 (同一 page_id 再次写入时覆盖旧向量)
+    """
+    prepared = _prepare_memory(page_id, text, title, domain, metadata)
+    if prepared is None:
+        print("❌ VectorOps: content too short or missing, skip memory.")
+        return False
+    embedding_text, cleaned_metadata = prepared
+
+    print(f"💾 Vectorizing memory: {cleaned_metadata['title']}...")
 
     try:
-        collection.add(
+        # upsert 而不是 add：add 遇到已存在的 id 会被忽略，覆盖写入后索引仍是旧内容
+        collection.upsert(
             documents=[embedding_text],
             metadatas=[cleaned_metadata],
             ids=[page_id],
@@ -92,6 +118,52 @@ def add_memory(
         print(f"❌ Failed to store vector: {e}")
         return False
 
+
+@traced("vector.upsert_memories")
+def upsert_memories(items: List[Dict[str, Any]]) -> List[str]:
+    """
+    批量写入 (一次 embedding 请求)。items: [{"page_id", "text", "title", "domain", "metadata"}]
+    返回实际写入的 page_id 列表 (内容过短的被跳过)；写入失败时抛出异常。
+    """
+    ids, documents, metadatas = [], [], []
+    for item in items:
+        prepared = _prepare_memory(item["page_id"], item["text"], item.get("title"), item.get("domain"),
+                                   item.get("metadata"))
+        if prepared is None:
+            continue
+        ids.append(item["page_id"])
+        documents.append(prepared[0])
+        metadatas.append(prepared[1])
+    if ids:
+        collection.upsert(documents=documents, metadatas=metadatas, ids=ids)
+    return ids
+
+
+@traced("vector.update_metadata")
+def update_metadata(page_ids: List[str], metadatas: List[Dict[str, Any]]):
+    """只更新 metadata (合并到已有字段)，不重新计算向量"""
+    if page_ids:
+        collection.update(ids=page_ids, metadatas=[{k: str(v) for k, v in m.items()} for m in metadatas])
+
+
+@traced("vector.delete_memories")
+def delete_memories(page_ids: List[str]):
+    if page_ids:
+        collection.delete(ids=page_ids)
+
+
+def iter_all_memories(batch_size: int = 500) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """分页遍历向量库中所有记录 (page_id, metadata)；读取失败时抛出异常"""
+    offset = 0
+    while True:
+        results = collection.get(limit=batch_size, offset=offset, include=["metadatas"])
+        for page_id, meta in zip(results["ids"], results["metadatas"]):
+            yield page_id, meta or {}
+        if len(results["ids"]) < batch_size:
+            break
+        offset += batch_size
+
+@traced("vector.search_memory")
 def search_memory(
     query_text: str,
     n_results: int = 5,
@@ -149,4 +221,77 @@ def search_memory(
 
     except Exception as e:
         print(f"❌ Vector Search Error: {e}")
-        return {"match": False}
\ No newline at end of file
+        return {"match": False}
+
+@traced("vector.search_memories")
+def search_memories(
+    query_text: str,
+    n_results: int = 5,
+    domain: Optional[str] = None,
+    threshold: Optional[float] = None,
+) -> List[Dict[str, Any]]:
+    """
+    返回按距离排序的候选列表 (search_memory 只返回第一个命中)
+    :param threshold: 若提供，只保留距离小于该值的候选
+    """
+    if not isinstance(query_text, str) or len(query_text.strip()) < 2:
+        return []
+
+    query_args = {
+        "query_texts": [query_text],
+        "n_results": n_results
+    }
+    if domain and domain not in ["All", None]:
+        query_args["where"] = {"domain": domain}
+
+    try:
+        results = collection.query(**query_args)
+    except Exception as e:
+        print(f"❌ Vector Search Error: {e}")
+        return []
+
+    if not results["ids"] or len(results["ids"][0]) == 0:
+        return []
+
+    candidates = []
+    for i, page_id in enumerate(results["ids"][0]):
+        dist = results["distances"][0][i]
+        if threshold is not None and dist >= threshold:
+            continue
+        meta = results["metadatas"][0][i] or {}
+        candidates.append({
+            "page_id": page_id,
+            "title": meta.get("title", "Untitled"),
+            "distance": dist,
+            "metadata": meta,
+        })
+    return candidates
+
+
+@traced("vector.list_memories")
+def list_memories(domain: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+    """
+    按 domain 列出已索引的页面 (不做向量检索)，最近写入 / 更新 (indexed_at) 的在前
+    collection.get 不支持排序，只能取出该 domain 的全部 metadata 后在本地排序
+    """
+    get_args = {"include": ["metadatas"]}
+    if domain and domain not in ["All", None]:
+        get_args["where"] = {"domain": domain}
+
+    try:
+        results = collection.get(**get_args)
+    except Exception as e:
+        print(f"❌ Vector List Error: {e}")
+        return []
+
+    items = [
+        {
+            "page_id": page_id,
+            "title": (meta or {}).get("title", "Untitled"),
+            "metadata": meta or {},
+        }
+        for page_id, meta in zip(results["ids"], results["metadatas"])
+    ]
+    # ISO 时间字符串可直接比较；没有 indexed_at 的旧记录排在最后
+    items.sort(key=lambda item: item["metadata"].get("indexed_at", ""), reverse=True)
+    return items[:limit]
@@ -0,0 +1,304 @@
+"""
+持久化后写队列 (Write-Behind Queue)
+
+Notion 写入与向量库同步不再阻塞对话：
+- 任务写入本地 SQLite，进程重启后未完成的任务继续执行
+- 后台 worker 线程池领取任务 (带租约，崩溃的任务到期后会被重新领取)
+- 幂等键：相同内容重复提交只会得到同一个任务 (仅限未完成、或在 WRITE_QUEUE_DEDUP_SECONDS 内完成的任务；
+  更早完成或已进入死信的任务不再拦截，重新提交会新建任务真正再写一次)
+- 失败按指数退避重试，超过次数进入死信 (status = dead)，可手动重放
+- 处理函数可通过 checkpoint() 记录阶段进度，重试时跳过已完成的步骤
+- 同一页面的任务按提交顺序串行执行，旧任务退避重试期间不会被新任务抢先
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from tracing import span
+
+WRITE_QUEUE_ENABLED = os.environ.get("WRITE_QUEUE", "1") != "0"
+WRITE_QUEUE_PATH = os.environ.get("WRITE_QUEUE_PATH", "./write_queue.db")
+WRITE_QUEUE_WORKERS = int(os.environ.get("WRITE_QUEUE_WORKERS", "2"))
+MAX_ATTEMPTS = int(os.environ.get("WRITE_QUEUE_MAX_ATTEMPTS", "5"))
+# 完成后多久内的相同提交仍视为重复 (挡住 LLM 在同一轮里重复调用工具)
+DEDUP_SECONDS = float(os.environ.get("WRITE_QUEUE_DEDUP_SECONDS", "600"))
+BACKOFF_BASE_SECONDS = 2.0      # 第 n 次失败后等待 base * 2^(n-1) 秒
+BACKOFF_MAX_SECONDS = 300.0
+LEASE_SECONDS = 600.0           # 领取后多久没完成视为 worker 已崩溃
+POLL_INTERVAL = 1.0
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_DEAD = "dead"
+
+# handler(payload, state, checkpoint) -> result dict
+JobHandler = Callable[[Dict, Dict, Callable[..., None]], Dict]
+
+
+class PermanentJobError(Exception):
+    """处理函数抛出此异常时不再重试，直接进入死信"""
+
+
+def idempotency_key(kind: str, payload: Dict) -> str:
+    raw = json.dumps({"kind": kind, "payload": payload}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class WriteQueue:
+    def __init__(self, path: str = WRITE_QUEUE_PATH, workers: int = WRITE_QUEUE_WORKERS,
+                 max_attempts: int = MAX_ATTEMPTS):
+        self.path = path
+        self.workers = max(1, workers)
+        self.max_attempts = max(1, max_attempts)
+        self._handlers: Dict[str, JobHandler] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._conn = None
+
+    # ==========================================
+    # 🗄️ 存储
+    # ==========================================
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.executescript(
+                """
+                PRAGMA journal_mode=WAL;
+                PRAGMA synchronous=NORMAL;
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    idempotency_key TEXT UNIQUE NOT NULL,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    state TEXT NOT NULL DEFAULT '{}',
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_run_at REAL NOT NULL,
+                    lease_until REAL,
+                    page_id TEXT,
+                    result TEXT,
+                    last_error TEXT,
+                    created REAL NOT NULL,
+                    updated REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs (status, next_run_at);
+                CREATE INDEX IF NOT EXISTS idx_jobs_page ON jobs (page_id, status);
+                """
+            )
+            self._conn = conn
+        return self._conn
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._db().execute(sql, params)
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        for field in ("payload", "state", "result"):
+            job[field] = json.loads(job[field]) if job[field] else None
+        return job
+
+    # ==========================================
+    # 📮 提交 & 查询
+    # ==========================================
+
+    def register_handler(self, kind: str, handler: JobHandler):
+        """注册处理函数并启动 worker (上次进程遗留的任务随即恢复执行)"""
+        self._handlers[kind] = handler
+        self._ensure_started()
+
+    def enqueue(self, kind: str, payload: Dict, key: str = None, page_id: str = None) -> Dict[str, Any]:
+        """
+        提交任务并立即返回任务记录。
+        幂等键相同的任务仍在排队 / 执行中，或完成不超过 DEDUP_SECONDS 时直接返回它；
+        否则 (更早完成 / 死信) 旧任务让出幂等键，新建一个任务。
+        """
+        self._ensure_started()
+        key = key or idempotency_key(kind, payload)
+        now = time.time()
+        job_id = uuid.uuid4().hex[:12]
+
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute("SELECT * FROM jobs WHERE idempotency_key = ?", (key,)).fetchone()
+                if row is not None and (
+                    row["status"] == STATUS_DEAD or (row["status"] == STATUS_DONE and row["updated"] < now - DEDUP_SECONDS)
+                ):
+                    # 幂等键是 UNIQUE 的：旧任务保留记录，键改名让出
+                    db.execute("UPDATE jobs SET idempotency_key = ? WHERE id = ?", (f"{key}:{row['id']}", row["id"]))
+                    row = None
+                if row is None:
+                    db.execute(
+                        "INSERT INTO jobs (id, idempotency_key, kind, payload, status, next_run_at, page_id, created, updated) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (job_id, key, kind, json.dumps(payload, ensure_ascii=False), STATUS_QUEUED, now, page_id, now, now),
+                    )
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+
+        if row is not None:
+            print(f"♻️ [WriteQueue] Duplicate submission, reusing job {row['id']} ({row['status']})")
+        self._wake.set()
+        return self.get(row["id"] if row is not None else job_id)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def list(self, status: str = None, limit: int = 20) -> List[Dict[str, Any]]:
+        if status:
+            rows = self._execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY created DESC LIMIT ?", (status, limit)
+            ).fetchall()
+        else:
+            rows = self._execute("SELECT * FROM jobs ORDER BY created DESC LIMIT ?", (limit,)).fetchall()
+        return [self._to_dict(r) for r in rows]
+
+    def stats(self) -> Dict[str, int]:
+        rows = self._execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        counts = {STATUS_QUEUED: 0, STATUS_RUNNING: 0, STATUS_DONE: 0, STATUS_DEAD: 0}
+        counts.update({r["status"]: r["n"] for r in rows})
+        return counts
+
+    def retry(self, job_id: str) -> bool:
+        """把死信任务重新排队"""
+        now = time.time()
+        cur = self._execute(
+            "UPDATE jobs SET status = ?, attempts = 0, next_run_at = ?, updated = ? WHERE id = ? AND status = ?",
+            (STATUS_QUEUED, now, now, job_id, STATUS_DEAD),
+        )
+        self._wake.set()
+        return cur.rowcount > 0
+
+    def wait(self, job_id: str, timeout: float = None) -> Optional[Dict[str, Any]]:
+        """阻塞直到任务完成或进入死信 (脚本/测试使用)，超时返回当前状态"""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job["status"] in (STATUS_DONE, STATUS_DEAD):
+                return job
+            if deadline is not None and time.time() >= deadline:
+                return job
+            time.sleep(0.2)
+
+    # ==========================================
+    # ⚙️ Worker
+    # ==========================================
+
+    def _ensure_started(self):
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            for i in range(len(self._threads), self.workers):
+                t = threading.Thread(target=self._worker, name=f"write-queue-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _claim(self) -> Optional[Dict[str, Any]]:
+        """
+        领取一个可执行的任务。同一页面 (page_id 非空) 的任务按提交顺序串行：
+        更早提交的任务还没完成 (排队 / 退避中 / 执行中) 时，后面的任务不可领取，
+        避免两个覆盖写入交错执行，或退避后重试的旧内容覆盖新内容。
+        """
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute(
+                    "SELECT * FROM jobs AS j WHERE ((j.status = ? AND j.next_run_at <= ?) "
+                    "OR (j.status = ? AND j.lease_until < ?)) "
+                    "AND (j.page_id IS NULL OR NOT EXISTS ("
+                    "  SELECT 1 FROM jobs AS e WHERE e.page_id = j.page_id AND e.id != j.id AND e.status IN (?, ?) "
+                    "  AND (e.created < j.created OR (e.created = j.created AND e.id < j.id) "
+                    "       OR (e.status = ? AND e.lease_until >= ?))"
+                    ")) ORDER BY j.next_run_at, j.created LIMIT 1",
+                    (STATUS_QUEUED, now, STATUS_RUNNING, now, STATUS_QUEUED, STATUS_RUNNING, STATUS_RUNNING, now),
+                ).fetchone()
+                if row is not None:
+                    db.execute(
+                        "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_until = ?, updated = ? WHERE id = ?",
+                        (STATUS_RUNNING, now + LEASE_SECONDS, now, row["id"]),
+                    )
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        job = self._to_dict(row)
+        job["attempts"] += 1
+        return job
+
+    def _checkpoint(self, job: Dict[str, Any], **updates):
+        job["state"].update(updates)
+        self._execute(
+            "UPDATE jobs SET state = ?, page_id = COALESCE(?, page_id), updated = ? WHERE id = ?",
+            (json.dumps(job["state"], ensure_ascii=False), updates.get("page_id"), time.time(), job["id"]),
+        )
+
+    def _finish(self, job: Dict[str, Any], result: Dict):
+        result = result or {}
+        self._execute(
+            "UPDATE jobs SET status = ?, result = ?, page_id = COALESCE(?, page_id), last_error = NULL, "
+            "lease_until = NULL, updated = ? WHERE id = ?",
+            (STATUS_DONE, json.dumps(result, ensure_ascii=False), result.get("page_id"), time.time(), job["id"]),
+        )
+        print(f"✅ [WriteQueue] Job {job['id']} done (attempt {job['attempts']}).")
+
+    def _fail(self, job: Dict[str, Any], error: Exception):
+        permanent = isinstance(error, PermanentJobError)
+        now = time.time()
+        if permanent or job["attempts"] >= self.max_attempts:
+            self._execute(
+                "UPDATE jobs SET status = ?, last_error = ?, lease_until = NULL, updated = ? WHERE id = ?",
+                (STATUS_DEAD, str(error), now, job["id"]),
+            )
+            print(f"☠️ [WriteQueue] Job {job['id']} dead-lettered after {job['attempts']} attempts: {error}")
+            return
+        delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (job["attempts"] - 1))
+        self._execute(
+            "UPDATE jobs SET status = ?, last_error = ?, next_run_at = ?, lease_until = NULL, updated = ? WHERE id = ?",
+            (STATUS_QUEUED, str(error), now + delay, now, job["id"]),
+        )
+        print(f"🔁 [WriteQueue] Job {job['id']} failed (attempt {job['attempts']}), retry in {delay:.0f}s: {error}")
+
+    def _worker(self):
+        while True:
+            try:
+                job = self._claim()
+            except Exception as e:
+                print(f"⚠️ [WriteQueue] Claim failed: {e}")
+                job = None
+            if job is None:
+                self._wake.wait(POLL_INTERVAL)
+                self._wake.clear()
+                continue
+
+            handler = self._handlers.get(job["kind"])
+            try:
+                if handler is None:
+                    raise PermanentJobError(f"No handler registered for '{job['kind']}'")
+                with span(f"write_queue.{job['kind']}", job_id=job["id"], attempt=job["attempts"]):
+                    result = handler(job["payload"], job["state"], lambda **kw: self._checkpoint(job, **kw))
+                self._finish(job, result)
+            except Exception as e:
+                self._fail(job, e)
+
+
+write_queue = WriteQueue()